@@ -0,0 +1,183 @@
+"""
+End-to-end benchmark of geo_to_hca over synthetic studies of increasing size.
+
+Each study size runs in a fresh process against a local stub of the remote services, timing every pipeline stage
+from template loading through save_spreadsheet_to_file and recording the peak memory. Results are written as json
+to the results directory and two result files can be compared to spot regressions between versions:
+
+    python -m benchmarks.run_benchmark run --sizes 10 1000
+    python -m benchmarks.run_benchmark compare benchmarks/results/<baseline>.json benchmarks/results/<candidate>.json
+"""
+# --- core imports
+import argparse
+import json
+import logging
+import multiprocessing
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+# --- application imports
+from geo_to_hca import version
+
+DEFAULT_SIZES = [10, 1_000, 10_000, 100_000]
+DEFAULT_RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+
+log = logging.getLogger(__name__)
+
+
+def run_case(n_runs: int, trace_memory: bool = False, nthreads: int = 1, large_study: bool = False,
+             memory_budget_mb: int = None) -> {}:
+    """
+    Runs the whole pipeline for a synthetic study of n_runs runs and returns its timings. Meant to be run in a fresh
+    process so that the peak rss reflects this case only.
+    """
+    from geo_to_hca import geo_to_hca
+    from geo_to_hca import large_study as large_study_mode
+    from geo_to_hca.utils import instrumentation
+    from geo_to_hca.utils import transport
+    from benchmarks.stub_server import StubServer
+    from benchmarks.synthetic import SyntheticStudy
+
+    study = SyntheticStudy(n_runs)
+    recorder = instrumentation.StageRecorder(trace_memory=trace_memory)
+    result = {'n_runs': n_runs, 'accession': study.geo_accession, 'large_study': large_study, 'status': 'ok'}
+    start = time.perf_counter()
+    with StubServer([study]) as stub, tempfile.TemporaryDirectory() as output_dir:
+        try:
+            with instrumentation.recording(recorder):
+                if large_study:
+                    large_study_mode.create_spreadsheet_in_chunks(
+                        study.geo_accession, output_dir, nthreads,
+                        memory_budget_mb=memory_budget_mb or large_study_mode.DEFAULT_MEMORY_BUDGET_MB)
+                else:
+                    workbook = geo_to_hca.create_spreadsheet_using_accession(study.geo_accession, nthreads)
+                    geo_to_hca.save_spreadsheet_to_file(workbook, study.geo_accession, output_dir)
+        except Exception as e:
+            log.exception(e)
+            result['status'] = 'error'
+            result['error'] = str(e)
+        result['requests'] = dict(stub.request_counts)
+        result['concurrency'] = transport.stats()['concurrency']
+    result['total_seconds'] = time.perf_counter() - start
+    result['peak_rss_mb'] = instrumentation.peak_rss_mb()
+    result['stages'] = recorder.as_dict()
+    return result
+
+
+def run_benchmark(sizes: [int], trace_memory: bool = False, nthreads: int = 1, large_study: bool = False,
+                  memory_budget_mb: int = None) -> {}:
+    context = multiprocessing.get_context('spawn')
+    cases = []
+    for n_runs in sizes:
+        log.info(f'benchmarking a synthetic study with {n_runs} runs')
+        # a fresh, non-daemonic worker per case: the pipeline starts its own multiprocessing pool
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            case = executor.submit(run_case, n_runs, trace_memory, nthreads, large_study, memory_budget_mb).result()
+        log.info(f"{n_runs} runs: {case['status']} in {case['total_seconds']:.2f}s, "
+                 f"peak rss {case['peak_rss_mb']:.1f} MiB")
+        cases.append(case)
+    return {
+        'version': version,
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'trace_memory': trace_memory,
+        'large_study': large_study,
+        'cases': cases,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def save_results(results: {}, results_dir: Path) -> Path:
+    results_dir.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%dT%H%M%S')
+    out_file = results_dir / f"{results['version']}_{results['git_commit'] or 'nogit'}_{stamp}.json"
+    out_file.write_text(json.dumps(results, indent=2))
+    return out_file
+
+
+def compare_results(baseline: {}, candidate: {}, threshold: float) -> [str]:
+    """
+    Prints the per stage timings of two benchmark results side by side and returns the list of regressions, i.e. the
+    stages, total times and peak rss values that grew by more than the threshold ratio.
+    """
+    regressions = []
+    baseline_cases = {case['n_runs']: case for case in baseline['cases']}
+    print(f"baseline {baseline['version']} ({baseline['git_commit']}) vs "
+          f"candidate {candidate['version']} ({candidate['git_commit']})")
+    for case in candidate['cases']:
+        old = baseline_cases.get(case['n_runs'])
+        if not old:
+            continue
+        print(f"\n{case['n_runs']} runs")
+        rows = [(stage, old['stages'].get(stage, {}).get('seconds'), timing['seconds'])
+                for stage, timing in case['stages'].items()]
+        rows.append(('total_seconds', old['total_seconds'], case['total_seconds']))
+        rows.append(('peak_rss_mb', old['peak_rss_mb'], case['peak_rss_mb']))
+        for name, old_value, new_value in rows:
+            if not old_value:
+                print(f'  {name:<36} {"-":>10} {new_value:>10.3f}')
+                continue
+            ratio = new_value / old_value
+            flag = ''
+            if ratio > threshold:
+                flag = '  REGRESSION'
+                regressions.append(f"{case['n_runs']} runs: {name} {old_value:.3f} -> {new_value:.3f}")
+            print(f'  {name:<36} {old_value:>10.3f} {new_value:>10.3f} {ratio:>6.2f}x{flag}')
+    return regressions
+
+
+def main():
+    logging.basicConfig(stream=sys.stdout, format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description='geo_to_hca benchmark over synthetic studies')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run the benchmark and store the results')
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                            help='number of runs of each synthetic study')
+    run_parser.add_argument('--nthreads', type=int, default=1, help='number of multiprocessing processes to use')
+    run_parser.add_argument('--trace_memory', action='store_true',
+                            help='also record the peak traced python memory of every stage (slower)')
+    run_parser.add_argument('--large_study', action='store_true',
+                            help='benchmark the bounded-memory large study mode')
+    run_parser.add_argument('--memory_budget', type=int, default=None,
+                            help='memory budget in MiB of the large study mode')
+    run_parser.add_argument('--results_dir', type=Path, default=DEFAULT_RESULTS_DIR,
+                            help='directory where the json results are stored')
+
+    compare_parser = subparsers.add_parser('compare', help='compare two stored benchmark results')
+    compare_parser.add_argument('baseline', type=Path)
+    compare_parser.add_argument('candidate', type=Path)
+    compare_parser.add_argument('--threshold', type=float, default=1.2,
+                                help='ratio above which a slower or bigger candidate is reported as a regression')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        results = run_benchmark(args.sizes, args.trace_memory, args.nthreads, args.large_study, args.memory_budget)
+        out_file = save_results(results, args.results_dir)
+        log.info(f'benchmark results saved to {out_file}')
+    else:
+        regressions = compare_results(json.loads(args.baseline.read_text()),
+                                      json.loads(args.candidate.read_text()),
+                                      args.threshold)
+        if regressions:
+            print('\nregressions:\n' + '\n'.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
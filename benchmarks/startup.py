@@ -0,0 +1,80 @@
+"""
+Startup time benchmark of the geo-to-hca command line.
+
+Times `geo-to-hca --help` in fresh interpreters and checks which heavy third-party modules it imported. The command
+fails when any of them was imported or when the median startup time exceeds --max_seconds, so it can guard the
+entry point against regressions:
+
+    python -m benchmarks.startup --repeat 20 --max_seconds 0.5
+"""
+# --- core imports
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ['pandas', 'numpy', 'openpyxl', 'requests', 'urllib3', 'lxml']
+
+HELP_SCRIPT = f"""
+import json, sys
+sys.argv = ['geo-to-hca', '--help']
+from geo_to_hca import cli
+try:
+    cli.main()
+except SystemExit:
+    pass
+print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]), file=sys.stderr)
+"""
+
+
+def time_help(python: str = sys.executable) -> (float, [str]):
+    """
+    Runs `geo-to-hca --help` in a fresh interpreter. Returns the wall time in seconds and the heavy modules that were
+    imported.
+    """
+    start = time.perf_counter()
+    process = subprocess.run([python, '-c', HELP_SCRIPT], capture_output=True, text=True, check=True)
+    elapsed = time.perf_counter() - start
+    imported = json.loads(process.stderr.strip().splitlines()[-1])
+    return elapsed, imported
+
+
+def time_interpreter(python: str = sys.executable) -> float:
+    start = time.perf_counter()
+    subprocess.run([python, '-c', 'pass'], check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='startup time benchmark of geo-to-hca --help')
+    parser.add_argument('--repeat', type=int, default=10, help='number of timed runs')
+    parser.add_argument('--max_seconds', type=float, default=None,
+                        help='fail when the median startup time is above this many seconds')
+    args = parser.parse_args()
+
+    time_help()  # warm the file system cache and the bytecode of the package
+    timings = []
+    imported = set()
+    for _ in range(args.repeat):
+        elapsed, modules = time_help()
+        timings.append(elapsed)
+        imported.update(modules)
+    median = statistics.median(timings)
+    interpreter = statistics.median(time_interpreter() for _ in range(args.repeat))
+    print(f'geo-to-hca --help: median {median:.3f}s, min {min(timings):.3f}s over {args.repeat} runs '
+          f'(bare interpreter {interpreter:.3f}s)')
+
+    failures = []
+    if imported:
+        failures.append(f"heavy modules imported: {', '.join(sorted(imported))}")
+    if args.max_seconds and median > args.max_seconds:
+        failures.append(f'median startup time {median:.3f}s is above {args.max_seconds:.3f}s')
+    if failures:
+        print('\n'.join(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
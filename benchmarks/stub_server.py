@@ -0,0 +1,273 @@
+"""
+A local stand-in for the NCBI eutils, GEO ftp, ENA portal and EuropePMC endpoints used by geo_to_hca, serving the
+payloads of one or more SyntheticStudy objects.
+"""
+# --- core imports
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# --- application imports
+from geo_to_hca import config
+from benchmarks.synthetic import SyntheticStudy, SyntheticSuperSeries
+
+log = logging.getLogger(__name__)
+
+STUB_CONFIG_FIELDS = ('EUTILS_BASE_URL', 'ENA_PORTAL_API_URL', 'EUROPEPMC_BASE_URL', 'GEO_FTP_HOST', 'IS_INTERACTIVE',
+                      'CACHE_DIR', 'ACCESSION_INDEX')
+
+
+class _StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+    def do_GET(self):
+        self._dispatch({})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode() if length else ''
+        self._dispatch(parse_qs(body))
+
+    def _dispatch(self, form_params):
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        params.update({key: values[-1] for key, values in form_params.items()})
+        endpoint = url.path.rstrip('/').split('/')[-1]
+        with self.server._lock:
+            self.server.request_counts[endpoint] += 1
+            self.server.in_flight += 1
+            throttled = self.server.capacity is not None and self.server.in_flight > self.server.capacity
+        try:
+            if throttled:
+                self.server.count('throttled')
+                self._send(429, 'text/plain', 'too many requests', {'Retry-After': '0.1'})
+                return
+            time.sleep(self.server.latency_seconds)
+            try:
+                status, content_type, payload = self.server.route(url.path, params)
+            except KeyError as e:
+                status, content_type, payload = 404, 'text/plain', f'unknown accession {e}'
+            self._send(status, content_type, payload)
+        finally:
+            with self.server._lock:
+                self.server.in_flight -= 1
+
+    def _send(self, status, content_type, payload, headers: {} = None):
+        body = payload.encode() if isinstance(payload, str) else payload
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            self.server.count('not_modified')
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if status == 200:
+            self.send_header('ETag', etag)
+        if 'gzip' in self.headers.get('Accept-Encoding', '') and len(body) > 1024:
+            body = gzip.compress(body, compresslevel=1)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server._lock:
+            self.server.bytes_sent += len(body)
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, studies: [SyntheticStudy], superseries: [SyntheticSuperSeries] = (), capacity: int = None,
+                 latency_seconds: float = 0.0):
+        super().__init__(('127.0.0.1', 0), _StubRequestHandler)
+        self.studies = list(studies)
+        self.superseries = list(superseries)
+        self.capacity = capacity
+        self.latency_seconds = latency_seconds
+        self.in_flight = 0
+        self.request_counts = Counter()
+        self.bytes_sent = 0
+        self._payloads = {}
+        self._lock = threading.Lock()
+
+    def count(self, name: str) -> None:
+        # requests are handled concurrently, by a thread each
+        with self._lock:
+            self.request_counts[name] += 1
+
+    def _cached(self, key, build):
+        with self._lock:
+            if key not in self._payloads:
+                self._payloads[key] = build()
+            return self._payloads[key]
+
+    def superseries_by_accession(self, accession: str) -> SyntheticSuperSeries:
+        return next((series for series in self.superseries if accession in (series.geo_accession, series.gds_id)),
+                    None)
+
+    def study_by_accession(self, accession: str) -> SyntheticStudy:
+        for study in self.studies:
+            if accession in (study.geo_accession, study.gds_id, study.srp_accession, study.bioproject_accession,
+                             study.pubmed_id):
+                return study
+        number = int(''.join(c for c in accession if c.isdigit()) or 0) // 10_000_000
+        for study in self.studies:
+            if study._prefix == number * 10_000_000:
+                return study
+        raise KeyError(accession)
+
+    def route(self, path, params):
+        if path.endswith('/esearch.fcgi'):
+            return 200, 'application/json', json.dumps({'esearchresult': self._esearch(params)})
+        if path.endswith('/esummary.fcgi'):
+            if 'WebEnv' in params:
+                # the experiments of a study, from the history of its esearch
+                study = self.study_by_accession(params['WebEnv'][len('STUB_'):])
+                return 200, 'application/json', json.dumps(study.sra_esummary_page(int(params.get('retstart', 0)),
+                                                                                   int(params.get('retmax', 20))))
+            accession = params['id']
+            if params.get('db') == 'sra':
+                return 200, 'application/json', json.dumps(self.study_by_accession(accession).sra_esummary(accession))
+            if accession.startswith('GSM'):
+                return 200, 'application/json', json.dumps(self.study_by_accession(accession).gsm_esummary(accession))
+            study = self.superseries_by_accession(accession) or self.study_by_accession(accession)
+            return 200, 'application/json', json.dumps(study.gds_esummary())
+        if path.endswith('_family.soft.gz'):
+            study = self.study_by_accession(path.rsplit('/', 1)[-1].split('_')[0])
+            return 200, 'application/x-gzip', self._cached(('family', study.geo_accession),
+                                                           lambda: gzip.compress(study.geo_family_soft().encode()))
+        if path.endswith('/efetch.fcgi') or path.endswith('/efetch/fcgi'):
+            return self._efetch(params)
+        if path.endswith('/filereport'):
+            study = self.study_by_accession(params['accession'])
+            time.sleep(study.ena_delay_seconds)
+            fields = params.get('fields', 'run_accession,fastq_ftp').split(',')
+            payload = self._cached(('filereport', study.srp_accession, tuple(fields)),
+                                   lambda: study.ena_filereport_tsv(fields))
+            return 200, 'text/plain', payload
+        if path.endswith('/search'):
+            query = params.get('query', '')
+            study = next((s for s in self.studies if s.project_title in query), None)
+            if study is None:
+                return 200, 'application/json', json.dumps({'hitCount': 0, 'resultList': {'result': []}})
+            if params.get('format') == 'json':
+                return 200, 'application/json', json.dumps(study.europepmc_search_json())
+            return 200, 'application/xml', study.europepmc_search_xml()
+        return 404, 'text/plain', f'no stub for {path}'
+
+    def _esearch(self, params):
+        term = params.get('term', '')
+        first_term = term.split(',')[0].strip()
+        superseries = self.superseries_by_accession(first_term)
+        if superseries and params.get('db') == 'gds':
+            return {'count': '1', 'idlist': [superseries.gds_id]}
+        try:
+            study = self.study_by_accession(first_term)
+        except KeyError:
+            return {'count': '0', 'idlist': [], 'errorlist': {'phrasesnotfound': [term]}}
+        if first_term.startswith('GSM') and params.get('db') == 'gds' or first_term.startswith('SRX'):
+            # the esummary of a sample or experiment is served by accession
+            return {'count': '1', 'idlist': [first_term]}
+        if params.get('db') == 'gds':
+            return {'count': '1', 'idlist': [study.gds_id]}
+        # an esearch of a study counts its experiments, as the sra db has an entry per experiment
+        count = len(term.split(',')) if first_term.startswith('SRR') else study.n_experiments
+        return {'count': str(count), 'retmax': '20', 'idlist': [], 'webenv': f'STUB_{study.srp_accession}',
+                'querykey': '1'}
+
+    def _efetch(self, params):
+        db = params.get('db')
+        if params.get('rettype') == 'runinfo':
+            study = self.study_by_accession(params['WebEnv'][len('STUB_'):])
+            return 200, 'text/csv', self._cached(('runinfo', study.srp_accession), study.runinfo_csv)
+        ids = [accession.strip() for accession in params.get('id', '').split(',') if accession.strip()]
+        if db == 'pubmed':
+            studies = {study.pubmed_id: study for study in self.studies}
+            articles = ''.join(studies[pmid].pubmed_article_xml() for pmid in ids if pmid in studies)
+            return 200, 'application/xml', f'<?xml version="1.0" ?>\n<PubmedArticleSet>{articles}</PubmedArticleSet>'
+        study = self.study_by_accession(ids[0] if ids else params['WebEnv'][len('STUB_'):])
+        if db in ('biosample', 'sra'):
+            # the ids of a SuperSeries belong to several studies
+            ids_by_study = {}
+            for accession in ids:
+                ids_by_study.setdefault(self.study_by_accession(accession), []).append(accession)
+            tag, build = ('BioSampleSet', SyntheticStudy.biosample_xml) if db == 'biosample' else \
+                ('EXPERIMENT_PACKAGE_SET', SyntheticStudy.experiment_xml)
+            documents = [build(study, study_ids) for study, study_ids in ids_by_study.items()] or [build(study, [])]
+            bodies = ''.join(document[document.index(f'<{tag}>') + len(tag) + 2:document.rindex(f'</{tag}>')]
+                             for document in documents)
+            return 200, 'application/xml', f'<?xml version="1.0" ?>\n<{tag}>{bodies}</{tag}>'
+        if db == 'bioproject':
+            return 200, 'application/xml', study.bioproject_xml()
+        return 400, 'application/xml', f'<eFetchResult><ERROR>unsupported db {db}</ERROR></eFetchResult>'
+
+
+class StubServer:
+    """
+    Context manager serving the given studies on a random local port. While active, the geo_to_hca config is
+    pointed at the stub (and made non-interactive), and restored on exit.
+
+    Like a busy upstream, the stub can answer 429 (with Retry-After: 0.1) to the requests beyond `capacity` requests in
+    flight, and take latency_seconds to answer each request.
+    """
+    def __init__(self, studies: [SyntheticStudy], superseries: [SyntheticSuperSeries] = (), capacity: int = None,
+                 latency_seconds: float = 0.0):
+        self.server = _StubHTTPServer(studies, superseries, capacity, latency_seconds)
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._saved_env = {}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address
+        return f'http://{host}:{port}'
+
+    @property
+    def request_counts(self) -> Counter:
+        return self.server.request_counts
+
+    @property
+    def bytes_sent(self) -> int:
+        return self.server.bytes_sent
+
+    def __enter__(self):
+        self._thread.start()
+        stub_env = {
+            'EUTILS_BASE_URL': f'{self.base_url}/entrez/eutils',
+            'ENA_PORTAL_API_URL': f'{self.base_url}/ena/portal/api',
+            'EUROPEPMC_BASE_URL': f'{self.base_url}/europepmc/webservices/rest',
+            'GEO_FTP_HOST': self.base_url,
+            'IS_INTERACTIVE': 'false',
+            # the persistent cache is keyed by the stub url, which changes on every run
+            'CACHE_DIR': '',
+            # the synthetic studies are only known to the stub
+            'ACCESSION_INDEX': '',
+        }
+        for field in STUB_CONFIG_FIELDS:
+            self._saved_env[field] = os.environ.get(field)
+            os.environ[field] = stub_env[field]
+        config.reload()
+        return self
+
+    def __exit__(self, *exc_info):
+        for field, value in self._saved_env.items():
+            if value is None:
+                os.environ.pop(field, None)
+            else:
+                os.environ[field] = value
+        config.reload()
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,339 @@
+"""
+Synthetic SRA/ENA/BioSample/pubmed payloads for studies of arbitrary size.
+
+A SyntheticStudy produces the same response formats the tool consumes from NCBI eutils, the GEO ftp, the ENA portal
+api and EuropePMC, so that the whole pipeline can be run against a local stub (see stub_server.py).
+"""
+# --- core imports
+from xml.sax.saxutils import escape
+
+RUNINFO_COLUMNS = ['Run', 'ReleaseDate', 'LoadDate', 'spots', 'bases', 'spots_with_mates', 'avgLength', 'size_MB',
+                   'AssemblyName', 'download_path', 'Experiment', 'LibraryName', 'LibraryStrategy',
+                   'LibrarySelection', 'LibrarySource', 'LibraryLayout', 'InsertSize', 'InsertDev', 'Platform',
+                   'Model', 'SRAStudy', 'BioProject', 'Study_Pubmed_id', 'ProjectID', 'Sample', 'BioSample',
+                   'SampleType', 'TaxID', 'ScientificName', 'SampleName', 'g1k_pop_code', 'source',
+                   'g1k_analysis_group', 'Subject_ID', 'Sex', 'Disease', 'Tumor', 'Affection_Status',
+                   'Analyte_Type', 'Histological_Type', 'Body_Site', 'CenterName', 'Submission',
+                   'dbgap_study_accession', 'Consent', 'RunHash', 'ReadHash']
+
+LIBRARY_CONSTRUCTION_PROTOCOL = "Libraries were prepared with the 10X Chromium Single Cell 3' v2 kit."
+INSTRUMENT_MODEL = 'Illumina NovaSeq 6000'
+READ_TYPES = ('I1', 'R1', 'R2')
+
+
+class SyntheticStudy:
+    """
+    A GEO series with a single SRA study of n_runs runs. Every experiment (GSM/SRX) has runs_per_experiment runs,
+    one per sequencing lane, and its own biosample. Every run has an index, read1 and read2 fastq file. Studies not
+    mirrored by ENA have no fastq files in the ENA file report, and the stub delays the ENA responses of a study by
+    ena_delay_seconds. The GEO series of a study which is not sra_linked only links its samples to the SRA
+    experiments, not the series to the SRA study.
+    """
+    def __init__(self, n_runs: int, study_number: int = 1, runs_per_experiment: int = 2, ena_mirrored: bool = True,
+                 ena_delay_seconds: float = 0.0, sra_linked: bool = True):
+        self.n_runs = n_runs
+        self.sra_linked = sra_linked
+        self.runs_per_experiment = runs_per_experiment
+        self.ena_mirrored = ena_mirrored
+        self.ena_delay_seconds = ena_delay_seconds
+        self.geo_accession = f'GSE9{study_number:05d}'
+        self.gds_id = f'2009{study_number:05d}'
+        self.srp_accession = f'SRP9{study_number:05d}'
+        self.bioproject_accession = f'PRJNA9{study_number:05d}'
+        self.pubmed_id = f'39{study_number:06d}'
+        self.project_title = f'Synthetic single cell atlas {study_number} with {n_runs} runs'
+        self._prefix = 10_000_000 * study_number
+
+    @property
+    def n_experiments(self) -> int:
+        return -(-self.n_runs // self.runs_per_experiment)
+
+    def run_accession(self, i: int) -> str:
+        return f'SRR{self._prefix + i}'
+
+    def experiment_index(self, run_index: int) -> int:
+        return run_index // self.runs_per_experiment
+
+    def experiment_accession(self, e: int) -> str:
+        return f'SRX{self._prefix + e}'
+
+    def biosample_accession(self, e: int) -> str:
+        return f'SAMN{self._prefix + e}'
+
+    def sample_accession(self, e: int) -> str:
+        return f'SRS{self._prefix + e}'
+
+    def sample_name(self, e: int) -> str:
+        return f'GSM{self._prefix + e}'
+
+    def run_accessions(self) -> [str]:
+        return [self.run_accession(i) for i in range(self.n_runs)]
+
+    def fastq_names(self, i: int) -> [str]:
+        e = self.experiment_index(i)
+        lane = i % self.runs_per_experiment + 1
+        return [f'{self.sample_name(e)}_S1_L{lane:03d}_{read}_001.fastq.gz' for read in READ_TYPES]
+
+    # --- eutils payloads
+
+    def runinfo_csv(self) -> str:
+        lines = [','.join(RUNINFO_COLUMNS)]
+        for i in range(self.n_runs):
+            e = self.experiment_index(i)
+            run = self.run_accession(i)
+            values = {
+                'Run': run, 'ReleaseDate': '2021-01-01 00:00:00', 'LoadDate': '2021-01-01 00:00:00',
+                'spots': '250000000', 'bases': '37500000000', 'spots_with_mates': '250000000',
+                'avgLength': '150', 'size_MB': '12000',
+                'download_path': f'https://sra-downloadb.be-md.ncbi.nlm.nih.gov/sos3/sra-pub-run-1/{run}/{run}.1',
+                'Experiment': self.experiment_accession(e), 'LibraryStrategy': 'RNA-Seq',
+                'LibrarySelection': 'cDNA', 'LibrarySource': 'TRANSCRIPTOMIC SINGLE CELL',
+                'LibraryLayout': 'PAIRED', 'InsertSize': '0', 'InsertDev': '0', 'Platform': 'ILLUMINA',
+                'Model': INSTRUMENT_MODEL, 'SRAStudy': self.srp_accession, 'BioProject': self.bioproject_accession,
+                'ProjectID': '900001', 'Sample': self.sample_accession(e), 'BioSample': self.biosample_accession(e),
+                'SampleType': 'simple', 'TaxID': '9606', 'ScientificName': 'Homo sapiens',
+                'SampleName': self.sample_name(e), 'Sex': 'female', 'Disease': '', 'Tumor': 'no',
+                'CenterName': 'GEO', 'Submission': 'SRA900001', 'Consent': 'public',
+                'RunHash': 'D41D8CD98F00B204E9800998ECF8427E', 'ReadHash': 'D41D8CD98F00B204E9800998ECF8427E',
+            }
+            lines.append(','.join(values.get(column, '') for column in RUNINFO_COLUMNS))
+        return '\n'.join(lines) + '\n'
+
+    def biosample_xml(self, accessions: [str]) -> str:
+        parts = ['<?xml version="1.0" ?>\n<BioSampleSet>']
+        for accession in accessions:
+            e = int(accession[len('SAMN'):]) - self._prefix
+            parts.append(
+                f'<BioSample access="public" accession="{accession}">'
+                f'<Ids><Id db="BioSample" is_primary="1">{accession}</Id>'
+                f'<Id db="GEO">{self.sample_name(e)}</Id></Ids>'
+                f'<Description><Title>{self.sample_name(e)} donor {e % 7} lung</Title>'
+                f'<Organism taxonomy_id="9606" taxonomy_name="Homo sapiens"/></Description>'
+                f'<Attributes>'
+                f'<Attribute attribute_name="source_name">lung</Attribute>'
+                f'<Attribute attribute_name="tissue">lung parenchyma</Attribute>'
+                f'<Attribute attribute_name="donor">donor {e % 7}</Attribute>'
+                f'</Attributes></BioSample>')
+        parts.append('</BioSampleSet>')
+        return ''.join(parts)
+
+    def _run_set_xml(self, run_indexes: [int]) -> str:
+        parts = ['<RUN_SET>']
+        for i in run_indexes:
+            run = self.run_accession(i)
+            names = self.fastq_names(i)
+            options = ' '.join(f'--{read.lower()}PairFiles={name}' for read, name in zip(('read1', 'read2'), names[1:]))
+            parts.append(f'<RUN accession="{run}"><RUN_ATTRIBUTES><RUN_ATTRIBUTE><TAG>options</TAG>'
+                         f'<VALUE>{escape(options)}</VALUE></RUN_ATTRIBUTE></RUN_ATTRIBUTES></RUN>')
+        parts.append('</RUN_SET>')
+        return ''.join(parts)
+
+    def _experiment_package_xml(self, e: int, run_indexes: [int]) -> str:
+        return (f'<EXPERIMENT_PACKAGE>'
+                f'<EXPERIMENT accession="{self.experiment_accession(e)}" alias="{self.sample_name(e)}">'
+                f'<STUDY_REF accession="{self.srp_accession}"/>'
+                f'<DESIGN><LIBRARY_DESCRIPTOR><LIBRARY_STRATEGY>RNA-Seq</LIBRARY_STRATEGY>'
+                f'<LIBRARY_CONSTRUCTION_PROTOCOL>{escape(LIBRARY_CONSTRUCTION_PROTOCOL)}'
+                f'</LIBRARY_CONSTRUCTION_PROTOCOL></LIBRARY_DESCRIPTOR></DESIGN>'
+                f'<PLATFORM><ILLUMINA><INSTRUMENT_MODEL>{INSTRUMENT_MODEL}</INSTRUMENT_MODEL></ILLUMINA></PLATFORM>'
+                f'</EXPERIMENT>'
+                f'{self._run_set_xml(run_indexes)}'
+                f'</EXPERIMENT_PACKAGE>')
+
+    def experiment_xml(self, accessions: [str]) -> str:
+        """
+        EXPERIMENT_PACKAGE_SET for a list of experiment (SRX) or run (SRR) accessions.
+        """
+        packages = {}
+        for accession in accessions:
+            number = int(accession[len('SRX'):]) - self._prefix
+            if accession.startswith('SRR'):
+                packages.setdefault(self.experiment_index(number), []).append(number)
+            else:
+                first_run = number * self.runs_per_experiment
+                packages.setdefault(number, []).extend(
+                    range(first_run, min(first_run + self.runs_per_experiment, self.n_runs)))
+        body = ''.join(self._experiment_package_xml(e, runs) for e, runs in packages.items())
+        return f'<?xml version="1.0" ?>\n<EXPERIMENT_PACKAGE_SET>{body}</EXPERIMENT_PACKAGE_SET>'
+
+    def bioproject_xml(self) -> str:
+        return (f'<?xml version="1.0" ?>\n<RecordSet><DocumentSummary uid="900001">'
+                f'<Project><ProjectID><ArchiveID accession="{self.bioproject_accession}" archive="NCBI"/></ProjectID>'
+                f'<ProjectDescr><Name>{escape(self.project_title)}</Name>'
+                f'<Title>{escape(self.project_title)}</Title>'
+                f'<Description>Single cell RNA sequencing of {self.n_experiments} synthetic samples.</Description>'
+                f'<Publication id="{self.pubmed_id}"><Reference>{self.pubmed_id}</Reference>'
+                f'<DbType>ePubmed</DbType></Publication>'
+                f'</ProjectDescr></Project></DocumentSummary></RecordSet>')
+
+    def pubmed_article_xml(self) -> str:
+        authors = ''.join(
+            f'<Author ValidYN="Y"><LastName>Author{n}</LastName><ForeName>First{n}</ForeName>'
+            f'<Initials>F{n}</Initials><AffiliationInfo><Affiliation>Institute {n % 3}</Affiliation>'
+            f'</AffiliationInfo></Author>' for n in range(12))
+        grants = ''.join(f'<Grant><GrantID>G{n:05d}</GrantID><Agency>Funder {n}</Agency></Grant>' for n in range(3))
+        return (f'<PubmedArticle>'
+                f'<MedlineCitation Status="MEDLINE" Owner="NLM"><PMID Version="1">{self.pubmed_id}</PMID>'
+                f'<Article><ArticleTitle>{escape(self.project_title)}.</ArticleTitle>'
+                f'<AuthorList CompleteYN="Y">{authors}</AuthorList>'
+                f'<GrantList CompleteYN="Y">{grants}</GrantList></Article></MedlineCitation>'
+                f'<PubmedData><ArticleIdList><ArticleId IdType="pubmed">{self.pubmed_id}</ArticleId>'
+                f'<ArticleId IdType="doi">10.9999/synthetic.{self.pubmed_id}</ArticleId></ArticleIdList>'
+                f'</PubmedData></PubmedArticle>')
+
+    def pubmed_xml(self) -> str:
+        return f'<?xml version="1.0" ?>\n<PubmedArticleSet>{self.pubmed_article_xml()}</PubmedArticleSet>'
+
+    def gds_esummary(self) -> {}:
+        return {
+            'header': {'type': 'esummary', 'version': '0.3'},
+            'result': {
+                'uids': [self.gds_id],
+                self.gds_id: {
+                    'uid': self.gds_id,
+                    'accession': self.geo_accession,
+                    'gdstype': 'Expression profiling by high throughput sequencing',
+                    'title': self.project_title,
+                    'extrelations': [{'relationtype': 'SRA',
+                                      'targetobject': self.srp_accession,
+                                      'targetftplink': ''}] if self.sra_linked else [],
+                    'samples': [{'accession': self.sample_name(e), 'title': self.sample_name(e)}
+                                for e in range(min(self.n_experiments, 10))],
+                },
+            },
+        }
+
+    def experiment_index_of_sample(self, sample_name: str) -> int:
+        return int(sample_name[len('GSM'):]) - self._prefix
+
+    def gsm_esummary(self, sample_name: str) -> {}:
+        e = self.experiment_index_of_sample(sample_name)
+        return {
+            'header': {'type': 'esummary', 'version': '0.3'},
+            'result': {
+                'uids': [sample_name],
+                sample_name: {
+                    'uid': sample_name,
+                    'accession': sample_name,
+                    'entrytype': 'GSM',
+                    'title': sample_name,
+                    'extrelations': [{'relationtype': 'SRA',
+                                      'targetobject': self.experiment_accession(e),
+                                      'targetftplink': ''}],
+                },
+            },
+        }
+
+    def sra_esummary(self, experiment_accession: str) -> {}:
+        expxml = (f'<Summary><Title>{escape(self.project_title)}</Title></Summary>'
+                  f'<Experiment acc="{experiment_accession}"/>'
+                  f'<Study acc="{self.srp_accession}" name="{escape(self.project_title)}"/>')
+        return {
+            'header': {'type': 'esummary', 'version': '0.3'},
+            'result': {
+                'uids': [experiment_accession],
+                experiment_accession: {'uid': experiment_accession, 'expxml': expxml},
+            },
+        }
+
+    def sra_esummary_page(self, retstart: int, retmax: int) -> {}:
+        experiments = range(retstart, min(retstart + retmax, self.n_experiments))
+        result = {'uids': [str(self._prefix + e) for e in experiments]}
+        for e in experiments:
+            runs = ''.join(f'<Run acc="{self.run_accession(i)}" total_spots="1000" total_bases="150000" '
+                           f'load_done="true" is_public="true" cluster_name="public" static_data_available="true"/>'
+                           for i in range(e * self.runs_per_experiment,
+                                          min((e + 1) * self.runs_per_experiment, self.n_runs)))
+            result[str(self._prefix + e)] = {'uid': str(self._prefix + e),
+                                             'expxml': f'<Experiment acc="{self.experiment_accession(e)}"/>',
+                                             'runs': runs}
+        return {'header': {'type': 'esummary', 'version': '0.3'}, 'result': result}
+
+    def geo_family_soft(self) -> str:
+        lines = ['^DATABASE = GeoMiame', '!Database_name = Gene Expression Omnibus (GEO)',
+                 f'^SERIES = {self.geo_accession}', f'!Series_title = {self.project_title}',
+                 f'!Series_geo_accession = {self.geo_accession}']
+        lines += [f'!Series_sample_id = {self.sample_name(e)}' for e in range(self.n_experiments)]
+        lines.append(f'!Series_relation = BioProject: '
+                     f'https://www.ncbi.nlm.nih.gov/bioproject/{self.bioproject_accession}')
+        if self.sra_linked:
+            lines.append(f'!Series_relation = SRA: https://www.ncbi.nlm.nih.gov/sra?term={self.srp_accession}')
+        lines += ['^PLATFORM = GPL24676', f'!Platform_title = {INSTRUMENT_MODEL} (Homo sapiens)',
+                  '!platform_table_begin', 'ID\tDescription', '!platform_table_end']
+        for e in range(self.n_experiments):
+            lines += [f'^SAMPLE = {self.sample_name(e)}',
+                      f'!Sample_title = synthetic sample {e}',
+                      f'!Sample_geo_accession = {self.sample_name(e)}',
+                      '!Sample_organism_ch1 = Homo sapiens',
+                      '!Sample_characteristics_ch1 = tissue: lung',
+                      f'!Sample_characteristics_ch1 = donor: D{e % 4}',
+                      f'!Sample_relation = BioSample: https://www.ncbi.nlm.nih.gov/biosample/'
+                      f'{self.biosample_accession(e)}',
+                      f'!Sample_relation = SRA: https://www.ncbi.nlm.nih.gov/sra?term={self.experiment_accession(e)}']
+        return '\n'.join(lines) + '\n'
+
+    # --- ENA and EuropePMC payloads
+
+    def ena_filereport_tsv(self, fields: [str]) -> str:
+        lines = ['\t'.join(fields)]
+        for i in range(self.n_runs):
+            run = self.run_accession(i)
+            directory = f'ftp.sra.ebi.ac.uk/vol1/fastq/{run[:6]}/{run[-3:].zfill(3)}/{run}'
+            names = self.fastq_names(i)
+            values = {
+                'run_accession': run,
+                'experiment_accession': self.experiment_accession(self.experiment_index(i)),
+                'sample_accession': self.sample_accession(self.experiment_index(i)),
+                'study_accession': self.bioproject_accession,
+                'secondary_study_accession': self.srp_accession,
+                'fastq_ftp': ';'.join(f'{directory}/{name}' for name in names) if self.ena_mirrored else '',
+                'fastq_bytes': ';'.join(str(1_000_000_000 + n) for n in range(len(names))),
+                'fastq_md5': ';'.join('d41d8cd98f00b204e9800998ecf8427e' for _ in names),
+                'read_count': '250000000',
+                'tax_id': '9606',
+                'scientific_name': 'Homo sapiens',
+                'sample_alias': self.sample_name(self.experiment_index(i)),
+            }
+            lines.append('\t'.join(values.get(field, '') for field in fields))
+        return '\n'.join(lines) + '\n'
+
+    def europepmc_search_xml(self) -> str:
+        return (f'<?xml version="1.0" ?>\n<responseWrapper><hitCount>1</hitCount><resultList>'
+                f'<result><id>{self.pubmed_id}</id><source>MED</source><pmid>{self.pubmed_id}</pmid>'
+                f'<title>{escape(self.project_title)}.</title><journalTitle>Synthetic Biology Letters</journalTitle>'
+                f'</result></resultList></responseWrapper>')
+
+    def europepmc_search_json(self) -> {}:
+        return {'hitCount': 1,
+                'resultList': {'result': [{'id': self.pubmed_id, 'source': 'MED', 'pmid': self.pubmed_id,
+                                           'title': f'{self.project_title}.',
+                                           'journalTitle': 'Synthetic Biology Letters'}]}}
+
+
+class SyntheticSuperSeries:
+    """
+    A GEO SuperSeries of the GEO series of the given studies (its SubSeries). Like real SuperSeries, it is not linked
+    to an SRA study itself.
+    """
+    def __init__(self, studies: [SyntheticStudy], series_number: int = 1):
+        self.studies = list(studies)
+        self.geo_accession = f'GSE8{series_number:05d}'
+        self.gds_id = f'2008{series_number:05d}'
+
+    def gds_esummary(self) -> {}:
+        return {
+            'header': {'type': 'esummary', 'version': '0.3'},
+            'result': {
+                'uids': [self.gds_id],
+                self.gds_id: {
+                    'uid': self.gds_id,
+                    'accession': self.geo_accession,
+                    'gdstype': 'Expression profiling by high throughput sequencing',
+                    'title': f'SuperSeries of {len(self.studies)} synthetic studies',
+                    'relations': [{'relationtype': 'SuperSeries of', 'targetobject': study.geo_accession}
+                                  for study in self.studies],
+                    'extrelations': [],
+                    'samples': [],
+                },
+            },
+        }
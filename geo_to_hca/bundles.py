@@ -0,0 +1,291 @@
+"""
+Two-phase conversion of accessions: the remote data of each accession is fetched into a bundle, from which its
+spreadsheet is rendered later, possibly on another machine and against other templates, without any request.
+
+    geo-to-hca fetch --input_file accessions.txt --bundle_dir bundles/
+    geo-to-hca render --bundle_dir bundles/ --output_dir spreadsheets/
+
+A bundle is a directory named after its accession in the bundle directory, with
+- bundle.json: the accession, its GEO and SRA study accessions and the fastq file names of its runs
+- metadata.sqlite: a metadata store (see metadata_store) with the runs of the accession and their biosamples,
+  experiments, bioproject and publication.
+
+Rendering reads the metadata store of the bundle with config.OFFLINE set, so a spreadsheet is never completed with data
+requested at render time: a bundle lacking data fails with OfflineError. Bundles are rendered in parallel, one process
+per bundle and template, up to the number of cores. A conversion to several templates goes through a temporary bundle
+(see create_spreadsheets), so the metadata of an accession is fetched once whatever the number of templates.
+"""
+# --- core imports
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+# --- third-party imports
+from openpyxl import load_workbook
+
+# --- application imports
+from geo_to_hca import config, version
+from geo_to_hca import geo_to_hca
+from geo_to_hca.cli import DEFAULT_HCA_TEMPLATE
+from geo_to_hca.utils import get_tab
+from geo_to_hca.utils import instrumentation
+from geo_to_hca.utils import metadata_store
+from geo_to_hca.utils import run_report
+from geo_to_hca.utils import utils
+from geo_to_hca.utils.records import FastqFile
+
+BUNDLE_FILE_NAME = 'bundle.json'
+BUNDLE_FORMAT = 1
+# the records of a bundle do not expire: it is rendered as it was fetched, whatever its age
+BUNDLE_TTL_DAYS = 1e6
+
+log = logging.getLogger(__name__)
+
+
+def bundle_path(bundle_dir: str, accession: str) -> str:
+    return os.path.join(bundle_dir, accession)
+
+
+# --- fetch
+
+def fetch_bundle(accession: str, bundle_dir: str) -> str:
+    """
+    Fetches the runs, fastq file names, biosamples, experiments, bioproject and publication of an accession into its
+    bundle, replacing the bundle fetched before. Returns the path of the bundle.
+    """
+    geo_accession, srp_accessions = geo_to_hca.resolve_srp_accessions(accession)
+    runs, fastq_map = geo_to_hca.fetch_studies(srp_accessions)
+    with instrumentation.stage('fetch_biosamples'):
+        biosamples = utils.fetch_experimental_metadata(list(get_tab.index_runs(runs, 'biosample')),
+                                                       accession_type='biosample')
+    with instrumentation.stage('fetch_experiments'):
+        experiments = utils.fetch_experimental_metadata(list(get_tab.index_runs(runs, 'experiment')),
+                                                        accession_type='experiment')
+    # the project tabs describe the bioproject of the first study, see get_tab.get_project_main_tab_xls
+    bioproject = runs[0].bioproject if runs else None
+    project = publication = None
+    with instrumentation.stage('fetch_project'):
+        try:
+            project = utils.get_bioproject_metadata(bioproject)
+            publication = utils.get_pubmed_metadata(project.pubmed_id, iteration=1)
+        except AttributeError:
+            log.info(f'no project metadata for accession {accession}')
+
+    path = bundle_path(bundle_dir, accession)
+    partial_path = f'{path}.partial'
+    shutil.rmtree(partial_path, ignore_errors=True)
+    os.makedirs(partial_path)
+    store = metadata_store.MetadataStore(os.path.join(partial_path, metadata_store.STORE_FILE_NAME))
+    try:
+        store.put_runs(accession, runs)
+        store.put_biosamples(biosamples)
+        store.put_experiments(experiments)
+        if project is not None:
+            store.put_project(bioproject, project)
+            if publication is not None:
+                # also kept without a title, so that rendering does not look the pubmed id up again
+                store.put_publication(project.pubmed_id, publication)
+        # a single file, which is read without writing to the bundle (e.g. on a read-only mount)
+        store.execute('PRAGMA journal_mode=DELETE')
+    finally:
+        store.close()
+    manifest = {
+        'format': BUNDLE_FORMAT,
+        'accession': accession,
+        'geo_accession': geo_accession,
+        'srp_accessions': srp_accessions,
+        'fastq_source': instrumentation.attribute('fastq_source', ''),
+        'fastq_map': {run: [[fastq_file.name, fastq_file.read_index, fastq_file.lane_index]
+                            for fastq_file in fastq_files]
+                      for run, fastq_files in fastq_map.items()} if fastq_map else None,
+        'version': version,
+        'created': datetime.now().isoformat(),
+    }
+    with open(os.path.join(partial_path, BUNDLE_FILE_NAME), 'w') as bundle_file:
+        json.dump(manifest, bundle_file)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(partial_path, path)
+    log.info(f'{accession}: {len(runs)} runs, {len(biosamples)} biosamples and {len(experiments)} experiments '
+             f'fetched to {path}')
+    return path
+
+
+def fetch_bundles(accession_list: [str], bundle_dir: str, output_log: bool = True) -> None:
+    """
+    Fetches the bundle of each accession into bundle_dir, scheduled like the accessions of a conversion (see
+    geo_to_hca.run_batch). Unless output_log is False, a report of the outcome of each accession is written to the
+    bundle directory.
+    """
+    os.makedirs(bundle_dir, exist_ok=True)
+    report = run_report.RunReport()
+    try:
+        geo_to_hca.run_batch(accession_list, lambda accession: fetch_bundle(accession, bundle_dir), report)
+    finally:
+        if output_log and report.accessions:
+            report.write(os.path.join(bundle_dir, run_report.REPORT_FILE_NAME))
+
+
+# --- render
+
+def find_bundles(bundle_dir: str, accessions: [str] = None) -> [str]:
+    """
+    Returns the paths of the bundles in bundle_dir, in the order of their accessions, or of the bundles of the given
+    accessions only.
+    """
+    if accessions:
+        paths = [bundle_path(bundle_dir, accession) for accession in accessions]
+        missing = [path for path in paths if not os.path.isfile(os.path.join(path, BUNDLE_FILE_NAME))]
+        if missing:
+            raise FileNotFoundError(f'no bundles at {", ".join(missing)}: fetch them first')
+        return paths
+    return [bundle_path(bundle_dir, name) for name in sorted(os.listdir(bundle_dir))
+            if os.path.isfile(os.path.join(bundle_dir, name, BUNDLE_FILE_NAME))]
+
+
+def read_bundle(path: str) -> {}:
+    with open(os.path.join(path, BUNDLE_FILE_NAME)) as bundle_file:
+        manifest = json.load(bundle_file)
+    if manifest.get('format') != BUNDLE_FORMAT:
+        raise ValueError(f'{path} is a bundle of format {manifest.get("format")}, {BUNDLE_FORMAT} expected: '
+                         f'fetch it again')
+    return manifest
+
+
+@contextmanager
+def offline(path: str):
+    """
+    Reads the metadata from the bundle at path, and only from there, for the duration of the context: the cache
+    directory is the bundle, its records never expire and no request is sent (config.OFFLINE). Nothing is written to
+    the bundle: its metadata store is opened read-only and the other caches are disabled.
+    """
+    fields = {'CACHE_DIR': path, 'METADATA_STORE': True, 'CACHE_TTL_DAYS': BUNDLE_TTL_DAYS,
+              'NEGATIVE_CACHE_TTL_DAYS': BUNDLE_TTL_DAYS, 'ACCESSION_INDEX': '', 'OFFLINE': True}
+    saved = {field: getattr(config, field) for field in fields}
+    for field, value in fields.items():
+        setattr(config, field, value)
+    try:
+        yield
+    finally:
+        for field, value in saved.items():
+            setattr(config, field, value)
+
+
+def render_bundle(path: str, output_dir: str, hca_template=DEFAULT_HCA_TEMPLATE, name: str = None) -> str:
+    """
+    Renders the spreadsheet of a bundle into output_dir, without any request, named after the accession of the bundle
+    unless a name is given. Returns the path of the spreadsheet.
+    """
+    manifest = read_bundle(path)
+    accession = manifest['accession']
+    with offline(path):
+        try:
+            with instrumentation.stage('load_template'):
+                workbook = load_workbook(filename=hca_template)
+            runs = metadata_store.store().get_runs(accession)
+            if runs is None:
+                raise ValueError(f'no runs in the bundle {path}')
+            fastq_map = {run: [FastqFile(run, *fastq_file) for fastq_file in fastq_files]
+                         for run, fastq_files in manifest['fastq_map'].items()} if manifest['fastq_map'] else None
+            instrumentation.annotate('fastq_source', manifest['fastq_source'])
+            geo_to_hca.render_spreadsheet(workbook, accession, manifest['geo_accession'], manifest['srp_accessions'],
+                                          runs, fastq_map)
+        except Exception as e:
+            raise Exception(f'Error rendering spreadsheet for accession {accession}. {e}') from e
+    return geo_to_hca.save_spreadsheet_to_file(workbook, accession, output_dir, name)
+
+
+def render_executor(processes: int = None) -> ProcessPoolExecutor:
+    """
+    Returns a pool of `processes` processes (the number of cores by default) rendering bundles. Its processes are
+    spawned rather than forked, so the pool can be used while other threads are fetching.
+    """
+    return ProcessPoolExecutor(max_workers=max(1, min(processes or os.cpu_count() or 1, os.cpu_count() or 1)),
+                               mp_context=multiprocessing.get_context('spawn'))
+
+
+def create_spreadsheets(accession: str, output_dir: str, hca_templates: [str],
+                        executor: ProcessPoolExecutor = None) -> [str]:
+    """
+    Fetches the metadata of an accession once, into a temporary bundle, and renders the spreadsheet of each template
+    from it into output_dir, on the processes of the executor (or one after the other without an executor). Returns
+    the paths of the spreadsheets, in the order of the templates.
+    """
+    with tempfile.TemporaryDirectory(prefix=f'{accession}-') as bundle_dir:
+        path = fetch_bundle(accession, bundle_dir)
+        with instrumentation.stage('render_templates'):
+            names = [geo_to_hca.spreadsheet_name(accession, hca_template, hca_templates)
+                     for hca_template in hca_templates]
+            if executor is None:
+                return [render_bundle(path, output_dir, hca_template, name)
+                        for hca_template, name in zip(hca_templates, names)]
+            futures = [executor.submit(render_bundle, path, output_dir, hca_template, name)
+                       for hca_template, name in zip(hca_templates, names)]
+            return [future.result() for future in futures]
+
+
+def _render_bundle_recorded(path: str, output_dir: str, hca_template, name: str) -> {}:
+    """
+    Renders a bundle (in a worker process) and returns the outcome for the run report.
+    """
+    recorder = instrumentation.StageRecorder()
+    start = time.perf_counter()
+    outcome = {'accession': os.path.basename(os.path.normpath(path)), 'recorder': recorder}
+    try:
+        with instrumentation.recording(recorder):
+            outcome['out_file'] = render_bundle(path, output_dir, hca_template, name)
+        outcome['status'] = 'done'
+    except Exception as e:
+        log.exception(e)
+        outcome['status'] = 'failed'
+        outcome['error'] = str(e)
+    outcome['seconds'] = time.perf_counter() - start
+    return outcome
+
+
+def render_bundles(bundle_paths: [str], output_dir: str, hca_template=DEFAULT_HCA_TEMPLATE, processes: int = None,
+                   output_log: bool = True) -> None:
+    """
+    Renders the spreadsheets of bundles into output_dir, in parallel on `processes` processes (the number of cores by
+    default). hca_template can be a list of templates, each rendered from every bundle (see
+    geo_to_hca.spreadsheet_name). Every bundle is rendered even if some fail; the failures are raised at the end.
+    Unless output_log is False, a report of the outcome of each bundle is written to the output directory.
+    """
+    templates = geo_to_hca.template_list(hca_template)
+    jobs = [(path, output_dir, template,
+             geo_to_hca.spreadsheet_name(os.path.basename(os.path.normpath(path)), template, templates))
+            for path in bundle_paths for template in templates]
+    processes = max(1, min(processes or os.cpu_count() or 1, len(jobs) or 1))
+    report = run_report.RunReport()
+    try:
+        if processes == 1:
+            outcomes = [_render_bundle_recorded(*job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                outcomes = [future.result() for future in
+                            [executor.submit(_render_bundle_recorded, *job) for job in jobs]]
+        for start in range(0, len(outcomes), len(templates)):
+            _report(report, outcomes[start:start + len(templates)])
+    finally:
+        if output_log and report.accessions:
+            report.write(os.path.join(output_dir, run_report.REPORT_FILE_NAME))
+    failed = [entry.accession for entry in report.accessions if entry.status != 'done']
+    if failed:
+        raise Exception(f'{len(failed)} of {len(bundle_paths)} bundles could not be rendered: {", ".join(failed)}')
+
+
+def _report(report: run_report.RunReport, outcomes: [{}]) -> None:
+    """
+    Adds the outcome of the rendering of a bundle to the report, from the outcomes of its templates.
+    """
+    failed = [outcome for outcome in outcomes if outcome['status'] != 'done']
+    report.add(outcomes[0]['accession'], 'failed' if failed else 'done',
+               sum(outcome['seconds'] for outcome in outcomes), outcomes[0]['recorder'],
+               out_file=', '.join(outcome['out_file'] for outcome in outcomes if 'out_file' in outcome),
+               error='; '.join(outcome['error'] for outcome in failed))
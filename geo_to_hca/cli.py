@@ -0,0 +1,238 @@
+"""
+Command line entry point of geo_to_hca.
+
+This module only depends on the standard library so that `geo-to-hca --help` and argument validation errors return
+quickly: the pipeline modules, which import pandas, openpyxl and requests, are imported once the arguments are valid.
+"""
+# --- core imports
+import argparse
+import csv
+import logging
+import os
+from pathlib import Path
+import sys
+
+# --- application imports
+from geo_to_hca import version, config
+from geo_to_hca.utils.scheduling import SCHEDULES
+
+DEFAULT_HCA_TEMPLATE = Path(__file__).resolve().parents[1] / "template/hca_template.xlsx"
+log = logging.getLogger(__name__)
+
+
+def check_list_str(values: str) -> []:
+    """
+    Checks if an input accession list is a list of comma-separated strings (accessions). Returns a list
+    of accessions if True.
+    """
+    if "," not in values:
+        raise argparse.ArgumentTypeError("Argument list not valid: comma separated list required")
+    return values.split(',')
+
+
+def check_bool(value: str) -> bool:
+    """
+    Checks if an input value is a boolean (true/false, yes/no or 1/0) and returns it as a bool.
+    """
+    if value.lower() in ['true', 'yes', '1']:
+        return True
+    if value.lower() in ['false', 'no', '0']:
+        return False
+    raise argparse.ArgumentTypeError("%s is not a valid boolean: true or false required" % (value))
+
+
+def check_file(path: str) -> []:
+    """
+    Checks if an input file with a list of accessions is in the required format. The file should consist of a
+    single column (list) of accessions with the column name "accession".
+    """
+    if not os.path.exists(path):
+        raise argparse.ArgumentTypeError("file %s does not exist" % (path))
+    try:
+        with open(path, newline='') as input_file:
+            rows = list(csv.DictReader(input_file, delimiter="\t"))
+    except (OSError, UnicodeDecodeError, csv.Error):
+        raise argparse.ArgumentTypeError("file %s is not a valid format" % (path))
+    try:
+        geo_accession_list = [row["accession"] for row in rows]
+    except KeyError:
+        raise argparse.ArgumentTypeError("accession list column not found in file %s" % (path))
+    return geo_accession_list
+
+
+def prepare_logging(level=None):
+    if not level:
+        if config.DEBUG:
+            level = logging.DEBUG
+    if not level:
+        level = logging.INFO
+
+    logging.basicConfig(stream=sys.stdout, format='%(asctime)s - %(levelname)s - %(message)s', level=level)
+
+    def handle_exception(exc_type, exc_value, exc_traceback):
+        if issubclass(exc_type, KeyboardInterrupt):
+            sys.__excepthook__(exc_type, exc_value, exc_traceback)
+            return
+
+        log.error("Exception", exc_info=(exc_type, exc_value, exc_traceback))
+
+    sys.excepthook = handle_exception
+
+
+def accession_arguments(argument_default=None) -> argparse.ArgumentParser:
+    """
+    Returns the parser of the options giving the accessions to process, shared by the commands.
+    """
+    parser = argparse.ArgumentParser(add_help=False, argument_default=argument_default)
+    parser.add_argument('--accession', type=str, help='accession (str): either GEO or SRA accession')
+    parser.add_argument('--accession_list', type=check_list_str, help='accession list (comma separated)')
+    parser.add_argument('--input_file', type=check_file, help='optional path to tab-delimited input .txt file')
+    return parser
+
+
+def fetch_arguments(argument_default=None) -> argparse.ArgumentParser:
+    """
+    Returns the parser of the options of the commands fetching metadata.
+    """
+    parser = argparse.ArgumentParser(add_help=False, argument_default=argument_default)
+    parser.add_argument('--schedule', choices=SCHEDULES,
+                        help='order in which the accessions are processed, after a probe of their number of runs: '
+                             'smallest studies first, largest first or in input order (default BATCH_SCHEDULE, '
+                             'smallest); studies of LARGE_STUDY_RUNS runs or more are processed on a lane of their own')
+    parser.add_argument('--deadline', type=float,
+                        help='seconds an accession may take before it is recorded as timed out in the output log and '
+                             'the next accession is processed (default ACCESSION_DEADLINE_SECONDS, 3600; 0: no limit)')
+    parser.add_argument('--recheck_negative', action='store_true',
+                        help='look up again the accessions, terms and pubmed ids which were recently not found '
+                             '(by default they fail immediately for NEGATIVE_CACHE_TTL_DAYS days)')
+    parser.add_argument('--metadata_store', action='store_true',
+                        help='keep the runs, experiments, biosamples, bioprojects and publications fetched in CACHE_DIR '
+                             'and reuse them in later runs for CACHE_TTL_DAYS days (30), without checking whether '
+                             'they were updated upstream (default METADATA_STORE, false)')
+    return parser
+
+
+def get_accession_list(args: argparse.Namespace) -> []:
+    if args.input_file:
+        return args.input_file
+    if args.accession_list:
+        return args.accession_list
+    if args.accession:
+        return [args.accession]
+    return None
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Returns the parser of the command line arguments, with the fetch and render subcommands.
+    """
+    parser = argparse.ArgumentParser(parents=[accession_arguments(), fetch_arguments()])
+    parser.add_argument('--nthreads', type=int, default=1,
+                        help='number of multiprocessing processes to use')
+    parser.add_argument('--template', nargs='+', default=[DEFAULT_HCA_TEMPLATE],
+                        help='path to an HCA spreadsheet template (xlsx), or several templates: the metadata is '
+                             'fetched once and <accession>_<template name>.xlsx is written for each template')
+    parser.add_argument('--header_row', type=int, default=4,
+                        help='header row with HCA programmatic names')
+    parser.add_argument('--input_row1', type=int, default=6,
+                        help='HCA metadata input start row')
+    parser.add_argument('--output_dir', default='spreadsheets/',
+                        help='path to output directory; if it does not exist, the directory will be created')
+    parser.add_argument('--output_log', type=check_bool, default=True,
+                        help='True/False: should the output result log (geo_to_hca_report.tsv, in the output '
+                             'directory) be created')
+    parser.add_argument('--large_study', action='store_true',
+                        help='process the runs of each study in chunks within a memory budget, streaming the rows '
+                             'to the output spreadsheet (rows are not sorted and template cell styles are not kept)')
+    parser.add_argument('--memory_budget', type=int, default=None,
+                        help='memory budget in MiB for --large_study (default 2048)')
+    parser.add_argument('--chunk_size', type=int, default=None,
+                        help='number of runs per chunk for --large_study (default: derived from the memory budget)')
+
+    # the options shared with the main command may also be given before a subcommand (e.g. --accession GSE1 fetch):
+    # the subcommands leave them unset unless they are given after it, rather than resetting them to their defaults
+    subparsers = parser.add_subparsers(dest='command', metavar='{fetch,render}',
+                                       help='optional: fetch the metadata of accessions to bundles, or render '
+                                            'spreadsheets from bundles without network access')
+    fetch_parser = subparsers.add_parser('fetch', argument_default=argparse.SUPPRESS,
+                                         parents=[accession_arguments(argparse.SUPPRESS),
+                                                  fetch_arguments(argparse.SUPPRESS)],
+                                         help='fetch the metadata of accessions to bundles (one directory per '
+                                              'accession in --bundle_dir)')
+    fetch_parser.add_argument('--bundle_dir', default='bundles/', help='directory of the bundles')
+    fetch_parser.add_argument('--output_log', type=check_bool,
+                              help='True/False: should the output result log be created in the bundle directory')
+    render_parser = subparsers.add_parser('render', argument_default=argparse.SUPPRESS,
+                                          parents=[accession_arguments(argparse.SUPPRESS)],
+                                          help='render the spreadsheets of bundles, of all bundles in --bundle_dir '
+                                               'unless accessions are given')
+    render_parser.add_argument('--bundle_dir', default='bundles/', help='directory of the bundles')
+    render_parser.add_argument('--template', nargs='+',
+                               help='path to an HCA spreadsheet template (xlsx), or several templates, each '
+                                    'rendered from every bundle')
+    render_parser.add_argument('--output_dir',
+                               help='path to output directory; if it does not exist, the directory will be created')
+    render_parser.add_argument('--processes', type=int, default=None,
+                               help='number of bundles rendered in parallel (default: the number of cores)')
+    render_parser.add_argument('--output_log', type=check_bool,
+                               help='True/False: should the output result log be created in the output directory')
+    return parser
+
+
+def main():
+    config.reload()
+    prepare_logging()
+    log.info(f'using {__package__}-{version}')
+    """
+    Parse user-provided command-line arguments.
+    """
+    args = build_parser().parse_args()
+
+    """
+    Check user-provided command-line arguments are valid.
+    """
+    accession_list = get_accession_list(args)
+    if accession_list is None and args.command != 'render':
+        raise ValueError("GEO or SRA accession input must be specified")
+
+    if getattr(args, 'recheck_negative', False):
+        config.RECHECK_NEGATIVE = True
+    if getattr(args, 'metadata_store', False):
+        config.METADATA_STORE = True
+    if getattr(args, 'schedule', None):
+        config.BATCH_SCHEDULE = args.schedule
+    if getattr(args, 'deadline', None) is not None:
+        config.ACCESSION_DEADLINE_SECONDS = args.deadline
+
+    if args.command == 'fetch':
+        from geo_to_hca import bundles
+        bundles.fetch_bundles(accession_list, args.bundle_dir, args.output_log)
+        return
+    if args.command == 'render':
+        from geo_to_hca import bundles
+        bundle_paths = bundles.find_bundles(args.bundle_dir, accession_list)
+        if not bundle_paths:
+            raise ValueError(f"no bundles in {args.bundle_dir}: run geo-to-hca fetch first")
+        os.makedirs(args.output_dir, exist_ok=True)
+        bundles.render_bundles(bundle_paths, args.output_dir, args.template, args.processes, args.output_log)
+        return
+
+    log.info(f"Using the HCA template file specified at: {', '.join(map(str, args.template))}")
+
+    if not os.path.exists(args.output_dir):
+        os.mkdir(args.output_dir)
+
+    # the pipeline imports pandas, openpyxl and requests: only load it once there is work to do
+    from geo_to_hca import geo_to_hca
+
+    try:
+        geo_to_hca.create_spreadsheet_using_accessions(accession_list, args.output_dir, args.nthreads, args.template,
+                                                       args.large_study, args.memory_budget, args.chunk_size,
+                                                       args.output_log)
+    except Exception as e:
+        log.exception(e)
+        raise RuntimeError from e
+
+
+if __name__ == "__main__":
+    main()
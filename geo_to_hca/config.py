@@ -17,6 +17,72 @@ class Config:
     EUTILS_HOST: str = 'https://eutils.ncbi.nlm.nih.gov'
     EUTILS_BASE_URL: str = f'{EUTILS_HOST}/entrez/eutils'
     NCBI_WEB_HOST: str = 'https://www.ncbi.nlm.nih.gov'
+    GEO_FTP_HOST: str = 'https://ftp.ncbi.nlm.nih.gov'
+    ENA_PORTAL_API_URL: str = 'https://www.ebi.ac.uk/ena/portal/api'
+    EUROPEPMC_BASE_URL: str = 'https://www.ebi.ac.uk/europepmc/webservices/rest'
+    # eutils allows 3 calls per second without an api key
+    EUTILS_RATE_LIMIT: float = 3.0
+    HTTP_POOL_SIZE: int = 10
+    # requests fail when the connection is not established, or no data is received, within these timeouts
+    HTTP_CONNECT_TIMEOUT_SECONDS: float = 10.0
+    HTTP_READ_TIMEOUT_SECONDS: float = 120.0
+    # in-flight requests per host: the limit starts at HTTP_CONCURRENCY_INITIAL and adapts within the bounds, cut on
+    # 429/503 answers or when the latency rises above HTTP_LATENCY_TOLERANCE times the usual latency of the host
+    HTTP_CONCURRENCY_INITIAL: int = 4
+    HTTP_CONCURRENCY_MIN: int = 1
+    HTTP_CONCURRENCY_MAX: int = 10
+    HTTP_LATENCY_TOLERANCE: float = 2.0
+    # requests answered 429/503 are retried after Retry-After or an exponential backoff
+    HTTP_RETRIES: int = 3
+    HTTP_RETRY_BACKOFF_SECONDS: float = 0.5
+    # order of the accessions of a batch (smallest, largest or input) and number of runs from which a study is
+    # processed on a lane of its own, alongside the smaller ones (0: a single lane)
+    BATCH_SCHEDULE: str = 'smallest'
+    LARGE_STUDY_RUNS: int = 10000
+    # wall-clock time an accession may take before it is recorded as timed out and the batch moves on (0: no limit)
+    ACCESSION_DEADLINE_SECONDS: float = 3600.0
+    # number of requests sent concurrently when a lookup is split in chunks, e.g. of SRA_RUN_CHUNK_SIZE runs
+    FETCH_WORKERS: int = 4
+    SRA_RUN_CHUNK_SIZE: int = 200
+    # time ENA has to answer with the fastq file names of a study before they are also requested from SRA
+    ENA_HEAD_START_SECONDS: float = 1.0
+    # bounds of the number of ids per efetch request, sized from the responses to take about EFETCH_TARGET_SECONDS
+    # and at most EFETCH_TARGET_MB each
+    EFETCH_CHUNK_MIN: int = 20
+    EFETCH_CHUNK_MAX: int = 500
+    EFETCH_TARGET_SECONDS: float = 5.0
+    EFETCH_TARGET_MB: float = 8.0
+    # efetch ids are sent in the body of a POST request when longer than this (urls are limited to a few kB)
+    EFETCH_POST_MIN_LENGTH: int = 2000
+    # processes saving the spreadsheets of a batch while the next accessions are fetched (0: saved in turn), and the
+    # number of spreadsheets which may wait for them
+    WRITER_PROCESSES: int = 1
+    WRITER_QUEUE_SIZE: int = 2
+    RESPONSE_CACHE_MB: int = 64
+    # persistent cache of lookups reused across runs (e.g. EuropePMC searches); an empty CACHE_DIR disables it
+    CACHE_DIR: str = os.path.join('~', '.cache', 'geo_to_hca')
+    CACHE_TTL_DAYS: float = 30.0
+    # lookups which failed (e.g. GEO accessions without an SRA study) fail immediately for this long, unless
+    # RECHECK_NEGATIVE (--recheck_negative) is set
+    NEGATIVE_CACHE_TTL_DAYS: float = 7.0
+    RECHECK_NEGATIVE: bool = 'false'
+    # cached http responses younger than this are reused without asking the server whether they changed
+    HTTP_CACHE_FRESH_HOURS: float = 24.0
+    # when a run opens the caches, the responses not revalidated for HTTP_CACHE_MAX_AGE_DAYS days are removed, then the
+    # oldest ones beyond HTTP_CACHE_MAX_MB; lookups older than CACHE_TTL_DAYS and NEGATIVE_CACHE_TTL_DAYS are removed
+    HTTP_CACHE_MAX_AGE_DAYS: float = 30.0
+    HTTP_CACHE_MAX_MB: int = 1024
+    # metadata of studies (runs, experiments, biosamples, bioprojects, publications) stored in CACHE_DIR by a run and
+    # reused by later runs for CACHE_TTL_DAYS days, without checking whether it was updated upstream (--metadata_store)
+    METADATA_STORE: bool = 'false'
+    EUROPEPMC_PAGE_SIZE: int = 5
+    # no request is sent, e.g. while rendering spreadsheets from bundles (geo-to-hca render)
+    OFFLINE: bool = 'false'
+    # local index of accessions imported from NCBI/ENA dump files (geo-to-hca-index), used when the file exists
+    ACCESSION_INDEX: str = os.path.join('~', '.cache', 'geo_to_hca', 'accession_index.sqlite')
+    # how the GEO samples of a series without an SRA study relation are linked to SRA experiments: an esummary per
+    # sample (esummary) or the series family file downloaded once from GEO_FTP_HOST (family)
+    GEO_SAMPLE_SOURCE: str = 'esummary'
 
     def __init__(self, env):
         self.load(env)
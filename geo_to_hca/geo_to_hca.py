@@ -1,83 +1,167 @@
 # --- core imports
-import argparse
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import ExitStack
+import contextvars
 from datetime import datetime
 import logging
 import os
-from pathlib import Path
-import sys
+import threading
+import time
 
 # --- third-party imports
-import pandas as pd
 from openpyxl import load_workbook, Workbook
 
 # --- application imports
-from geo_to_hca import version, config
+from geo_to_hca import config, version
+# the command line entry point lives in cli, which is kept light on imports
+from geo_to_hca.cli import DEFAULT_HCA_TEMPLATE, main, prepare_logging
+from geo_to_hca.utils import deadline
 from geo_to_hca.utils import get_tab
+from geo_to_hca.utils import instrumentation
 from geo_to_hca.utils import parse_reads
+from geo_to_hca.utils import run_report
+from geo_to_hca.utils import scheduling
+from geo_to_hca.utils import spreadsheet_writer
 from geo_to_hca.utils import sra_utils
 from geo_to_hca.utils import utils
+from geo_to_hca.utils.records import FastqFile, Run
 
-DEFAULT_HCA_TEMPLATE = Path(__file__).resolve().parents[1] / "template/hca_template.xlsx"
 log = logging.getLogger(__name__)
 
 
 def fetch_fastq_names(srp_accession: str, srr_accessions: []) -> {}:
     """
-    Function to try and get fastq file names from the SRA database or if not available, from the ENA
-    database, given a list of SRA run accessions. It also tests if the number of fastq files per run
+    Function to try and get fastq file names from the ENA database or if not available, from the SRA database,
+    given a SRA study accession and its list of SRA run accessions. It also tests if the number of fastq files per run
     accession meets the hca metadata standard requirements.
+
+    The ENA file names are used whenever they meet the requirements. SRA is queried as soon as ENA answers without
+    them or, if ENA is slow, after ENA has had config.ENA_HEAD_START_SECONDS to answer; the SRA lookup is cancelled
+    once ENA answers with file names meeting the requirements. The source of the file names (ENA, SRA or none) is
+    recorded as the fastq_source attribute of the run.
     """
+    fastq_map, fastq_source = _fetch_fastq_names(srp_accession, srr_accessions)
+    instrumentation.annotate('fastq_source', fastq_source)
+    return fastq_map
+
+
+def _fetch_fastq_names(srp_accession: str, srr_accessions: []) -> [{}, str]:
     """
-    Takes as input a single SRA Study accession.
+    Races the ENA and SRA lookups of fetch_fastq_names. Returns the fastq file names and their source.
     """
-    fastq_map = parse_reads.request_fastq_from_ENA(srp_accession)
-    fastq_map = utils.test_number_fastq_files(fastq_map)
-    if not fastq_map:
+    ena_answered = threading.Event()
+    cancel_sra = threading.Event()
+
+    def fetch_from_ENA():
+        """
+        Takes as input a single SRA Study accession.
+        """
+        try:
+            fastq_map = utils.test_number_fastq_files(parse_reads.request_fastq_from_ENA(srp_accession))
+            if fastq_map:
+                cancel_sra.set()
+            return fastq_map
+        finally:
+            ena_answered.set()
+
+    def fetch_from_SRA():
         """
         Takes as input a list of SRA Run accessions.
         """
-        fastq_map = parse_reads.get_fastq_from_SRA(srr_accessions)
-        fastq_map = utils.test_number_fastq_files(fastq_map)
-    return fastq_map
+        ena_answered.wait(config.ENA_HEAD_START_SECONDS)
+        return parse_reads.get_fastq_from_SRA(srr_accessions, cancelled=cancel_sra)
+
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='fastq-names')
+    try:
+        ena = executor.submit(deadline.propagate(fetch_from_ENA))
+        sra = executor.submit(deadline.propagate(fetch_from_SRA))
+        fastq_map = ena.result()
+        if fastq_map:
+            fastq_source = 'ENA'
+        else:
+            fastq_map = utils.test_number_fastq_files(sra.result())
+            fastq_source = 'SRA' if fastq_map else 'none'
+    finally:
+        # a running SRA lookup stops at its next chunk or experiment package, without holding up the caller
+        cancel_sra.set()
+        executor.shutdown(wait=False)
+    log.info(f'fastq file names of SRA study ID {srp_accession} from: {fastq_source}')
+    return fastq_map, fastq_source
+
+
+def fetch_study(srp_accession: str) -> [[Run], {}, str]:
+    """
+    Fetches the runs of an SRA study and the fastq file names of the runs. Returns the runs, the fastq file names
+    and their source.
+    """
+    log.info(f"Fetching study metadata for SRA study ID: {srp_accession}")
+    with instrumentation.stage('get_srp_metadata'):
+        runs = sra_utils.get_study_runs(srp_accession)
+    log.info(f"Fetching fastq file names for SRA study ID: {srp_accession}")
+    with instrumentation.stage('fetch_fastq_names'):
+        fastq_map, fastq_source = _fetch_fastq_names(srp_accession, [run.accession for run in runs])
+    return runs, fastq_map, fastq_source
 
 
-def integrate_metadata(srp_metadata: pd.DataFrame, fastq_map: {}, cols: []) -> pd.DataFrame:
+def fetch_studies(srp_accessions: [str]) -> [[Run], {}]:
+    """
+    Fetches the runs and fastq file names of the SRA studies of an accession, e.g. of the SubSeries of a GEO
+    SuperSeries, concurrently (up to config.FETCH_WORKERS studies at a time). Returns the runs of all studies, in the
+    order of the studies and without duplicates, and their fastq file names merged into one map.
+    """
+    if len(srp_accessions) == 1:
+        studies = [fetch_study(srp_accessions[0])]
+    else:
+        # the stages and attributes of every study are recorded by the recorder of the accession
+        contexts = [contextvars.copy_context() for _ in srp_accessions]
+        with ThreadPoolExecutor(max_workers=max(1, min(config.FETCH_WORKERS, len(srp_accessions))),
+                                thread_name_prefix='studies') as executor:
+            studies = list(executor.map(lambda context, srp_accession: context.run(fetch_study, srp_accession),
+                                        contexts, srp_accessions))
+    runs = {}
+    fastq_map = {}
+    for study_runs, study_fastq_map, _ in studies:
+        for run in study_runs:
+            runs.setdefault(run.accession, run)
+        if study_fastq_map:
+            fastq_map.update(study_fastq_map)
+    fastq_sources = list(dict.fromkeys(fastq_source for _, _, fastq_source in studies))
+    instrumentation.annotate('fastq_source', ','.join(fastq_sources))
+    if len(srp_accessions) > 1:
+        log.info(f'{len(runs)} runs of SRA study IDs {", ".join(srp_accessions)} merged')
+    return list(runs.values()), fastq_map or None
+
+
+def integrate_metadata(runs: [Run], fastq_map: {}) -> [(Run, FastqFile)]:
     """
-    Integrates an input dataframe including study, sample, experiment and run accessions with extracted
-    fastq file names which are stored in the input fastq_map dictionary. It uses the run accessions
-    (dictionary keys) to map the fastq file names to the study metadata accessions in the dataframe.
+    Integrates the runs of a study, including study, sample, experiment and run accessions, with the fastq files
+    which are stored in the input fastq_map dictionary. It uses the run accessions (dictionary keys) to map the fastq
+    files to the runs: returns a (run, fastq file) pair per fastq file of each run, or a single (run, None) pair if
+    no fastq file is available for the run.
     """
-    srp_metadata_update = pd.DataFrame()
-    for _, row in srp_metadata.iterrows():
-        srr_accession = row['Run']
-        if not fastq_map or srr_accession not in fastq_map.keys():
-            new_row = row.to_list()
-            new_row.extend(['', '', ''])
-            a_series = pd.Series(new_row)
-            srp_metadata_update = srp_metadata_update.append(a_series, ignore_index=True)
+    run_files = []
+    for run in runs:
+        if not fastq_map or run.accession not in fastq_map.keys():
+            run_files.append((run, None))
         else:
-            filenames_list = fastq_map[srr_accession]
-            for file in filenames_list:
-                lane_index = parse_reads.get_lane_index(file)
-                if lane_index:
-                    g = lane_index.group()
-                    lane_index = g.split("_")[1]
-                else:
-                    lane_index = ''
-                new_row = row.to_list()
-                new_row.extend([file, parse_reads.get_file_index(file), lane_index])
-                a_series = pd.Series(new_row)
-                srp_metadata_update = srp_metadata_update.append(a_series, ignore_index=True)
-    cols.extend(['fastq_name', 'file_index', 'lane_index'])
-    srp_metadata_update.columns = cols
-    return srp_metadata_update
-
-
-def save_spreadsheet_to_file(workbook: Workbook, accession: str, output_dir: str):
+            run_files.extend((run, fastq_file) for fastq_file in fastq_map[run.accession])
+    return run_files
+
+
+def save_spreadsheet_to_file(workbook: Workbook, accession: str, output_dir: str, name: str = None,
+                             writer: spreadsheet_writer.SpreadsheetWriter = None):
+    """
+    Saves the workbook of an accession to output_dir and returns the path of the file. With a writer, the workbook is
+    queued to be saved by a writer process and a future of the path is returned.
+    """
     log.info(f"Done. Saving workbook to excel file")
-    out_file = f"{output_dir}/{accession}.xlsx"
+    out_file = f"{output_dir}/{name or accession}.xlsx"
     set_workbook_properties(accession, workbook)
-    workbook.save(out_file)
+    if writer is not None:
+        return writer.submit(workbook, out_file)
+    with instrumentation.stage('save_spreadsheet_to_file'):
+        workbook.save(out_file)
+    return out_file
 
 
 def set_workbook_properties(accession, workbook):
@@ -90,221 +174,331 @@ def set_workbook_properties(accession, workbook):
     workbook.properties.modified = datetime.now()
 
 
-def create_spreadsheet_using_accession(accession, nthreads=1, hca_template=DEFAULT_HCA_TEMPLATE):
-    try:
-        workbook = load_workbook(filename=hca_template)
+def resolve_srp_accession(accession: str) -> [str, str]:
+    """
+    Check the study accession type. Is it a GEO database study accession or SRA study accession? if GEO, fetch the
+    SRA study accession from the GEO accession. Returns the GEO accession (or None) and the (first) SRA study
+    accession.
+    """
+    geo_accession, srp_accessions = resolve_srp_accessions(accession)
+    return geo_accession, srp_accessions[0]
 
-        """
-        Initialise a study accession string.
-        """
-        srp_accession = None
-        geo_accession = None
 
-        """
-        Check the study accession type. Is it a GEO database study accession or SRA study accession? if GEO, fetch the
-        SRA study accession from the GEO accession.
-        """
+def resolve_srp_accessions(accession: str) -> [str, [str]]:
+    """
+    Like resolve_srp_accession, but returns all the SRA study accessions of the accession, e.g. those of the SubSeries
+    of a GEO SuperSeries.
+    """
+    srp_accessions = []
+    geo_accession = None
 
-        if 'GSE' in accession:
-            geo_accession = accession
-            log.info(f"Fetching SRA study ID for GEO dataset {accession}")
-            srp_accession = sra_utils.get_srp_accession_from_geo(accession)
-            log.info(f"Found SRA study ID: {srp_accession}")
-        elif 'SRP' in accession or 'ERP' in accession:
-            srp_accession = accession
+    if 'GSE' in accession:
+        geo_accession = accession
+        log.info(f"Fetching SRA study ID for GEO dataset {accession}")
+        with instrumentation.stage('get_srp_accession_from_geo'):
+            srp_accessions = sra_utils.get_srp_accessions_from_geo(accession)
+        log.info(f"Found SRA study ID: {', '.join(srp_accessions)}")
+    elif 'SRP' in accession or 'ERP' in accession:
+        srp_accessions = [accession]
 
-        if not srp_accession:
-            raise Exception(f"No SRA study accession is available")
+    if not srp_accessions:
+        raise Exception(f"No SRA study accession is available")
+    return geo_accession, srp_accessions
 
-        """
-        Fetch the SRA study metadata for the srp accession.
-        """
-        log.info(f"Fetching study metadata for SRA study ID: {srp_accession}")
-        srp_metadata = sra_utils.get_srp_metadata(srp_accession)
 
-        """
-        Save the column names for later.
-        """
-        cols = srp_metadata.columns.tolist()
+def estimate_accession_size(accession: str) -> int:
+    """
+    Returns the approximate number of runs of the SRA studies of an accession, e.g. to schedule the accessions of a
+    batch. The lookups resolving a GEO accession are cached, so they are not repeated when the accession is processed.
+    """
+    _, srp_accessions = resolve_srp_accessions(accession)
+    return sum(sra_utils.get_study_size(srp_accession) for srp_accession in srp_accessions)
 
-        """
-        Fetch the fastq file names associated with the list of SRA study run accessions.
-        """
-        log.info(f"Fetching fastq file names for SRA study ID: {srp_accession}")
-        fastq_map = fetch_fastq_names(srp_accession, list(srp_metadata['Run']))
 
-        """
-        Record whether both read1 and read2 fastq files are available for the run accessions in the study.
-        """
-        if not fastq_map:
-            log.info(f"Both Read1 and Read2 fastq files are not available for SRA study ID: {srp_accession}")
+def create_spreadsheet_using_accession(accession, nthreads=1, hca_template=DEFAULT_HCA_TEMPLATE, template_workbook=None):
+    """
+    Retrieves the metadata of a study accession and returns the HCA metadata spreadsheet (workbook). The template is
+    loaded from hca_template, unless a workbook freshly loaded from the template is given (template_workbook).
+    """
+    try:
+        with instrumentation.stage('load_template'):
+            workbook = template_workbook
+            if workbook is None:
+                workbook = load_workbook(filename=hca_template)
 
-        else:
-            log.info(f"Found fastq files for SRA study ID: {srp_accession}")
+        geo_accession, srp_accessions = resolve_srp_accessions(accession)
 
         """
-        Integrate metadata and fastq file names into a single dataframe.
+        Fetch the SRA study metadata and the fastq file names associated with the list of SRA study run accessions,
+        for each srp accession.
         """
-        log.info(f"Integrating study metadata and fastq file names")
-        srp_metadata_update = integrate_metadata(srp_metadata, fastq_map, cols)
+        runs, fastq_map = fetch_studies(srp_accessions)
+        return render_spreadsheet(workbook, accession, geo_accession, srp_accessions, runs, fastq_map, nthreads)
+    except Exception as e:
+        raise Exception(f'Error creating spreadsheet for accession {accession}. {e}') from e
 
-        """
-        Get HCA Sequence file metadata: fetch as many fields as is possible using the above metadata accessions.
-        """
-        log.info(f"Getting Sequence file tab")
-        sequence_file_tab = get_tab.get_sequence_file_tab_xls(srp_metadata_update, workbook,
+
+def render_spreadsheet(workbook: Workbook, accession: str, geo_accession: str, srp_accessions: [str], runs: [Run],
+                       fastq_map: {}, nthreads: int = 1) -> Workbook:
+    """
+    Fills the tabs of the HCA metadata spreadsheet (workbook) of an accession from the runs of its SRA studies and
+    their fastq file names. The biosample, experiment, bioproject and publication metadata of the runs are read from
+    the metadata store or fetched (see geo_to_hca.bundles to render from data fetched beforehand). Returns the workbook.
+    """
+    srp_accession = ', '.join(srp_accessions)
+    """
+    Record whether both read1 and read2 fastq files are available for the run accessions in the study.
+    """
+    if not fastq_map:
+        log.info(f"Both Read1 and Read2 fastq files are not available for SRA study ID: {srp_accession}")
+
+    else:
+        log.info(f"Found fastq files for SRA study ID: {srp_accession}")
+
+    """
+    Integrate the runs and their fastq files.
+    """
+    log.info(f"Integrating study metadata and fastq file names")
+    with instrumentation.stage('integrate_metadata'):
+        run_files = integrate_metadata(runs, fastq_map)
+
+    """
+    Get HCA Sequence file metadata: fetch as many fields as is possible using the above metadata accessions.
+    """
+    log.info(f"Getting Sequence file tab")
+    with instrumentation.stage('sequence_file_tab'):
+        sequence_file_tab = get_tab.get_sequence_file_tab_xls(run_files, workbook,
                                                               tab_name="Sequence file")
 
-        """
-        Get HCA Cell suspension metadata: fetch as many fields as is possible using the above metadata accessions.
-        """
-        log.info(f"Getting Cell suspension tab")
-        get_tab.get_cell_suspension_tab_xls(srp_metadata_update, workbook, tab_name="Cell suspension")
+    """
+    Get HCA Cell suspension metadata: fetch as many fields as is possible using the above metadata accessions.
+    """
+    log.info(f"Getting Cell suspension tab")
+    with instrumentation.stage('cell_suspension_tab'):
+        get_tab.get_cell_suspension_tab_xls(runs, workbook, tab_name="Cell suspension")
 
-        """
-        Get HCA Specimen from organism metadata: fetch as many fields as is possible using the above metadata accessions.
-        """
-        log.info(f"Getting Specimen from Organism tab")
-        get_tab.get_specimen_from_organism_tab_xls(srp_metadata_update, workbook, nthreads,
+    """
+    Get HCA Specimen from organism metadata: fetch as many fields as is possible using the above metadata accessions.
+    """
+    log.info(f"Getting Specimen from Organism tab")
+    with instrumentation.stage('specimen_from_organism_tab'):
+        get_tab.get_specimen_from_organism_tab_xls(runs, workbook, nthreads,
                                                    tab_name="Specimen from organism")
 
-        """
-        Get HCA Library preparation protocol metadata: fetch as many fields as is possible using the above metadata accessions.
-        """
-        log.info(f"Getting Library preparation protocol tab")
-        library_protocol_dict, attribute_lists = get_tab.get_library_protocol_tab_xls(srp_metadata_update, workbook,
-                                                                                      tab_name="Library preparation protocol")
+    """
+    Get HCA Library preparation protocol metadata: fetch as many fields as is possible using the above metadata accessions.
+    """
+    log.info(f"Getting Library preparation protocol tab")
+    with instrumentation.stage('library_preparation_protocol_tab'):
+        library_protocol_ids, experiments = get_tab.get_library_protocol_tab_xls(runs, workbook,
+                                                                                 tab_name="Library preparation protocol")
 
-        """
-        Get HCA Sequencing protocol metadata: fetch as many fields as is possible using the above metadata accessions.
-        """
-        log.info(f"Getting Sequencing protocol tab")
-        sequencing_protocol_dict = get_tab.get_sequencing_protocol_tab_xls(workbook, attribute_lists,
-                                                                           tab_name="Sequencing protocol")
+    """
+    Get HCA Sequencing protocol metadata: fetch as many fields as is possible using the above metadata accessions.
+    """
+    log.info(f"Getting Sequencing protocol tab")
+    with instrumentation.stage('sequencing_protocol_tab'):
+        sequencing_protocol_ids = get_tab.get_sequencing_protocol_tab_xls(workbook, experiments,
+                                                                          tab_name="Sequencing protocol")
 
-        """
-        Update HCA Sequence file metadata with the correct library preparation protocol ids and sequencing protocol ids.
-        """
-        log.info(f"Updating Sequencing file tab with protocol ids")
-        get_tab.update_sequence_file_tab_xls(sequence_file_tab, library_protocol_dict, sequencing_protocol_dict,
+    """
+    Update HCA Sequence file metadata with the correct library preparation protocol ids and sequencing protocol ids.
+    """
+    log.info(f"Updating Sequencing file tab with protocol ids")
+    with instrumentation.stage('update_sequence_file_tab'):
+        get_tab.update_sequence_file_tab_xls(sequence_file_tab, library_protocol_ids, sequencing_protocol_ids,
                                              workbook, tab_name="Sequence file")
 
+    """
+    Get Project metadata: fetch as many fields as is possible using the above metadata accessions.
+    """
+    log.info(f"Getting project metadata")
+    with instrumentation.stage('project_tab'):
+        project = get_tab.get_project_main_tab_xls(runs, workbook, geo_accession, tab_name="Project")
+
+    try:
         """
-        Get Project metadata: fetch as many fields as is possible using the above metadata accessions.
+        Get Project - Publications metadata: fetch as many fields as is possible using the above metadata accessions.
         """
-        log.info(f"Getting project metadata")
-        project_name, project_title, project_description, project_pubmed_id = get_tab.get_project_main_tab_xls(
-            srp_metadata_update, workbook, geo_accession, tab_name="Project")
-
-        try:
-            """
-            Get Project - Publications metadata: fetch as many fields as is possible using the above metadata accessions.
-            """
+        with instrumentation.stage('project_publications_tab'):
             get_tab.get_project_publication_tab_xls(workbook, tab_name="Project - Publications",
-                                                    project_pubmed_id=project_pubmed_id)
-        except AttributeError:
-            log.info(f'Publication attribute error with accession {accession}')
+                                                    project_pubmed_id=project.pubmed_id)
+    except AttributeError:
+        log.info(f'Publication attribute error with accession {accession}')
 
-        try:
-            """
-            Get Project - Contributors metadata: fetch as many fields as is possible using the above metadata accessions.
-            """
+    try:
+        """
+        Get Project - Contributors metadata: fetch as many fields as is possible using the above metadata accessions.
+        """
+        with instrumentation.stage('project_contributors_tab'):
             get_tab.get_project_contributors_tab_xls(workbook, tab_name="Project - Contributors",
-                                                     project_pubmed_id=project_pubmed_id)
-        except AttributeError:
-            log.info(f'Contributors attribute error with accession {accession}')
+                                                     project_pubmed_id=project.pubmed_id)
+    except AttributeError:
+        log.info(f'Contributors attribute error with accession {accession}')
 
-        try:
-            """
-            Get Project - Funders metadata: fetch as many fields as is possible using the above metadata accessions.
-            """
+    try:
+        """
+        Get Project - Funders metadata: fetch as many fields as is possible using the above metadata accessions.
+        """
+        with instrumentation.stage('project_funders_tab'):
             get_tab.get_project_funders_tab_xls(workbook, tab_name="Project - Funders",
-                                                project_pubmed_id=project_pubmed_id)
-        except AttributeError:
-            log.info(f'Funders attribute error with accession {accession}')
-        return workbook
-    except Exception as e:
-        raise Exception(f'Error creating spreadsheet for accession {accession}. {e}') from e
+                                                project_pubmed_id=project.pubmed_id)
+    except AttributeError:
+        log.info(f'Funders attribute error with accession {accession}')
+    return workbook
 
 
-def create_spreadsheet_using_accessions(accession_list, output_dir: str, nthreads=1,
-                                        hca_template=DEFAULT_HCA_TEMPLATE):
+def template_list(hca_template) -> [str]:
     """
-    For each study accession provided, retrieve the relevant metadata from the SRA, ENA and EuropePMC databases and write to an
-    HCA metadata spreadsheet.
+    Returns the templates to render, given a template or a list of templates. Raises ValueError if two templates have
+    the same file name, as their spreadsheets would overwrite each other.
     """
-    for accession in accession_list:
-        workbook = create_spreadsheet_using_accession(accession, nthreads, hca_template)
-        save_spreadsheet_to_file(workbook, accession, output_dir)
+    templates = [hca_template] if isinstance(hca_template, (str, os.PathLike)) else list(hca_template)
+    names = [template_name(template) for template in templates]
+    if not templates or len(set(names)) < len(names):
+        raise ValueError(f'templates with distinct file names expected: {", ".join(map(str, templates))}')
+    return templates
 
 
-def prepare_logging(level=None):
-    if not level:
-        if config.DEBUG:
-            level = logging.DEBUG
-    if not level:
-        level = logging.INFO
+def template_name(hca_template: str) -> str:
+    return os.path.splitext(os.path.basename(hca_template))[0]
 
-    logging.basicConfig(stream=sys.stdout, format='%(asctime)s - %(levelname)s - %(message)s', level=level)
 
-    def handle_exception(exc_type, exc_value, exc_traceback):
-        if issubclass(exc_type, KeyboardInterrupt):
-            sys.__excepthook__(exc_type, exc_value, exc_traceback)
-            return
-
-        log.error("Exception", exc_info=(exc_type, exc_value, exc_traceback))
-
-    sys.excepthook = handle_exception
+def spreadsheet_name(accession: str, hca_template: str, templates: [str]) -> str:
+    """
+    Returns the name of the spreadsheet of an accession rendered from a template: the accession, followed by the name
+    of the template when several templates are rendered.
+    """
+    return accession if len(templates) < 2 else f'{accession}_{template_name(hca_template)}'
 
 
-def main():
-    config.reload()
-    prepare_logging()
-    log.info(f'using {__package__}-{version}')
+def create_spreadsheet_using_accessions(accession_list, output_dir: str, nthreads=1,
+                                        hca_template=DEFAULT_HCA_TEMPLATE, large_study=False,
+                                        memory_budget_mb=None, chunk_size=None, output_log=True):
     """
-    Parse user-provided command-line arguments.
+    For each study accession provided, retrieve the relevant metadata from the SRA, ENA and EuropePMC databases and write to an
+    HCA metadata spreadsheet. In large study mode the runs of each study are processed in chunks within a memory budget.
+    Unless output_log is False, a report of the outcome of each accession is written to the output directory.
+    The accessions are scheduled and processed as described in run_batch.
+
+    hca_template can be a list of templates: the metadata of each accession is then fetched once and a spreadsheet
+    named <accession>_<template name>.xlsx is rendered from it for each template, in parallel (see
+    bundles.create_spreadsheets). Otherwise, in a batch of several accessions, the workbooks are saved by
+    config.WRITER_PROCESSES writer processes while the next accessions are fetched (see spreadsheet_writer).
     """
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--accession', type=str, help='accession (str): either GEO or SRA accession')
-    parser.add_argument('--accession_list', type=utils.check_list_str, help='accession list (comma separated)')
-    parser.add_argument('--input_file', type=utils.check_file, help='optional path to tab-delimited input .txt file')
-    parser.add_argument('--nthreads', type=int, default=1,
-                        help='number of multiprocessing processes to use')
-    parser.add_argument('--template', default=DEFAULT_HCA_TEMPLATE,
-                        help='path to an HCA spreadsheet template (xlsx)')
-    parser.add_argument('--header_row', type=int, default=4,
-                        help='header row with HCA programmatic names')
-    parser.add_argument('--input_row1', type=int, default=6,
-                        help='HCA metadata input start row')
-    parser.add_argument('--output_dir', default='spreadsheets/',
-                        help='path to output directory; if it does not exist, the directory will be created')
-    parser.add_argument('--output_log', type=bool, default=True,
-                        help='True/False: should the output result log be created')
+    templates = template_list(hca_template)
+    if large_study:
+        if len(templates) > 1:
+            raise ValueError('large study mode renders a single template')
+        from geo_to_hca import large_study as large_study_mode
+        memory_budget_mb = memory_budget_mb or large_study_mode.DEFAULT_MEMORY_BUDGET_MB
+
+    with ExitStack() as stack:
+        if len(templates) > 1:
+            from geo_to_hca import bundles
+            executor = stack.enter_context(bundles.render_executor(len(templates)))
+        writer = None
+        if not large_study and len(templates) == 1 and config.WRITER_PROCESSES > 0 and len(accession_list) > 1:
+            writer = stack.enter_context(spreadsheet_writer.SpreadsheetWriter(templates[0], config.WRITER_PROCESSES,
+                                                                              config.WRITER_QUEUE_SIZE))
+
+        def create_spreadsheet(accession):
+            if large_study:
+                return large_study_mode.create_spreadsheet_in_chunks(accession, output_dir, nthreads, templates[0],
+                                                                     memory_budget_mb, chunk_size)
+            if len(templates) > 1:
+                return ', '.join(bundles.create_spreadsheets(accession, output_dir, templates, executor))
+            workbook = create_spreadsheet_using_accession(accession, nthreads, templates[0])
+            return save_spreadsheet_to_file(workbook, accession, output_dir, writer=writer)
+
+        report = run_report.RunReport()
+        try:
+            run_batch(accession_list, create_spreadsheet, report)
+        finally:
+            if output_log and report.accessions:
+                report.write(os.path.join(output_dir, run_report.REPORT_FILE_NAME))
 
-    args = parser.parse_args()
 
+def run_batch(accession_list: [str], process, report: run_report.RunReport) -> None:
     """
-    Check user-provided command-line arguments are valid.
-    """
-    if args.input_file:
-        accession_list = args.input_file
-    elif args.accession_list:
-        accession_list = args.accession_list
-    elif args.accession:
-        accession_list = [args.accession]
-    else:
-        raise ValueError("GEO or SRA accession input must be specified")
+    Runs process(accession), which returns the file it wrote, for each accession of a batch and adds the outcome of
+    each accession to the report, in the order the accessions were completed.
 
-    log.info(f"Using the HCA template file specified at: {args.template}")
+    Each accession has config.ACCESSION_DEADLINE_SECONDS to complete: when it takes longer, its requests and stages are
+    cancelled, it is reported as timed out and the batch moves on to the next accession.
 
-    if not os.path.exists(args.output_dir):
-        os.mkdir(args.output_dir)
+    The accessions are processed in the order of config.BATCH_SCHEDULE (smallest studies first by default), after a
+    probe of their size, and the studies with at least config.LARGE_STUDY_RUNS runs on a lane of their own, alongside
+    the others (see scheduling). When an accession fails, no other accession is started and the error is raised once
+    the accession of the other lane is completed.
 
+    process can also return a future of the file, e.g. when the file is written by a writer process: the outcome of
+    the accession is then completed once the future is done, after the last accession of the batch was processed.
+    """
+    failed = threading.Event()
+    pending = []
+    # time each file written in the background was completed, rather than when the batch got to report it
+    written_at = {}
+
+    def process_accession(accession):
+        recorder = instrumentation.StageRecorder()
+        start = time.perf_counter()
+        with deadline.scope(config.ACCESSION_DEADLINE_SECONDS) as accession_deadline:
+            try:
+                with instrumentation.recording(recorder):
+                    out_file = process(accession)
+            except Exception as e:
+                if accession_deadline is None or not accession_deadline.expired():
+                    report.add(accession, 'failed', time.perf_counter() - start, recorder, error=str(e))
+                    raise
+                log.error(f'{accession} timed out after {accession_deadline.seconds:g}s: {e}')
+                report.add(accession, 'timed out', time.perf_counter() - start, recorder, error=str(e))
+                return
+        if isinstance(out_file, Future):
+            # reported in the order the accessions were processed, completed once the file is written
+            out_file.add_done_callback(lambda written: written_at.setdefault(written, time.perf_counter()))
+            pending.append((accession, start, report.add(accession, 'writing', time.perf_counter() - start, recorder),
+                            out_file))
+            return
+        report.add(accession, 'done', time.perf_counter() - start, recorder, out_file=out_file)
+
+    def report_written() -> [Exception]:
+        errors = []
+        for accession, start, entry, written in pending:
+            try:
+                entry.out_file = written.result()
+                entry.status = 'done'
+            except Exception as e:
+                log.error(f'{accession}: the spreadsheet could not be written: {e}')
+                entry.status, entry.error = 'failed', str(e)
+                errors.append(e)
+            # the callbacks of a future run just after its result is available
+            entry.seconds = round(written_at.get(written, time.perf_counter()) - start, 3)
+        return errors
+
+    def run_lane(accessions):
+        for accession in accessions:
+            if failed.is_set():
+                return
+            try:
+                process_accession(accession)
+            except Exception:
+                failed.set()
+                raise
+
+    small_studies, large_studies = scheduling.plan(accession_list, estimate_accession_size)
     try:
-        create_spreadsheet_using_accessions(accession_list, args.output_dir, args.nthreads, args.template)
-    except Exception as e:
-        log.exception(e)
-        raise RuntimeError from e
+        if not large_studies:
+            run_lane(small_studies)
+        else:
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix='large-studies') as executor:
+                large_studies_lane = executor.submit(run_lane, large_studies)
+                run_lane(small_studies)
+                large_studies_lane.result()
+    finally:
+        write_errors = report_written()
+    if write_errors:
+        raise write_errors[0]
 
 
 if __name__ == "__main__":
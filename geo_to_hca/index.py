@@ -0,0 +1,67 @@
+"""
+Builds and queries the local accession index (see geo_to_hca.utils.accession_index):
+
+    geo-to-hca-index import SRA_Accessions.tab read_run.tsv
+    geo-to-hca-index lookup GSE97168 GSE124872
+
+lookup prints the SRA studies of each GEO series as tab-delimited lines, without going to NCBI.
+"""
+# --- core imports
+import argparse
+import logging
+import os
+import sys
+
+# --- application imports
+from geo_to_hca import config
+from geo_to_hca.cli import prepare_logging
+from geo_to_hca.utils import accession_index
+
+log = logging.getLogger(__name__)
+
+
+def import_files(paths: [str]) -> {}:
+    index = accession_index.index(create=True)
+    for path in paths:
+        index.import_file(path)
+    stats = index.stats()
+    log.info(f'{index.path} indexes {stats["studies"]} studies, {stats["experiments"]} experiments '
+             f'and {stats["runs"]} runs')
+    return stats
+
+
+def lookup(geo_accessions: [str], out=sys.stdout) -> {}:
+    index = accession_index.index()
+    if not index:
+        raise SystemExit(f'the accession index {config.ACCESSION_INDEX} was not built: run geo-to-hca-index import')
+    studies = index.studies_for_geo_accessions(geo_accessions)
+    for geo_accession, srp_accessions in studies.items():
+        out.write(f'{geo_accession}\t{",".join(srp_accessions)}\n')
+    return studies
+
+
+def main():
+    config.reload()
+    prepare_logging()
+    parser = argparse.ArgumentParser(description='local index of GEO/SRA accessions built from NCBI and ENA dumps')
+    parser.add_argument('--index', default=config.ACCESSION_INDEX,
+                        help='path to the index (sqlite); ACCESSION_INDEX by default')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    import_parser = subparsers.add_parser('import', help='import SRA_Accessions.tab files or ENA read_run reports')
+    import_parser.add_argument('paths', nargs='+', help='tab-delimited dump files')
+    lookup_parser = subparsers.add_parser('lookup', help='print the SRA studies of GEO series')
+    lookup_parser.add_argument('accessions', nargs='+', help='GEO series accessions')
+    args = parser.parse_args()
+
+    config.ACCESSION_INDEX = args.index
+    if args.command == 'import':
+        missing = [path for path in args.paths if not os.path.isfile(path)]
+        if missing:
+            parser.error(f'no such files: {", ".join(missing)}')
+        import_files(args.paths)
+    else:
+        lookup(args.accessions)
+
+
+if __name__ == "__main__":
+    main()
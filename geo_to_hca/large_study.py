@@ -0,0 +1,225 @@
+"""
+Bounded-memory processing of very large studies.
+
+Instead of loading the whole run info table, integrating every fastq file and building every tab in memory before
+writing the workbook, the runs of the study are processed in chunks end to end: a chunk of the run info table is
+joined with its fastq file names, the new experiments and biosamples of the chunk are fetched and the resulting tab
+rows are streamed to a write-only workbook. Intermediate data of a chunk is released before the next one is read.
+Only the run to fastq file names map and the sets of experiment and biosample accessions already written are kept
+for the whole study.
+"""
+# --- core imports
+import gc
+import logging
+import multiprocessing
+
+# --- application imports
+from geo_to_hca import geo_to_hca
+from geo_to_hca.utils import deadline
+from geo_to_hca.utils import get_tab
+from geo_to_hca.utils import instrumentation
+from geo_to_hca.utils import parse_reads
+from geo_to_hca.utils import sra_utils
+from geo_to_hca.utils import utils
+from geo_to_hca.utils.records import FastqFile, Run
+from geo_to_hca.utils.streaming_workbook import StreamingWorkbook
+
+DEFAULT_MEMORY_BUDGET_MB = 2048
+# rough upper bound of the memory needed per run while a chunk is processed: runinfo and integrated rows for its
+# fastq files, experiment and biosample xml, tab rows
+ESTIMATED_BYTES_PER_RUN = 64 * 1024
+MIN_CHUNK_SIZE = 100
+MAX_CHUNK_SIZE = 50_000
+
+log = logging.getLogger(__name__)
+
+
+def chunk_size_for_budget(memory_budget_mb: int) -> int:
+    """
+    Number of runs per chunk so that a chunk uses about a quarter of the memory budget, leaving the rest to the
+    interpreter, libraries, the fastq map and the workbook writer.
+    """
+    chunk_size = int(memory_budget_mb * 2 ** 20 / 4 / ESTIMATED_BYTES_PER_RUN)
+    return max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, chunk_size))
+
+
+def create_spreadsheet_in_chunks(accession: str, output_dir: str, nthreads: int = 1,
+                                 hca_template=geo_to_hca.DEFAULT_HCA_TEMPLATE,
+                                 memory_budget_mb: int = DEFAULT_MEMORY_BUDGET_MB,
+                                 chunk_size: int = None) -> str:
+    """
+    Writes the HCA metadata spreadsheet of a study accession processing its runs in chunks of chunk_size runs (by
+    default derived from the memory budget). The chunk size is halved whenever the rss of the process gets close to the
+    budget. Returns the path of the spreadsheet.
+    """
+    study = None
+    try:
+        if not chunk_size:
+            chunk_size = chunk_size_for_budget(memory_budget_mb)
+        geo_accession, srp_accessions = geo_to_hca.resolve_srp_accessions(accession)
+        workbook = StreamingWorkbook(hca_template)
+        study = StudyChunks(workbook, None, nthreads)
+        first_run = None
+        fastq_sources = []
+        previous_peak_rss_mb = instrumentation.peak_rss_mb()
+
+        # the studies of a SuperSeries are processed one after the other, to stay within the memory budget
+        for srp_accession in srp_accessions:
+            log.info(f"Fetching fastq file names from ENA for SRA study ID: {srp_accession}")
+            with instrumentation.stage('fetch_fastq_names'):
+                fastq_map = utils.test_number_fastq_files(parse_reads.request_fastq_from_ENA(srp_accession))
+            if not fastq_map:
+                log.info(f"No ENA fastq file names for SRA study ID: {srp_accession}, they will be fetched from SRA per chunk")
+            fastq_sources.append('ENA' if fastq_map else 'SRA')
+
+            study.fastq_map = fastq_map
+            reader = sra_utils.iter_srp_metadata(srp_accession, chunksize=chunk_size)
+            while True:
+                try:
+                    runs = sra_utils.get_runs(reader.get_chunk(chunk_size))
+                except StopIteration:
+                    break
+                deadline.check()
+                study.add_chunk(runs)
+                if first_run is None and runs:
+                    first_run = runs[0]
+                del runs
+                gc.collect()
+                rss_mb, peak_rss_mb = instrumentation.rss_mb(), instrumentation.peak_rss_mb()
+                log.info(f'{study.n_runs} runs processed in {study.n_chunks} chunks, '
+                         f'rss {rss_mb or peak_rss_mb:.0f} MiB, peak rss {peak_rss_mb:.0f} MiB')
+                # the peak rss never goes down: where the current rss cannot be read, the chunk size is only reduced
+                # when the peak grew with this chunk
+                if rss_mb is not None:
+                    near_budget = rss_mb > 0.8 * memory_budget_mb
+                else:
+                    near_budget = peak_rss_mb > 0.8 * memory_budget_mb and peak_rss_mb > previous_peak_rss_mb
+                previous_peak_rss_mb = peak_rss_mb
+                if near_budget and chunk_size > MIN_CHUNK_SIZE:
+                    chunk_size = max(MIN_CHUNK_SIZE, chunk_size // 2)
+                    log.warning(f'rss close to the memory budget of {memory_budget_mb} MiB, '
+                                f'reducing the chunk size to {chunk_size} runs')
+            del fastq_map
+            study.fastq_map = None
+        instrumentation.annotate('fastq_source', ','.join(dict.fromkeys(fastq_sources)))
+        if first_run is None:
+            raise RuntimeError(f'no runs found for SRA study ID: {", ".join(srp_accessions)}')
+
+        log.info(f"Getting project metadata")
+        with instrumentation.stage('project_tabs'):
+            add_project_tabs(workbook, first_run, geo_accession)
+
+        out_file = f"{output_dir}/{accession}.xlsx"
+        log.info(f"Done. Saving workbook to excel file")
+        geo_to_hca.set_workbook_properties(accession, workbook)
+        with instrumentation.stage('save_spreadsheet_to_file'):
+            workbook.save(out_file)
+        log.info(f'{accession}: {study.n_runs} runs written to {out_file}, '
+                 f'peak rss {instrumentation.peak_rss_mb():.0f} MiB')
+        return out_file
+    except Exception as e:
+        raise Exception(f'Error creating spreadsheet for accession {accession}. {e}') from e
+    finally:
+        if study:
+            study.close()
+
+
+class StudyChunks:
+    """
+    Turns chunks of the run info table of a study into tab rows of a StreamingWorkbook. Experiments and biosamples
+    shared by runs of different chunks are written once. With nthreads > 1 the specimens are processed by a pool of
+    nthreads processes, started with the first chunk that needs it and kept until close() is called.
+    """
+    def __init__(self, workbook: StreamingWorkbook, fastq_map: {}, nthreads: int = 1):
+        self.workbook = workbook
+        self.fastq_map = fastq_map
+        self.nthreads = nthreads
+        self.pool = None
+        self.library_protocols = get_tab.LibraryProtocols()
+        self.sequencing_protocols = get_tab.SequencingProtocols()
+        self.experiments = set()
+        self.biosamples = set()
+        self.n_runs = 0
+        self.n_chunks = 0
+
+    def add_chunk(self, runs: [Run]) -> None:
+        self.n_chunks += 1
+        self.n_runs += len(runs)
+        with instrumentation.stage('fetch_fastq_names'):
+            fastq_map = self.fastq_map
+            if not fastq_map:
+                fastq_map = utils.test_number_fastq_files(
+                    parse_reads.get_fastq_from_SRA([run.accession for run in runs]))
+        with instrumentation.stage('integrate_metadata'):
+            run_files = geo_to_hca.integrate_metadata(runs, fastq_map)
+        del fastq_map
+
+        new_experiments = [run for experiment, run in get_tab.index_runs(runs, 'experiment').items()
+                           if experiment not in self.experiments]
+        self.experiments.update(run.experiment for run in new_experiments)
+        with instrumentation.stage('protocol_tabs'):
+            self._add_protocols([run.experiment for run in new_experiments])
+        with instrumentation.stage('sequence_file_tab'):
+            self.workbook.append_rows("Sequence file", self._sequence_file_rows(run_files))
+        with instrumentation.stage('cell_suspension_tab'):
+            self.workbook.append_rows("Cell suspension", [get_tab.cell_suspension_row(run) for run in new_experiments])
+        with instrumentation.stage('specimen_from_organism_tab'):
+            self._add_specimens(runs)
+
+    def _add_protocols(self, experiment_accessions: []) -> None:
+        if not experiment_accessions:
+            return
+        experiments = utils.fetch_experimental_metadata(experiment_accessions, accession_type='experiment')
+        library_rows = [self.library_protocols.register(experiment) for experiment in experiments]
+        sequencing_rows = [self.sequencing_protocols.register(experiment) for experiment in experiments]
+        self.workbook.append_rows("Library preparation protocol", [row for row in library_rows if row])
+        self.workbook.append_rows("Sequencing protocol", [row for row in sequencing_rows if row])
+
+    def _sequence_file_rows(self, run_files: [(Run, FastqFile)]) -> [{}]:
+        for run, fastq_file in run_files:
+            sequence_file_row = get_tab.sequence_file_row(run, fastq_file)
+            library_protocol_id, sequencing_protocol_id = get_tab.sequence_file_protocol_ids(
+                run.experiment,
+                self.library_protocols.protocol_ids,
+                self.sequencing_protocols.protocol_ids)
+            sequence_file_row['library_preparation_protocol.protocol_core.protocol_id'] = library_protocol_id
+            sequence_file_row['sequencing_protocol.protocol_core.protocol_id'] = sequencing_protocol_id
+            yield sequence_file_row
+
+    def _add_specimens(self, runs: [Run]) -> None:
+        runs_by_biosample = {biosample: run for biosample, run in get_tab.index_runs(runs, 'biosample').items()
+                             if biosample not in self.biosamples}
+        if not runs_by_biosample:
+            return
+        self.biosamples.update(runs_by_biosample)
+        biosamples = utils.fetch_experimental_metadata(list(runs_by_biosample), accession_type='biosample')
+        specimens = [(biosample, runs_by_biosample[biosample.accession]) for biosample in biosamples]
+        if self.nthreads > 1:
+            if self.pool is None:
+                self.pool = multiprocessing.Pool(processes=self.nthreads)
+            rows = self.pool.starmap(get_tab.process_specimen_from_organism, specimens)
+        else:
+            rows = [get_tab.process_specimen_from_organism(biosample, run) for biosample, run in specimens]
+        self.workbook.append_rows("Specimen from organism", rows)
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+
+def add_project_tabs(workbook: StreamingWorkbook, run: Run, geo_accession: str) -> None:
+    """
+    Writes the Project, Project - Publications, Project - Contributors and Project - Funders tabs, given the first run
+    of the study. The publication metadata is fetched once for the three publication tabs.
+    """
+    project = utils.get_bioproject_metadata(run.bioproject)
+    workbook.append_rows("Project", [get_tab.project_row(project, run, geo_accession)])
+    try:
+        publication = utils.get_pubmed_metadata(project.pubmed_id, iteration=1)
+    except AttributeError:
+        log.info(f'Publication attribute error with accession {geo_accession}')
+        return
+    workbook.append_rows("Project - Publications", [get_tab.publication_row(project.pubmed_id, publication)])
+    workbook.append_rows("Project - Contributors", get_tab.contributor_rows(publication.authors))
+    workbook.append_rows("Project - Funders", get_tab.funder_rows(publication.grants))
@@ -0,0 +1,319 @@
+"""
+Long running HTTP service converting study accessions to HCA metadata spreadsheets.
+
+    geo-to-hca-service --port 8080 --workers 2 --output_dir spreadsheets/
+
+POST /jobs with a json body {"accession": "GSE132509"} queues a conversion and returns the job with its id.
+GET /jobs lists the jobs, GET /jobs/<id> returns a job with its status (queued, running, done, failed or timed out) and
+GET /jobs/<id>/result downloads the spreadsheet of a finished job. Only the latest --max_finished_jobs finished jobs
+are kept: the ids of older ones are answered 404. GET /stats reports the job queue, the template pool, the response
+cache and the rate limiters.
+
+Unlike a geo-to-hca process per accession, the service keeps its imports, a pool of workbooks already loaded from the
+template, the http session, the eutils rate limiter and the response cache across jobs. Jobs run on a fixed number of
+worker threads which share the rate limiter, so the latency of a job is the time spent fetching and converting its
+metadata.
+"""
+# --- core imports
+import argparse
+import collections
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- third-party imports
+from openpyxl import load_workbook
+
+# --- application imports
+from geo_to_hca import config, version
+from geo_to_hca import geo_to_hca
+from geo_to_hca.cli import DEFAULT_HCA_TEMPLATE, prepare_logging
+from geo_to_hca.utils import chunking
+from geo_to_hca.utils import deadline
+from geo_to_hca.utils import europepmc_client
+from geo_to_hca.utils import instrumentation
+from geo_to_hca.utils import metadata_store
+from geo_to_hca.utils import transport
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+DEFAULT_MAX_FINISHED_JOBS = 1000
+
+log = logging.getLogger(__name__)
+
+
+class TemplatePool:
+    """
+    Keeps `size` workbooks loaded from the HCA template ready for use. Every workbook taken from the pool is replaced
+    by loading the template again in a background thread, so jobs do not wait for the template to be parsed. The first
+    workbook is loaded when the pool is created, so that a template which cannot be loaded fails at startup.
+    """
+    def __init__(self, hca_template, size: int = 2):
+        self.hca_template = hca_template
+        self.loads = 0
+        self._ready = queue.Queue()
+        self._ready.put(load_workbook(filename=self.hca_template))
+        self.loads += 1
+        self._loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='template-loader')
+        for _ in range(size - 1):
+            self._loader.submit(self._load)
+
+    def _load(self) -> None:
+        # a failed load is put on the queue in place of the workbook, to be raised by take()
+        try:
+            self._ready.put(load_workbook(filename=self.hca_template))
+        except Exception as e:
+            log.exception(e)
+            self._ready.put(e)
+        self.loads += 1
+
+    def take(self):
+        """
+        Returns a workbook loaded from the template, waiting for one until the deadline of the current context.
+        """
+        current_deadline = deadline.current()
+        try:
+            workbook = self._ready.get(timeout=current_deadline.remaining() if current_deadline else None)
+        except queue.Empty:
+            raise deadline.DeadlineExceeded(f'deadline of {current_deadline.seconds:g}s exceeded '
+                                            f'while waiting for the template') from None
+        self._loader.submit(self._load)
+        if isinstance(workbook, Exception):
+            raise workbook
+        return workbook
+
+    def stats(self) -> {}:
+        return {'ready': self._ready.qsize(), 'loads': self.loads}
+
+    def shutdown(self) -> None:
+        self._loader.shutdown(wait=False)
+
+
+@dataclass
+class Job:
+    accession: str
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = 'queued'
+    submitted: datetime = field(default_factory=datetime.now)
+    started: datetime = None
+    finished: datetime = None
+    error: str = None
+    out_file: str = None
+    stages: {} = None
+    attributes: {} = None
+
+    def as_dict(self) -> {}:
+        job = {'id': self.id, 'accession': self.accession, 'status': self.status, 'error': self.error,
+               'stages': self.stages, 'attributes': self.attributes}
+        for name in ('submitted', 'started', 'finished'):
+            value = getattr(self, name)
+            job[name] = value.isoformat() if value else None
+        if self.started and self.finished:
+            job['seconds'] = (self.finished - self.started).total_seconds()
+        return job
+
+
+class ConversionService:
+    """
+    Queues accession conversion jobs and runs them on `workers` threads, writing every spreadsheet to its own
+    directory under output_dir. Only the latest max_finished_jobs finished jobs are kept: older ones are forgotten and
+    their directory is removed.
+    """
+    def __init__(self, output_dir: str, hca_template=DEFAULT_HCA_TEMPLATE, workers: int = 2, nthreads: int = 1,
+                 max_finished_jobs: int = DEFAULT_MAX_FINISHED_JOBS):
+        self.output_dir = output_dir
+        self.nthreads = nthreads
+        self.max_finished_jobs = max(1, max_finished_jobs)
+        self.templates = TemplatePool(hca_template, size=workers)
+        self._jobs = {}
+        self._finished = collections.deque()
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+
+    def submit(self, accession: str) -> Job:
+        job = Job(accession)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job)
+        log.info(f'job {job.id} queued for accession {accession}')
+        return job
+
+    def job(self, job_id: str) -> Job:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self) -> [Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _run(self, job: Job) -> None:
+        job.status = 'running'
+        job.started = datetime.now()
+        recorder = instrumentation.StageRecorder()
+        accession_deadline = None
+        try:
+            with instrumentation.recording(recorder), \
+                    deadline.scope(config.ACCESSION_DEADLINE_SECONDS) as accession_deadline:
+                with instrumentation.stage('take_template'):
+                    template_workbook = self.templates.take()
+                workbook = geo_to_hca.create_spreadsheet_using_accession(job.accession, self.nthreads,
+                                                                         template_workbook=template_workbook)
+                job_dir = os.path.join(self.output_dir, job.id)
+                os.makedirs(job_dir, exist_ok=True)
+                geo_to_hca.save_spreadsheet_to_file(workbook, job.accession, job_dir)
+            job.out_file = os.path.join(job_dir, f'{job.accession}.xlsx')
+            job.status = 'done'
+        except Exception as e:
+            log.exception(e)
+            job.error = str(e)
+            job.status = 'timed out' if accession_deadline is not None and accession_deadline.expired() else 'failed'
+        finally:
+            job.stages = recorder.as_dict()
+            job.attributes = dict(recorder.attributes)
+            job.finished = datetime.now()
+            log.info(f'job {job.id} for accession {job.accession} {job.status}')
+            self._evict(job)
+
+    def _evict(self, finished_job: Job) -> None:
+        with self._lock:
+            self._finished.append(finished_job.id)
+            evicted = [self._jobs.pop(self._finished.popleft())
+                       for _ in range(len(self._finished) - self.max_finished_jobs)]
+            self.evicted += len(evicted)
+        for job in evicted:
+            shutil.rmtree(os.path.join(self.output_dir, job.id), ignore_errors=True)
+            log.debug(f'job {job.id} for accession {job.accession} evicted')
+
+    def stats(self) -> {}:
+        store = metadata_store.store()
+        statuses = {}
+        for job in self.jobs():
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {'version': version, 'jobs': statuses, 'evicted_jobs': self.evicted,
+                'templates': self.templates.stats(), **transport.stats(),
+                'europepmc': europepmc_client.stats(), 'efetch_chunks': chunking.stats(),
+                'metadata_store': store.stats() if store else None}
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
+        self.templates.shutdown()
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    job_path = re.compile(r'^/jobs/([0-9a-f]+)(/result)?$')
+    # the accession names the spreadsheet file and the Content-Disposition header of its download
+    accession_pattern = re.compile(r'^(GSE|SRP|ERP)\d+$')
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+    @property
+    def service(self) -> ConversionService:
+        return self.server.service
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            return self._send_json(404, {'error': f'unknown path {self.path}'})
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            accession = json.loads(self.rfile.read(length) or b'{}').get('accession')
+        except (ValueError, AttributeError):
+            return self._send_json(400, {'error': 'the request body must be a json object'})
+        if not accession or not isinstance(accession, str):
+            return self._send_json(400, {'error': 'an accession is required'})
+        accession = accession.strip()
+        if not self.accession_pattern.match(accession):
+            return self._send_json(400, {'error': f'{json.dumps(accession)} is not a GEO series or SRA study '
+                                                  f'accession (GSE, SRP or ERP followed by digits)'})
+        job = self.service.submit(accession)
+        self._send_json(202, job.as_dict(), headers={'Location': f'/jobs/{job.id}'})
+
+    def do_GET(self):
+        path = self.path.rstrip('/')
+        if path == '/jobs':
+            return self._send_json(200, [job.as_dict() for job in self.service.jobs()])
+        if path == '/stats':
+            return self._send_json(200, self.service.stats())
+        match = self.job_path.match(path)
+        if not match:
+            return self._send_json(404, {'error': f'unknown path {self.path}'})
+        job = self.service.job(match.group(1))
+        if not job:
+            # never submitted, or evicted (see ConversionService.max_finished_jobs)
+            return self._send_json(404, {'error': f'unknown job {match.group(1)}'})
+        if not match.group(2):
+            return self._send_json(200, job.as_dict())
+        if job.status != 'done':
+            return self._send_json(409, job.as_dict())
+        with open(job.out_file, 'rb') as out_file:
+            content = out_file.read()
+        self._send(200, XLSX_CONTENT_TYPE, content,
+                   headers={'Content-Disposition': f'attachment; filename="{job.accession}.xlsx"'})
+
+    def _send_json(self, status: int, payload, headers: {} = None):
+        self._send(status, 'application/json', json.dumps(payload).encode(), headers)
+
+    def _send(self, status: int, content_type: str, body: bytes, headers: {} = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ServiceHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: (str, int), service: ConversionService):
+        super().__init__(address, ServiceRequestHandler)
+        self.service = service
+
+
+def main():
+    config.reload()
+    prepare_logging()
+    parser = argparse.ArgumentParser(description='geo_to_hca conversion service')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='port to listen on')
+    parser.add_argument('--workers', type=int, default=2, help='number of jobs converted concurrently')
+    parser.add_argument('--nthreads', type=int, default=1,
+                        help='number of multiprocessing processes to use per job')
+    parser.add_argument('--template', default=DEFAULT_HCA_TEMPLATE,
+                        help='path to an HCA spreadsheet template (xlsx)')
+    parser.add_argument('--output_dir', default='spreadsheets/',
+                        help='path to output directory; if it does not exist, the directory will be created')
+    parser.add_argument('--max_finished_jobs', type=int, default=DEFAULT_MAX_FINISHED_JOBS,
+                        help='number of finished jobs kept; the spreadsheets of older jobs are removed and their '
+                             f'ids are no longer known (default {DEFAULT_MAX_FINISHED_JOBS})')
+    args = parser.parse_args()
+
+    if config.IS_INTERACTIVE:
+        log.info('the service does not prompt for confirmation of publications found in EuropePMC')
+        config.IS_INTERACTIVE = False
+    os.makedirs(args.output_dir, exist_ok=True)
+    service = ConversionService(args.output_dir, args.template, args.workers, args.nthreads,
+                                args.max_finished_jobs)
+    server = ServiceHTTPServer((args.host, args.port), service)
+    log.info(f'using {__package__}-{version}, listening on http://{args.host}:{server.server_address[1]}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Local index of the relationships between GEO series, SRA studies, experiments, runs and biosamples, imported from
+bulk dump files rather than requested accession by accession from the eutils:
+
+- SRA_Accessions.tab (https://ftp.ncbi.nlm.nih.gov/sra/reports/Metadata/), which lists every SRA study, experiment
+  and run with its sample, biosample and bioproject; the alias of the studies submitted through GEO is their GEO
+  series accession.
+- ENA read_run reports (tab-delimited, with a header naming the ENA fields), which also give the taxon, scientific
+  name and sample alias of the runs.
+
+The index is a sqlite database at config.ACCESSION_INDEX, built with geo-to-hca-index. When the file exists,
+sra_utils.get_srp_accession_from_geo and sra_utils.get_study_runs look accessions up in it before going to NCBI.
+"""
+# --- core imports
+import csv
+import logging
+import os
+import threading
+
+# --- application imports
+from geo_to_hca import config
+from geo_to_hca.utils import cache
+from geo_to_hca.utils.records import Run
+
+# rows written per transaction while importing a dump file
+IMPORT_BATCH_SIZE = 50_000
+MISSING_VALUES = ('', '-')
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_accession_index = None
+
+
+def _field(row: {}, name: str) -> str:
+    value = row.get(name)
+    return None if value is None or value.strip() in MISSING_VALUES else value.strip()
+
+
+def _upsert(table: str, columns: [str]) -> str:
+    """
+    Returns the statement inserting a row in the table or, if its accession is already indexed, filling in the columns
+    which the row has a value for, so that rows of the same accession from different dump files are merged.
+    """
+    updates = ', '.join(f'{column} = COALESCE(excluded.{column}, {column})' for column in columns[1:])
+    return (f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) '
+            f'ON CONFLICT (accession) DO UPDATE SET {updates}')
+
+
+STUDY_COLUMNS = ['accession', 'alias', 'bioproject']
+EXPERIMENT_COLUMNS = ['accession', 'alias', 'study', 'sample', 'biosample']
+RUN_COLUMNS = ['accession', 'experiment', 'study', 'bioproject', 'sample', 'biosample', 'taxon_id',
+               'scientific_name', 'sample_name']
+
+
+class AccessionIndex(cache.SqliteDatabase):
+    schema = (
+        'CREATE TABLE IF NOT EXISTS studies (accession TEXT PRIMARY KEY, alias TEXT, bioproject TEXT)',
+        'CREATE INDEX IF NOT EXISTS studies_alias ON studies (alias)',
+        'CREATE TABLE IF NOT EXISTS experiments (accession TEXT PRIMARY KEY, alias TEXT, study TEXT, sample TEXT, '
+        'biosample TEXT)',
+        'CREATE INDEX IF NOT EXISTS experiments_alias ON experiments (alias)',
+        'CREATE TABLE IF NOT EXISTS runs (accession TEXT PRIMARY KEY, experiment TEXT, study TEXT, bioproject TEXT, '
+        'sample TEXT, biosample TEXT, taxon_id INTEGER, scientific_name TEXT, sample_name TEXT)',
+        'CREATE INDEX IF NOT EXISTS runs_study ON runs (study)',
+        'CREATE INDEX IF NOT EXISTS runs_biosample ON runs (biosample)',
+    )
+
+    # --- import
+
+    def import_file(self, path: str) -> {}:
+        """
+        Imports an SRA_Accessions.tab file or an ENA read_run report, recognised by their header. Returns the number of
+        studies, experiments and runs read from the file.
+        """
+        with open(path, newline='') as dump_file:
+            reader = csv.DictReader(dump_file, delimiter='\t')
+            header = reader.fieldnames or []
+            if 'Accession' in header and 'Type' in header:
+                rows = self._sra_accessions_rows(reader)
+            elif 'run_accession' in header:
+                rows = self._ena_read_run_rows(reader)
+            else:
+                raise ValueError(f'{path} is neither an SRA_Accessions.tab file nor an ENA read_run report')
+            counts = self._import_rows(rows)
+        log.info(f'imported {path}: {counts}')
+        return counts
+
+    @staticmethod
+    def _sra_accessions_rows(reader: csv.DictReader):
+        for row in reader:
+            accession_type = row.get('Type')
+            if accession_type == 'STUDY':
+                yield 'studies', (_field(row, 'Accession'), _field(row, 'Alias'), _field(row, 'BioProject'))
+            elif accession_type == 'EXPERIMENT':
+                yield 'experiments', (_field(row, 'Accession'), _field(row, 'Alias'), _field(row, 'Study'),
+                                      _field(row, 'Sample'), _field(row, 'BioSample'))
+            elif accession_type == 'RUN':
+                yield 'runs', (_field(row, 'Accession'), _field(row, 'Experiment'), _field(row, 'Study'),
+                               _field(row, 'BioProject'), _field(row, 'Sample'), _field(row, 'BioSample'),
+                               None, None, None)
+
+    @staticmethod
+    def _ena_read_run_rows(reader: csv.DictReader):
+        studies = set()
+        for row in reader:
+            study = _field(row, 'secondary_study_accession')
+            taxon_id = _field(row, 'tax_id')
+            yield 'runs', (_field(row, 'run_accession'), _field(row, 'experiment_accession'), study,
+                           _field(row, 'study_accession'), _field(row, 'secondary_sample_accession'),
+                           _field(row, 'sample_accession'), int(taxon_id) if taxon_id else None,
+                           _field(row, 'scientific_name'), _field(row, 'sample_alias'))
+            if study and study not in studies:
+                studies.add(study)
+                yield 'studies', (study, _field(row, 'study_alias'), _field(row, 'study_accession'))
+
+    def _import_rows(self, rows) -> {}:
+        statements = {
+            'studies': _upsert('studies', STUDY_COLUMNS),
+            'experiments': _upsert('experiments', EXPERIMENT_COLUMNS),
+            'runs': _upsert('runs', RUN_COLUMNS),
+        }
+        counts = dict.fromkeys(statements, 0)
+        batches = {table: [] for table in statements}
+
+        def flush(connection):
+            for table, batch in batches.items():
+                connection.executemany(statements[table], batch)
+                batch.clear()
+
+        with self._lock:
+            connection = self._connect()
+            n_rows = 0
+            for table, values in rows:
+                if not values[0]:
+                    continue
+                batches[table].append(values)
+                counts[table] += 1
+                n_rows += 1
+                if n_rows % IMPORT_BATCH_SIZE == 0:
+                    with connection:
+                        flush(connection)
+            with connection:
+                flush(connection)
+        return counts
+
+    # --- lookups
+
+    def studies_for_geo_accession(self, geo_accession: str) -> [str]:
+        """
+        Returns the SRA study accessions of a GEO series (the studies whose alias is the series accession).
+        """
+        return [row[0] for row in self.query('SELECT accession FROM studies WHERE alias = ? ORDER BY accession',
+                                             (geo_accession,))]
+
+    def studies_for_geo_accessions(self, geo_accessions: [str]) -> {}:
+        """
+        Returns the SRA study accessions of many GEO series, by series accession, with one query per 500 series.
+        """
+        studies = {geo_accession: [] for geo_accession in geo_accessions}
+        geo_accessions = list(studies)
+        for i in range(0, len(geo_accessions), 500):
+            part = geo_accessions[i:i + 500]
+            for alias, accession in self.query(f'SELECT alias, accession FROM studies WHERE alias IN '
+                                               f'({",".join("?" * len(part))}) ORDER BY accession', part):
+                studies[alias].append(accession)
+        return studies
+
+    def get_runs(self, srp_accession: str) -> [Run]:
+        """
+        Returns the runs of an SRA study, in the order of their accessions, or None if the study has no runs indexed or
+        some of its runs lack the fields of the run info table (e.g. when only SRA_Accessions.tab was imported).
+        """
+        rows = self.query(f'SELECT {", ".join(RUN_COLUMNS)} FROM runs WHERE study = ? '
+                          f'ORDER BY length(accession), accession', (srp_accession,))
+        if not rows or any(row[6] is None or row[7] is None for row in rows):
+            return None
+        return [Run(*row[:8], float('nan') if row[8] is None else row[8]) for row in rows]
+
+    def stats(self) -> {}:
+        return {table: self.query(f'SELECT count(*) FROM {table}')[0][0]
+                for table in ('studies', 'experiments', 'runs')}
+
+
+def index(create: bool = False) -> AccessionIndex:
+    """
+    Returns the accession index of the process, at config.ACCESSION_INDEX, or None if ACCESSION_INDEX is not set or,
+    unless create is True, if the index was never built.
+    """
+    global _accession_index
+    if not config.ACCESSION_INDEX:
+        return None
+    path = os.path.expanduser(config.ACCESSION_INDEX)
+    if not create and not os.path.exists(path):
+        return None
+    with _lock:
+        if _accession_index is None or _accession_index.path != path:
+            if _accession_index is not None:
+                _accession_index.close()
+            _accession_index = AccessionIndex(path)
+        return _accession_index
@@ -0,0 +1,221 @@
+"""
+Persistent cache of lookup results which rarely change, kept in a sqlite database under config.CACHE_DIR so that they
+are reused across runs of geo_to_hca (e.g. the results of EuropePMC searches by project title).
+
+Values are strings (usually json) stored by namespace and key, with the time they were stored; entries older than the
+max_age given to get are ignored. The bodies of cacheable http responses are kept in a separate database (see
+HttpCache and transport). Both databases are pruned when a process opens them, so that they do not grow without
+bound: expired lookups are removed, as are the responses older than config.HTTP_CACHE_MAX_AGE_DAYS and the oldest ones
+beyond config.HTTP_CACHE_MAX_MB. Setting CACHE_DIR to an empty string disables the caches, as does config.OFFLINE (while
+rendering from a bundle, which is only read).
+"""
+# --- core imports
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+# --- application imports
+from geo_to_hca import config
+
+log = logging.getLogger(__name__)
+
+CACHE_FILE_NAME = 'cache.sqlite'
+HTTP_CACHE_FILE_NAME = 'http.sqlite'
+
+_lock = threading.Lock()
+_persistent_cache = None
+_http_cache = None
+
+
+class SqliteDatabase:
+    """
+    A sqlite database shared by all threads of a process, created with the statements of its schema. Each process
+    opens its own connection, so the database can be used by the multiprocessing pools. A read_only database must
+    exist and is opened without writing to its directory, e.g. on a read-only mount.
+    """
+    schema = ()
+
+    def __init__(self, path: str, read_only: bool = False):
+        self.path = path
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None or self._pid != os.getpid():
+            if self.read_only:
+                self._connection = sqlite3.connect(f'file:{urllib.parse.quote(os.path.abspath(self.path))}?mode=ro',
+                                                   uri=True, timeout=30, check_same_thread=False)
+            else:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+                self._connection.execute('PRAGMA journal_mode=WAL')
+                for statement in self.schema:
+                    self._connection.execute(statement)
+                self._connection.commit()
+            self._pid = os.getpid()
+        return self._connection
+
+    def query(self, sql: str, parameters=()) -> []:
+        with self._lock:
+            return self._connect().execute(sql, parameters).fetchall()
+
+    def execute(self, sql: str, parameters=()) -> None:
+        with self._lock:
+            connection = self._connect()
+            connection.execute(sql, parameters)
+            connection.commit()
+
+    def execute_many(self, sql: str, rows) -> None:
+        with self._lock:
+            connection = self._connect()
+            connection.executemany(sql, rows)
+            connection.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
+
+
+class PersistentCache(SqliteDatabase):
+    """
+    Key-value store of strings by namespace and key, with the time they were stored.
+    """
+    schema = ('CREATE TABLE IF NOT EXISTS entries ('
+              'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '
+              'stored REAL NOT NULL, PRIMARY KEY (namespace, key))',)
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, namespace: str, key: str, max_age: float = None) -> str:
+        """
+        Returns the value stored for the key, or None if there is none or it was stored more than max_age seconds ago.
+        """
+        rows = self.query('SELECT value, stored FROM entries WHERE namespace = ? AND key = ?', (namespace, key))
+        if not rows or (max_age is not None and time.time() - rows[0][1] > max_age):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return rows[0][0]
+
+    def put(self, namespace: str, key: str, value: str) -> None:
+        self.execute('INSERT OR REPLACE INTO entries (namespace, key, value, stored) VALUES (?, ?, ?, ?)',
+                     (namespace, key, value, time.time()))
+
+    def delete(self, namespace: str, key: str) -> None:
+        self.execute('DELETE FROM entries WHERE namespace = ? AND key = ?', (namespace, key))
+
+    def prune(self, max_age: float) -> int:
+        """
+        Removes the entries stored more than max_age seconds ago. Returns the number of entries removed.
+        """
+        with self._lock:
+            connection = self._connect()
+            removed = connection.execute('DELETE FROM entries WHERE stored < ?', (time.time() - max_age,)).rowcount
+            connection.commit()
+        return removed
+
+    def stats(self) -> {}:
+        return {'path': self.path, 'hits': self.hits, 'misses': self.misses}
+
+
+class HttpCache(SqliteDatabase):
+    """
+    Bodies of http responses by request, with the headers needed to revalidate them (ETag and Last-Modified) and the
+    time they were stored or last revalidated.
+    """
+    schema = ('CREATE TABLE IF NOT EXISTS responses ('
+              'key TEXT PRIMARY KEY, headers TEXT NOT NULL, content BLOB NOT NULL, stored REAL NOT NULL)',
+              'CREATE INDEX IF NOT EXISTS responses_stored ON responses (stored)')
+
+    def get(self, key: str) -> ({}, bytes, float):
+        """
+        Returns the headers, content and storage time of the response stored for the key, or None.
+        """
+        rows = self.query('SELECT headers, content, stored FROM responses WHERE key = ?', (key,))
+        if not rows:
+            return None
+        headers, content, stored = rows[0]
+        return json.loads(headers), content, stored
+
+    def put(self, key: str, headers: {}, content: bytes) -> None:
+        self.execute('INSERT OR REPLACE INTO responses (key, headers, content, stored) VALUES (?, ?, ?, ?)',
+                     (key, json.dumps(headers), content, time.time()))
+
+    def touch(self, key: str) -> None:
+        """
+        Marks the response stored for the key as fresh, e.g. after the server confirmed it did not change.
+        """
+        self.execute('UPDATE responses SET stored = ? WHERE key = ?', (time.time(), key))
+
+    def prune(self, max_age: float, max_bytes: int) -> int:
+        """
+        Removes the responses stored (or revalidated) more than max_age seconds ago, then the oldest responses until
+        their content takes at most max_bytes. Returns the number of responses removed.
+        """
+        with self._lock:
+            connection = self._connect()
+            removed = connection.execute('DELETE FROM responses WHERE stored < ?', (time.time() - max_age,)).rowcount
+            removed += connection.execute(
+                'DELETE FROM responses WHERE key IN (SELECT key FROM ('
+                'SELECT key, SUM(LENGTH(content)) OVER (ORDER BY stored DESC, key) AS kept_bytes FROM responses) '
+                'WHERE kept_bytes > ?)', (max_bytes,)).rowcount
+            connection.commit()
+        return removed
+
+
+def persistent_cache() -> PersistentCache:
+    """
+    Returns the persistent cache of the process, in config.CACHE_DIR, or None if CACHE_DIR is not set or the process
+    is offline.
+    """
+    global _persistent_cache
+    if not config.CACHE_DIR or config.OFFLINE:
+        return None
+    path = os.path.join(os.path.expanduser(config.CACHE_DIR), CACHE_FILE_NAME)
+    with _lock:
+        if _persistent_cache is None or _persistent_cache.path != path:
+            if _persistent_cache is not None:
+                _persistent_cache.close()
+            _persistent_cache = PersistentCache(path)
+            removed = _persistent_cache.prune(max(max_age(), config.NEGATIVE_CACHE_TTL_DAYS * 24 * 3600))
+            if removed:
+                log.info(f'{removed} expired entries removed from {path}')
+        return _persistent_cache
+
+
+def http_cache() -> HttpCache:
+    """
+    Returns the http response cache of the process, in config.CACHE_DIR, or None if CACHE_DIR is not set or the process
+    is offline.
+    """
+    global _http_cache
+    if not config.CACHE_DIR or config.OFFLINE:
+        return None
+    path = os.path.join(os.path.expanduser(config.CACHE_DIR), HTTP_CACHE_FILE_NAME)
+    with _lock:
+        if _http_cache is None or _http_cache.path != path:
+            if _http_cache is not None:
+                _http_cache.close()
+            _http_cache = HttpCache(path)
+            removed = _http_cache.prune(config.HTTP_CACHE_MAX_AGE_DAYS * 24 * 3600, config.HTTP_CACHE_MAX_MB * 2 ** 20)
+            if removed:
+                log.info(f'{removed} old responses removed from {path}')
+        return _http_cache
+
+
+def max_age() -> float:
+    """
+    Returns the maximum age, in seconds, of the entries read from the persistent cache (config.CACHE_TTL_DAYS).
+    """
+    return config.CACHE_TTL_DAYS * 24 * 3600
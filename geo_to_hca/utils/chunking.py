@@ -0,0 +1,113 @@
+"""
+Adaptive sizing of the chunks of ids sent per efetch request.
+
+The biosample and experiment xml of an id can be a few hundred bytes or many kilobytes, so a fixed number of ids per
+request is either slow (many small requests, each spaced by the eutils rate limiter) or risky (huge responses which
+time out). An AdaptiveChunker learns the bytes and seconds per id from the responses of the requests it sized and
+makes the next chunks as large as fits in config.EFETCH_TARGET_SECONDS and config.EFETCH_TARGET_MB, within
+config.EFETCH_CHUNK_MIN and config.EFETCH_CHUNK_MAX ids. Chunkers are kept per eutils database for the life of the
+process, so later requests start from what earlier ones learned.
+"""
+# --- core imports
+import logging
+import threading
+
+# --- application imports
+from geo_to_hca import config
+
+# ids per request until a response was observed, as with the former fixed chunks
+INITIAL_CHUNK_SIZE = 100
+# weight of the latest response in the estimates of bytes and seconds per id
+SMOOTHING = 0.5
+# a chunk is at most this many times larger than the previous one
+MAX_GROWTH = 2
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_chunkers = {}
+
+
+class AdaptiveChunker:
+    """
+    Splits lists of ids into chunks whose size follows the observed bytes and seconds per id of the responses.
+    """
+    def __init__(self, name: str, min_size: int, max_size: int, target_seconds: float, target_bytes: float,
+                 initial_size: int = INITIAL_CHUNK_SIZE):
+        self.name = name
+        self.min_size = max(1, min_size)
+        self.max_size = max(self.min_size, max_size)
+        self.target_seconds = target_seconds
+        self.target_bytes = target_bytes
+        self.size = min(self.max_size, max(self.min_size, initial_size))
+        self.seconds_per_id = None
+        self.bytes_per_id = None
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def chunks(self, ids: []):
+        """
+        Yields consecutive chunks of the ids, each sized when it is taken, i.e. after the responses of the previous
+        chunks were recorded.
+        """
+        start = 0
+        while start < len(ids):
+            size = self.size
+            yield ids[start:start + size]
+            start += size
+
+    def record(self, n_ids: int, n_bytes: int, seconds: float) -> None:
+        """
+        Records the response to a request for n_ids ids and resizes the next chunks.
+        """
+        if n_ids <= 0:
+            return
+        with self._lock:
+            self.requests += 1
+            self.seconds_per_id = self._smooth(self.seconds_per_id, seconds / n_ids)
+            self.bytes_per_id = self._smooth(self.bytes_per_id, n_bytes / n_ids)
+            size = self.max_size
+            if self.seconds_per_id > 0:
+                size = min(size, self.target_seconds / self.seconds_per_id)
+            if self.bytes_per_id > 0:
+                size = min(size, self.target_bytes / self.bytes_per_id)
+            size = min(int(size), self.size * MAX_GROWTH)
+            size = min(self.max_size, max(self.min_size, size))
+            if size != self.size:
+                log.debug(f'{self.name} efetch chunks resized from {self.size} to {size} ids')
+            self.size = size
+
+    @staticmethod
+    def _smooth(estimate: float, value: float) -> float:
+        return value if estimate is None else SMOOTHING * value + (1 - SMOOTHING) * estimate
+
+    def stats(self) -> {}:
+        return {'size': self.size, 'requests': self.requests,
+                'seconds_per_id': round(self.seconds_per_id, 6) if self.seconds_per_id is not None else None,
+                'bytes_per_id': round(self.bytes_per_id) if self.bytes_per_id is not None else None}
+
+
+def chunker(db: str) -> AdaptiveChunker:
+    """
+    Returns the chunker of the efetch requests to an eutils database, created from the configured bounds.
+    """
+    with _lock:
+        db_chunker = _chunkers.get(db)
+        if db_chunker is None:
+            db_chunker = _chunkers[db] = AdaptiveChunker(db, config.EFETCH_CHUNK_MIN, config.EFETCH_CHUNK_MAX,
+                                                         config.EFETCH_TARGET_SECONDS,
+                                                         config.EFETCH_TARGET_MB * 2 ** 20)
+        return db_chunker
+
+
+def stats() -> {}:
+    with _lock:
+        return {db: db_chunker.stats() for db, db_chunker in _chunkers.items()}
+
+
+def reset() -> None:
+    """
+    Drops the chunkers, e.g. after the configuration changed.
+    """
+    with _lock:
+        _chunkers.clear()
@@ -0,0 +1,107 @@
+"""
+Wall-clock deadlines of the processing of an accession.
+
+A deadline is set for the current context with scope(seconds) and shared by every stage run in it, including the
+threads started with propagate(). transport.send checks it before each request and caps the timeouts of the request
+to the time left, and the loops over chunks and experiment packages check it between iterations, so once the deadline
+has passed every stage stops at its next request or iteration with DeadlineExceeded instead of running to completion.
+"""
+# --- core imports
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar('deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    """
+    Point in time after which the work done under the deadline is cancelled. A deadline can also be cancelled before
+    it expires, e.g. when the caller gives up on the work.
+    """
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+        self._cancelled = threading.Event()
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - time.monotonic())
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def expired(self) -> bool:
+        return self._cancelled.is_set() or time.monotonic() >= self.expires
+
+    def check(self) -> None:
+        if self.expired():
+            raise DeadlineExceeded(f'deadline of {self.seconds:g}s exceeded')
+
+
+@contextmanager
+def scope(seconds: float):
+    """
+    Sets a deadline of `seconds` from now for the current context, or none if seconds is not positive. Yields the
+    deadline (or None); the deadline is cancelled when the scope is left, so that threads still working under it stop.
+    """
+    if not seconds or seconds <= 0:
+        yield None
+        return
+    deadline = Deadline(seconds)
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+        deadline.cancel()
+
+
+def current() -> Deadline:
+    return _current.get()
+
+
+def check() -> None:
+    """
+    Raises DeadlineExceeded if the deadline of the current context has passed or was cancelled. This is a no-op
+    outside of a deadline scope.
+    """
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.check()
+
+
+def timeout(connect_seconds: float, read_seconds: float) -> (float, float):
+    """
+    Returns the (connect, read) timeouts of a request, capped to the time left before the deadline of the current
+    context.
+    """
+    deadline = _current.get()
+    if deadline is None:
+        return connect_seconds, read_seconds
+    remaining = max(deadline.remaining(), 0.001)
+    return min(connect_seconds, remaining), min(read_seconds, remaining)
+
+
+def propagate(function):
+    """
+    Wraps a function to be run on another thread, e.g. by an executor, so that it runs under the deadline of the
+    calling context.
+    """
+    deadline = _current.get()
+    if deadline is None:
+        return function
+
+    @functools.wraps(function)
+    def run_under_deadline(*args, **kwargs):
+        token = _current.set(deadline)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run_under_deadline
@@ -1,54 +1,62 @@
 import logging
-from time import sleep
 from requests import Request
 from xml.etree import ElementTree as xm
 
-import requests
-import requests as rq
-
 from geo_to_hca import config
 from geo_to_hca.utils import handle_errors
+from geo_to_hca.utils import negative_cache
+from geo_to_hca.utils import transport
 from geo_to_hca.utils.handle_errors import TermNotFound
 
 log = logging.getLogger(__name__)
 
 
-def throttle():
-    """
-    basic implementation to test whether
-    throttling is the solution for the 429
-    see dcp-838
-    """
-    # eutils allows 3 calls per second, otherwise they return 429
-    sleep(0.6)
-
-
 def call_esearch(geo_accession, db='gds'):
-    throttle()
-    r = requests.get(f'{config.EUTILS_BASE_URL}/esearch.fcgi',
-                     params={
-                         'db': db,
-                         'retmode': 'json',
-                         'term': geo_accession})
+    # calls to eutils are rate limited by the transport, see dcp-838
+    r = transport.get(f'{config.EUTILS_BASE_URL}/esearch.fcgi',
+                      params={
+                          'db': db,
+                          'retmode': 'json',
+                          'term': geo_accession},
+                      cache=True)
     r.raise_for_status()
     response_json = r.json()
     return response_json['esearchresult']
 
 
 def call_esummary(accession, db='gds'):
-    throttle()
-    esummary_response = requests.get(f'{config.EUTILS_BASE_URL}/esummary.fcgi',
-                                     params={'db': db,
-                                             'retmode': 'json',
-                                             'id': accession})
+    esummary_response = transport.get(f'{config.EUTILS_BASE_URL}/esummary.fcgi',
+                                      params={'db': db,
+                                              'retmode': 'json',
+                                              'id': accession},
+                                      cache=True)
     esummary_response.raise_for_status()
     esummary_response_json = esummary_response.json()
     return esummary_response_json
 
 
+def call_esummary_history(webenv, query_key, db='sra', retstart=0, retmax=None):
+    """
+    Function to request the esummaries of a page of the results of an esearch, from its search history.
+    """
+    # not cached: the WebEnv of the search history expires
+    esummary_response = transport.get(f'{config.EUTILS_BASE_URL}/esummary.fcgi',
+                                      params={'db': db,
+                                              'retmode': 'json',
+                                              'WebEnv': webenv,
+                                              'query_key': query_key,
+                                              'retstart': retstart,
+                                              'retmax': retmax or ESUMMARY_PAGE_SIZE})
+    esummary_response.raise_for_status()
+    return esummary_response.json()
+
+
 def get_entrez_esearch(term, db="sra"):
-    throttle()
-    esearch_response = requests.get(url=f'{config.EUTILS_BASE_URL}/esearch.fcgi',
+    error_key = negative_cache.known_failure(negative_cache.ESEARCH_TERM_NOT_FOUND, f'{db}:{term}')
+    if error_key is not None:
+        raise TermNotFound(term, error_key, db)
+    # not cached: the WebEnv of the search history expires
+    esearch_response = transport.get(url=f'{config.EUTILS_BASE_URL}/esearch.fcgi',
                      params={
                          "db": db,
                          "term": term,
@@ -62,6 +70,8 @@ def get_entrez_esearch(term, db="sra"):
     esearch_response_json = esearch_response.json()
     esearch_result = esearch_response_json['esearchresult']
     check_esearch_result(db, term, esearch_result)
+    if config.RECHECK_NEGATIVE:
+        negative_cache.clear_failure(negative_cache.ESEARCH_TERM_NOT_FOUND, f'{db}:{term}')
     return esearch_result
 
 
@@ -70,6 +80,7 @@ def check_esearch_result(db, term, esearch_result):
         return
     for error_key, errors in esearch_result['errorlist'].items():
         if len(errors) > 0:
+            negative_cache.record_failure(negative_cache.ESEARCH_TERM_NOT_FOUND, f'{db}:{term}', error_key)
             raise TermNotFound(term, error_key, db)
     # validation passed
 
@@ -79,7 +90,8 @@ def call_efetch(db, accessions=[],
                 query_key=None,
                 rettype=None,
                 retmode=None,
-                mode='call'):
+                mode='call',
+                stream=False):
     url = f'{config.EUTILS_BASE_URL}/efetch/fcgi'
     params= {
         'db': db,
@@ -95,7 +107,10 @@ def call_efetch(db, accessions=[],
     if retmode:
         params['retmode'] = retmode
     if mode == 'call':
-        efetch_response = rq.get(url, params=params)
+        if len(params.get('id', '')) >= config.EFETCH_POST_MIN_LENGTH:
+            efetch_response = transport.post(url, data=params, cache=not webenv, stream=stream)
+        else:
+            efetch_response = transport.get(url, params=params, cache=not webenv, stream=stream)
         if efetch_response.status_code == STATUS_ERROR_CODE:
             raise handle_errors.NotFoundSRA(efetch_response, accessions)
         return efetch_response
@@ -111,9 +126,8 @@ def request_bioproject_metadata(bioproject_accession: str):
     """
     Function to request metadata at the project level given an SRA Bioproject accession.
     """
-    throttle()
-    srp_bioproject_url = rq.get(
-        f'{config.EUTILS_BASE_URL}/efetch/fcgi?db=bioproject&id={bioproject_accession}')
+    srp_bioproject_url = transport.get(
+        f'{config.EUTILS_BASE_URL}/efetch/fcgi?db=bioproject&id={bioproject_accession}', cache=True)
     if srp_bioproject_url.status_code == STATUS_ERROR_CODE:
         raise handle_errors.NotFoundSRA(srp_bioproject_url, bioproject_accession)
     return xm.fromstring(srp_bioproject_url.content)
@@ -123,12 +137,47 @@ def request_pubmed_metadata(project_pubmed_id: str):
     """
     Function to request metadata at the publication level given a pubmed ID.
     """
-    throttle()
-    pubmed_url = rq.get(
-        f'{config.EUTILS_BASE_URL}/efetch/fcgi?db=pubmed&id={project_pubmed_id}&rettype=xml')
+    pubmed_url = transport.get(
+        f'{config.EUTILS_BASE_URL}/efetch/fcgi?db=pubmed&id={project_pubmed_id}&rettype=xml', cache=True)
     if pubmed_url.status_code == STATUS_ERROR_CODE:
         raise handle_errors.NotFoundSRA(pubmed_url, project_pubmed_id)
     return xm.fromstring(pubmed_url.content)
 
 
+def request_pubmed_articles(pubmed_ids: [str]) -> {}:
+    """
+    Function to request the metadata of many publications with a single efetch of their pubmed IDs (at most
+    PUBMED_BATCH_SIZE). Returns, by pubmed ID, a PubmedArticleSet element holding the PubmedArticle (or
+    PubmedBookArticle) of that publication, i.e. the same structure as the xml returned by request_pubmed_metadata for
+    a single ID. Pubmed IDs not found in pubmed are left out.
+    """
+    xml_content = xm.fromstring(call_efetch(db='pubmed', accessions=pubmed_ids, rettype='xml').content)
+    articles = {}
+    for article in xml_content:
+        if article.tag not in PUBMED_ARTICLE_TAGS:
+            continue
+        pmid = article.find('MedlineCitation/PMID')
+        if pmid is None:
+            pmid = article.find('BookDocument/PMID')
+        if pmid is None:
+            continue
+        article_set = xm.Element('PubmedArticleSet')
+        article_set.append(article)
+        articles[pmid.text.strip()] = article_set
+    return articles
+
+
+def has_pubmed_article(xml_content) -> bool:
+    """
+    Returns whether a PubmedArticleSet holds an article, either a journal article or a book (or chapter).
+    """
+    return any(xml_content.find(tag) is not None for tag in PUBMED_ARTICLE_TAGS)
+
+
 STATUS_ERROR_CODE = 400
+# the elements of the publications of a PubmedArticleSet
+PUBMED_ARTICLE_TAGS = ('PubmedArticle', 'PubmedBookArticle')
+# NCBI recommends POST requests for efetch calls of more than 200 IDs
+PUBMED_BATCH_SIZE = 200
+# esummaries per request of the results of an esearch (at most 10000)
+ESUMMARY_PAGE_SIZE = 1000
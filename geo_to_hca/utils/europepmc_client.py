@@ -0,0 +1,119 @@
+"""
+Client of the EuropePMC search api, used to find the publication of a project from its title or name when NCBI does
+not link one.
+
+Searches request the json `lite` results, limited to config.EUROPEPMC_PAGE_SIZE results. The results are memoised by
+normalised query (case and whitespace insensitive, as the search is) for the life of the process and kept in the
+persistent cache, so a title searched once is not searched again, by this run or the next ones. Searches without
+results are recorded as known failures instead (see negative_cache), for config.NEGATIVE_CACHE_TTL_DAYS days.
+"""
+# --- core imports
+import json
+import logging
+import threading
+
+# ---application imports
+from geo_to_hca import config
+from geo_to_hca.utils import cache
+from geo_to_hca.utils import handle_errors
+from geo_to_hca.utils import negative_cache
+from geo_to_hca.utils import transport
+
+STATUS_ERROR_CODE = 400
+CACHE_NAMESPACE = 'europepmc_search'
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_searches = {}
+_stats = {'memo_hits': 0, 'cache_hits': 0, 'requests': 0}
+
+
+def normalize_query(query: str) -> str:
+    """
+    Returns the query in lower case with its whitespace collapsed and trailing full stops removed, e.g. so that
+    a project title and the same title ending with a full stop are searched once.
+    """
+    return ' '.join(str(query).split()).casefold().rstrip('.').strip() if query else ''
+
+
+def search(query: str) -> [{}]:
+    """
+    Returns the EuropePMC results of a query, at most config.EUROPEPMC_PAGE_SIZE, as dictionaries with (among others)
+    the pmid, title and journalTitle keys of each result.
+    """
+    normalized_query = normalize_query(query)
+    if not normalized_query:
+        return []
+    key = f'{config.EUROPEPMC_BASE_URL}|{config.EUROPEPMC_PAGE_SIZE}|{normalized_query}'
+    with _lock:
+        results = _searches.get(key)
+        if results is not None:
+            _stats['memo_hits'] += 1
+            return results
+    persistent_cache = cache.persistent_cache()
+    cached = persistent_cache.get(CACHE_NAMESPACE, key, cache.max_age()) if persistent_cache else None
+    if cached == '[]':
+        # searches without results are known failures, not cached results
+        cached = None
+    if cached is not None:
+        results = json.loads(cached)
+        with _lock:
+            _stats['cache_hits'] += 1
+    elif negative_cache.known_failure(negative_cache.EUROPEPMC_NO_RESULTS, key) is not None:
+        results = []
+    else:
+        results = request_search(query)
+        if results is None:
+            return []
+        if not results:
+            negative_cache.record_failure(negative_cache.EUROPEPMC_NO_RESULTS, key, 'no results')
+        else:
+            if persistent_cache:
+                persistent_cache.put(CACHE_NAMESPACE, key, json.dumps(results))
+            if config.RECHECK_NEGATIVE:
+                negative_cache.clear_failure(negative_cache.EUROPEPMC_NO_RESULTS, key)
+    with _lock:
+        _searches[key] = results
+    return results
+
+
+def request_search(query: str) -> [{}]:
+    """
+    Sends a search request to EuropePMC. Returns the list of results, or None if the search failed and should not be
+    cached.
+    """
+    response = transport.get(f'{config.EUROPEPMC_BASE_URL}/search',
+                             params={
+                                 'query': query,
+                                 'format': 'json',
+                                 'resultType': 'lite',
+                                 'pageSize': config.EUROPEPMC_PAGE_SIZE,
+                             })
+    with _lock:
+        _stats['requests'] += 1
+    if response.status_code == STATUS_ERROR_CODE:
+        raise handle_errors.NotFoundENA(response, query)
+    try:
+        response.raise_for_status()
+        return response.json().get('resultList', {}).get('result', [])
+    except ValueError as e:
+        log.warning(f'invalid EuropePMC search response for {query}: {e}')
+    except Exception as e:
+        log.warning(f'EuropePMC search failed for {query}: {e}')
+    return None
+
+
+def stats() -> {}:
+    with _lock:
+        return {**_stats, 'memoised_queries': len(_searches)}
+
+
+def reset() -> None:
+    """
+    Drops the memoised searches, e.g. after the configuration changed.
+    """
+    with _lock:
+        _searches.clear()
+        for name in _stats:
+            _stats[name] = 0
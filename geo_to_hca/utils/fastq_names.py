@@ -0,0 +1,81 @@
+"""
+Parsing of the read index (read1, read2, index1, index2) and lane index (L001, etc.) of fastq file names.
+
+The names of the fastq files of a study are parsed as a column rather than name by name. The read index is given by
+the first group of markers contained in the name (_I1, _R3 or _3 for index1, then _R1 or _1 for read1, _R2 or _2 for
+read2 and _I2, _R4 or _4 for index2) and the lane index is the first _L followed by 3 digits, found with a compiled
+pattern. The names of a study mostly follow a few naming schemes which only differ by run accession (e.g.
+SRR1234567_1.fastq.gz), so each scheme is parsed once: the result is memoized by the name in which the run accession
+is replaced by a placeholder, and the other names of the column are looked up.
+
+The read index is found with substring tests rather than a regular expression, and the column is not parsed with
+pandas str.extract: both were several times slower, notably on names which are all distinct (e.g. 10x names with a
+sample per run).
+"""
+# --- core imports
+import re
+import threading
+
+LANE_INDEX_PATTERN = re.compile('_(L[0-9]{3})')
+# run accessions start with a letter, so no marker (an underscore followed by a letter or digit) overlaps them and
+# the placeholder does not make one
+RUN_PLACEHOLDER = '{run}'
+# memoized naming schemes, dropped when there are more (the schemes of a column with more are not memoized)
+MAX_SCHEMES = 100000
+
+_lock = threading.Lock()
+_schemes = {}
+
+
+def parse_file_names(run_accessions: [str], file_names: [str]) -> [(str, str)]:
+    """
+    Returns the (read index, lane index) of each fastq file name of the given runs, '' when a name has none.
+    """
+    schemes = [file_name.replace(run_accession, RUN_PLACEHOLDER) if run_accession else file_name
+               for run_accession, file_name in zip(run_accessions, file_names)]
+    # reading the memo does not need the lock: dict lookups are atomic
+    memoized = _schemes.get
+    parsed = {}
+    indices_of_names = []
+    for scheme in schemes:
+        indices = parsed.get(scheme)
+        if indices is None:
+            indices = parsed[scheme] = memoized(scheme) or _parse(scheme)
+        indices_of_names.append(indices)
+    if len(parsed) <= MAX_SCHEMES:
+        with _lock:
+            if len(_schemes) + len(parsed) > MAX_SCHEMES:
+                _schemes.clear()
+            _schemes.update(parsed)
+    return indices_of_names
+
+
+def _parse(file_name: str) -> (str, str):
+    lane_index = LANE_INDEX_PATTERN.search(file_name)
+    return read_index(file_name), lane_index.group(1) if lane_index else ''
+
+
+def read_index(file_name: str) -> str:
+    """
+    Returns the read index of a single fastq file name (read1, read2, index1 or index2), or ''.
+    """
+    # substring tests, in the order of the read indices, are faster than a table of markers or a pattern
+    if '_I1' in file_name or '_R3' in file_name or '_3' in file_name:
+        return 'index1'
+    if '_R1' in file_name or '_1' in file_name:
+        return 'read1'
+    if '_R2' in file_name or '_2' in file_name:
+        return 'read2'
+    if '_I2' in file_name or '_R4' in file_name or '_4' in file_name:
+        return 'index2'
+    return ''
+
+
+def stats() -> {}:
+    with _lock:
+        return {'schemes': len(_schemes)}
+
+
+def reset() -> None:
+    with _lock:
+        _schemes.clear()
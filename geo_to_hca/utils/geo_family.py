@@ -0,0 +1,92 @@
+"""
+Samples of a GEO series read from its family file.
+
+The samples (GSM) of a GEO series are listed with their title, characteristics and relations to SRA experiments and
+biosamples in the SOFT family file of the series, e.g.
+https://ftp.ncbi.nlm.nih.gov/geo/series/GSE97nnn/GSE97168/soft/GSE97168_family.soft.gz. The file is downloaded once
+from config.GEO_FTP_HOST (so that a local stand-in can serve it) and parsed line by line as it is decompressed, rather
+than looking every sample up with a rate limited esearch and esummary. The data tables of the platforms and samples
+(e.g. microarray probe values) are skipped without being kept.
+"""
+# --- core imports
+import gzip
+import io
+import logging
+import re
+
+# --- application imports
+from geo_to_hca import config
+from geo_to_hca.utils import transport
+from geo_to_hca.utils.records import GeoSample
+
+log = logging.getLogger(__name__)
+
+# relations of a sample to an SRA experiment or biosample, e.g. 'SRA: https://www.ncbi.nlm.nih.gov/sra?term=SRX123'
+SRA_RELATION = 'SRA'
+BIOSAMPLE_RELATION = 'BioSample'
+RELATION_TARGET_PATTERN = re.compile('[^/=]+$')
+
+
+def family_file_url(geo_accession: str) -> str:
+    """
+    Returns the url of the SOFT family file of a GEO series, in the directory of the series of the same thousand
+    (e.g. GSE97nnn for GSE97168).
+    """
+    return f'{config.GEO_FTP_HOST}/geo/series/{geo_accession[:-3]}nnn/{geo_accession}/soft/' \
+           f'{geo_accession}_family.soft.gz'
+
+
+def request_family_samples(geo_accession: str) -> [GeoSample]:
+    """
+    Returns the samples of a GEO series, in the order of its family file.
+    """
+    family_url = family_file_url(geo_accession)
+    response = transport.get(family_url, stream=True)
+    try:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        with io.TextIOWrapper(gzip.GzipFile(fileobj=response.raw), encoding='utf-8', errors='replace') as lines:
+            samples = parse_family_soft(lines)
+    finally:
+        response.close()
+    log.debug(f'{len(samples)} samples of {geo_accession} read from {family_url}')
+    return samples
+
+
+def parse_family_soft(lines) -> [GeoSample]:
+    """
+    Parses the samples of the lines of a SOFT family file, in a single pass.
+    """
+    samples = []
+    sample = None
+    in_table = False
+    for line in lines:
+        if in_table:
+            in_table = not (line.startswith('!') and line.rstrip().endswith('_table_end'))
+            continue
+        if line.startswith('^'):
+            entity, _, accession = line.partition(' = ')
+            sample = GeoSample(accession.strip(), '', None, None, []) if entity == '^SAMPLE' else None
+            if sample:
+                samples.append(sample)
+            continue
+        if not line.startswith('!'):
+            continue
+        key, _, value = line.rstrip('\r\n').partition(' = ')
+        if key.endswith('_table_begin'):
+            in_table = True
+        elif sample is None:
+            continue
+        elif key == '!Sample_title':
+            sample.title = value
+        elif key.startswith('!Sample_characteristics_ch'):
+            tag, separator, tag_value = value.partition(': ')
+            sample.characteristics.append((tag, tag_value) if separator else ('', value))
+        elif key == '!Sample_relation':
+            relation, _, target = value.partition(': ')
+            target = RELATION_TARGET_PATTERN.search(target.strip())
+            if relation == SRA_RELATION and target and sample.experiment is None:
+                sample.experiment = target.group()
+            elif relation == BIOSAMPLE_RELATION and target and sample.biosample is None:
+                sample.biosample = target.group()
+    return samples
@@ -1,13 +1,10 @@
 # --- core imports
 import logging
-import xml.etree.ElementTree as xm
-
-# --- third-party imports
-import requests as rq
 
 # ---application imports
 from geo_to_hca import config
-from geo_to_hca.utils import handle_errors
+from geo_to_hca.utils import europepmc_client
+from geo_to_hca.utils.records import Author, BioSample, Experiment, Grant, Project, Publication
 
 """
 Define constants.
@@ -17,7 +14,7 @@ STATUS_ERROR_CODE = 400
 log = logging.getLogger(__name__)
 
 
-def get_attributes_pubmed(xml_content: object,iteration: int) -> [str,[],[],str]:
+def get_attributes_pubmed(xml_content: object,iteration: int) -> Publication:
     author_list = list()
     grant_list=  list()
     try:
@@ -31,25 +28,9 @@ def get_attributes_pubmed(xml_content: object,iteration: int) -> [str,[],[],str]
     except:
         if iteration == 1:
             log.info("no authors found in SRA")
-        try:
-            url = rq.get(f'https://www.ebi.ac.uk/europepmc/webservices/rest/search?query={title}')
-            if url.status_code == STATUS_ERROR_CODE:
-                raise handle_errors.NotFoundENA(url, title)
-            else:
-                xml_content_2 = xm.fromstring(url.content)
-            try:
-                results = list()
-                result_list = xml_content_2.find("resultList")
-                for result in result_list:
-                    results.append(result)
-            except:
-                authors = None
-                if iteration == 1:
-                    log.info("no authors found in ENA")
-        except:
-            authors = None
-            if iteration == 1:
-                log.info("no authors found in ENA")
+        # EuropePMC used to be searched by title here, but its results only list the authors as a string and were
+        # never used as contributors
+        authors = None
     if authors:
         for author in authors:
             try:
@@ -68,7 +49,7 @@ def get_attributes_pubmed(xml_content: object,iteration: int) -> [str,[],[],str]
                 affiliation = author.find('AffiliationInfo').find("Affiliation").text
             except:
                 affiliation = ''
-            author_list.append([lastname,forename,initials,affiliation])
+            author_list.append(Author(lastname,forename,initials,affiliation))
     try:
         grants = xml_content.find("PubmedArticle").find("MedlineCitation").find("Article").find("GrantList")
     except:
@@ -85,7 +66,7 @@ def get_attributes_pubmed(xml_content: object,iteration: int) -> [str,[],[],str]
                 agency = grant.find("Agency").text
             except:
                 agency = ''
-            grant_list.append([id,agency])
+            grant_list.append(Grant(id,agency))
     try:
         articles = xml_content.find('PubmedArticle').find('PubmedData').find('ArticleIdList')
         for article_id in articles:
@@ -95,10 +76,10 @@ def get_attributes_pubmed(xml_content: object,iteration: int) -> [str,[],[],str]
         article_doi_id = ''
         if iteration == 1:
             log.info("no publication doi found")
-    return title,author_list,grant_list,article_doi_id
+    return Publication(title,author_list,grant_list,article_doi_id)
 
 
-def get_attributes_biosample(element: object) -> []:
+def get_attributes_biosample(element: object) -> BioSample:
     """
     Extracts sample metadata from an an xml file which consists of many attributes.
     The xml is derived from a request with biosample accessions.
@@ -121,10 +102,10 @@ def get_attributes_biosample(element: object) -> []:
             attribute_list.append(attribute.text)
     if attribute_list == []:
         attribute_list = ['','']
-    return [element_id,sample_title,attribute_list]
+    return BioSample(element_id,sample_title,attribute_list)
 
 
-def get_attributes_library_protocol(experiment_package: object) -> []:
+def get_attributes_library_protocol(experiment_package: object) -> Experiment:
     """
     Extracts experiment metadata from an an xml file which consists of many attributes.
     The xml is derived from a request with experiment accessions.
@@ -146,10 +127,10 @@ def get_attributes_library_protocol(experiment_package: object) -> []:
             instrument = illumina.find('INSTRUMENT_MODEL').text
         else:
             instrument = ''
-    return [experiment_id,library_construction_protocol,instrument]
+    return Experiment(experiment_id,library_construction_protocol,instrument)
 
 
-def get_attributes_bioproject(xml_content: object, bioproject_accession: str) -> [str,str,str,str]:
+def get_attributes_bioproject(xml_content: object, bioproject_accession: str) -> Project:
     bioproject_metadata = xml_content.find('DocumentSummary')
     project_metadata = bioproject_metadata.find("Project")
     project_description = project_metadata.find('ProjectDescr')
@@ -184,7 +165,7 @@ def get_attributes_bioproject(xml_content: object, bioproject_accession: str) ->
         project_title = ''
         project_name = ''
         project_pubmed_id = ''
-    return project_name, project_title, project_description, project_pubmed_id
+    return Project(project_name, project_title, project_description, project_pubmed_id)
 
 
 def search_europepmc_for_publication(project_title, key):
@@ -192,34 +173,22 @@ def search_europepmc_for_publication(project_title, key):
     project_pubmed_id = ''
     if project_title:
         log.info(f"{key} is: {project_title}")
-        url = rq.get(f'https://www.ebi.ac.uk/europepmc/webservices/rest/search',
-                     params={
-                         "query": project_title
-                     })
         # the purpose here is to find the publication (pmid) when no citation is available
         # in geo.
         # Enrique's process is to serach for the matching titles from EuroPMC
         # in google and if the text is available look for the geo accession
-        if url.status_code == STATUS_ERROR_CODE:
-            raise handle_errors.NotFoundENA(url, project_title)
-        else:
-            xml_content = xm.fromstring(url.content)
-            try:
-                result_list = xml_content.find("resultList")
-                for result in result_list:
-                    journal_title = result.find("journalTitle").text
-                    if not journal_title or journal_title == '':
-                        log.info(f"no publication results for {key} in ENA")
-                    else:
-                        if config.IS_INTERACTIVE:
-                            answer = input(f"A publication title has been found: {journal_title}.\n"
-                                           f"Is this the publication title associated with the GEO accession? [y/n]: ")
-                            if answer.lower() in ['y', "yes"]:
-                                project_pubmed_id = result.find("pmid").text
-                                break
-                        else:
-                            project_pubmed_id = result.find("pmid").text
-                            break
-            except:
-                log.warning(f"no publication results for {key} in ENA")
+        for result in europepmc_client.search(project_title):
+            journal_title = result.get("journalTitle")
+            if not journal_title or not result.get("pmid"):
+                log.info(f"no publication results for {key} in ENA")
+            else:
+                if config.IS_INTERACTIVE:
+                    answer = input(f"A publication title has been found: {journal_title}.\n"
+                                   f"Is this the publication title associated with the GEO accession? [y/n]: ")
+                    if answer.lower() in ['y', "yes"]:
+                        project_pubmed_id = result["pmid"]
+                        break
+                else:
+                    project_pubmed_id = result["pmid"]
+                    break
     return project_pubmed_id
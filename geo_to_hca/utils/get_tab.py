@@ -1,5 +1,4 @@
 # --- core imports
-from functools import partial
 import logging
 
 # --- third-party imports
@@ -7,83 +6,113 @@ import pandas as pd
 
 # ---application imports
 from geo_to_hca.utils import utils
+from geo_to_hca.utils.records import Author, BioSample, Experiment, FastqFile, Grant, Project, Publication, Run
 
 log = logging.getLogger(__name__)
 
 
-def get_sequence_file_tab_xls(srp_metadata_update: pd.DataFrame,workbook: object,tab_name: str) -> pd.DataFrame:
+def index_runs(runs: [Run], key: str) -> {}:
     """
-    Fills Sequence file metadata fields where the required fields are available in the input dataframe. Writes this tab.
+    Indexes runs by the accession of their experiment or biosample (key: 'experiment' or 'biosample'), keeping the
+    first run of each accession in the order of the runs.
+    """
+    runs_by_key = {}
+    for run in runs:
+        runs_by_key.setdefault(getattr(run, key), run)
+    return runs_by_key
+
+
+def sequence_file_row(run: Run, fastq_file: FastqFile) -> {}:
+    """
+    Fills Sequence file metadata fields for a single fastq file of a run, or for the run alone if no fastq file is
+    available (fastq_file is None).
+    """
+    if fastq_file:
+        file_name, read_index, lane_index = fastq_file.name, fastq_file.read_index, fastq_file.lane_index
+    else:
+        file_name, read_index, lane_index = '', '', ''
+    return {'sequence_file.file_core.file_name': file_name,
+            'sequence_file.file_core.format': 'fastq.gz',
+            'sequence_file.file_core.content_description.text':'DNA sequence',
+            'sequence_file.read_index': read_index,
+            'sequence_file.lane_index': lane_index,
+            'sequence_file.insdc_run_accessions': run.accession,
+            'process.insdc_experiment.insdc_experiment_accession': run.experiment,
+            'cell_suspension.biomaterial_core.biomaterial_id':run.experiment,
+            'library_preparation_protocol.protocol_core.protocol_id':'',
+            'sequencing_protocol.protocol_core.protocol_id':'',
+            'process.process_core.process_id':run.accession}
+
+
+def get_sequence_file_tab_xls(run_files: [(Run, FastqFile)],workbook: object,tab_name: str) -> pd.DataFrame:
+    """
+    Fills Sequence file metadata fields for each (run, fastq file) pair of the integrated study metadata. Writes this tab.
     """
     tab = utils.get_empty_df(workbook,tab_name)
-    for index,row in srp_metadata_update.iterrows():
-        tab = tab.append({'sequence_file.file_core.file_name': row['fastq_name'],
-                          'sequence_file.file_core.format': 'fastq.gz',
-                          'sequence_file.file_core.content_description.text':'DNA sequence',
-                          'sequence_file.read_index': row['file_index'],
-                          'sequence_file.lane_index': row['lane_index'],
-                          'sequence_file.insdc_run_accessions': row['Run'],
-                          'process.insdc_experiment.insdc_experiment_accession': row['Experiment'],
-                          'cell_suspension.biomaterial_core.biomaterial_id':row['Experiment'],
-                          'library_preparation_protocol.protocol_core.protocol_id':'',
-                          'sequencing_protocol.protocol_core.protocol_id':'',
-                          'process.process_core.process_id':row['Run']}, ignore_index=True)
+    tab = tab.append([sequence_file_row(run, fastq_file) for run, fastq_file in run_files], ignore_index=True)
     tab = tab.sort_values(by='sequence_file.insdc_run_accessions')
     return tab
 
 
-def get_cell_suspension_tab_xls(srp_metadata_update: pd.DataFrame,workbook: object,tab_name: str) -> None:
+def cell_suspension_row(run: Run) -> {}:
     """
-    Fills Cell suspension metadata fields where the required fields are available in the input dataframe. Writes this tab.
+    Fills Cell suspension metadata fields for an experiment, given the first run of that experiment.
+    """
+    return {'cell_suspension.biomaterial_core.biomaterial_id':run.experiment,
+            'cell_suspension.biomaterial_core.biomaterial_name':run.sample_name,
+            'specimen_from_organism.biomaterial_core.biomaterial_id':run.biosample,
+            'cell_suspension.biomaterial_core.ncbi_taxon_id':run.taxon_id,
+            'cell_suspension.genus_species.text':run.scientific_name,
+            'cell_suspension.biomaterial_core.biosamples_accession':run.biosample}
+
+
+def get_cell_suspension_tab_xls(runs: [Run],workbook: object,tab_name: str) -> None:
+    """
+    Fills Cell suspension metadata fields where the required fields are available in the study runs. Writes this tab.
     """
     tab = utils.get_empty_df(workbook, tab_name)
-    experiments_dedup = list(set(list(srp_metadata_update['Experiment'])))
-    for experiment in experiments_dedup:
-        biosample = list(srp_metadata_update.loc[srp_metadata_update['Experiment'] == experiment]['BioSample'])[0]
-        gsm_sample = list(srp_metadata_update.loc[srp_metadata_update['Experiment'] == experiment]['SampleName'])[0]
-        tab = tab.append({'cell_suspension.biomaterial_core.biomaterial_id':experiment,
-                          'cell_suspension.biomaterial_core.biomaterial_name':gsm_sample,
-                         'specimen_from_organism.biomaterial_core.biomaterial_id':biosample,
-                          'cell_suspension.biomaterial_core.ncbi_taxon_id':list(srp_metadata_update.loc[srp_metadata_update['Experiment'] == experiment]['TaxID'])[0],
-                         'cell_suspension.genus_species.text':list(srp_metadata_update.loc[srp_metadata_update['Experiment'] == experiment]['ScientificName'])[0],
-                         'cell_suspension.biomaterial_core.biosamples_accession':biosample}, ignore_index=True)
+    experiments = index_runs(runs, 'experiment')
+    tab = tab.append([cell_suspension_row(run) for run in experiments.values()], ignore_index=True)
     tab = tab.sort_values(by='cell_suspension.biomaterial_core.biomaterial_id')
     utils.write_to_wb(workbook, tab_name, tab)
 
-def process_specimen_from_organism(biosample_attribute_list: [],srp_metadata_update: pd.DataFrame) -> pd.DataFrame:
+def process_specimen_from_organism(biosample: BioSample,run: Run) -> {}:
     """
-    Fills Specimen from organism metadata fields where the required fields are available in the input biosample attribute list.
+    Fills Specimen from organism metadata fields from the biosample metadata and the first run of the biosample.
     """
-    df = {'specimen_from_organism.biomaterial_core.biomaterial_id':biosample_attribute_list[0],
-          'specimen_from_organism.biomaterial_core.biomaterial_name':biosample_attribute_list[1],
-          'specimen_from_organism.biomaterial_core.biomaterial_description': ','.join(biosample_attribute_list[2]),
-          'specimen_from_organism.biomaterial_core.ncbi_taxon_id': list(srp_metadata_update.loc[srp_metadata_update['BioSample'] == biosample_attribute_list[0]]['TaxID'])[0],
-          'specimen_from_organism.genus_species.text': list(srp_metadata_update.loc[srp_metadata_update['BioSample'] == biosample_attribute_list[0]]['ScientificName'])[0],
-          'specimen_from_organism.genus_species.ontology_label': list(srp_metadata_update.loc[srp_metadata_update['BioSample'] == biosample_attribute_list[0]]['ScientificName'])[0],
-          'specimen_from_organism.biomaterial_core.biosamples_accession': biosample_attribute_list[0],
-          'specimen_from_organism.biomaterial_core.insdc_sample_accession': list(srp_metadata_update.loc[srp_metadata_update['BioSample'] == biosample_attribute_list[0]]['Sample'])[0],
+    df = {'specimen_from_organism.biomaterial_core.biomaterial_id':biosample.accession,
+          'specimen_from_organism.biomaterial_core.biomaterial_name':biosample.title,
+          'specimen_from_organism.biomaterial_core.biomaterial_description': ','.join(biosample.attributes),
+          'specimen_from_organism.biomaterial_core.ncbi_taxon_id': run.taxon_id,
+          'specimen_from_organism.genus_species.text': run.scientific_name,
+          'specimen_from_organism.genus_species.ontology_label': run.scientific_name,
+          'specimen_from_organism.biomaterial_core.biosamples_accession': biosample.accession,
+          'specimen_from_organism.biomaterial_core.insdc_sample_accession': run.sample,
           'collection_protocol.protocol_core.protocol_id':'',
-          'process.insdc_experiment.insdc_experiment_accession':srp_metadata_update[srp_metadata_update['BioSample'] == biosample_attribute_list[0]]['Experiment'].values.tolist()[0]}
+          'process.insdc_experiment.insdc_experiment_accession':run.experiment}
     return df
 
 
-def get_specimen_from_organism_tab_xls(srp_metadata_update: pd.DataFrame,workbook: object,nthreads: int,tab_name: str) -> None:
+def get_specimen_from_organism_tab_xls(runs: [Run],workbook: object,nthreads: int,tab_name: str) -> None:
     """
     Fills Specimen from organism metadata fields based on sample metadata obtained via a request to NCBI SRA
     database with biosample accessions. If specified number of threads nthreads > 1, this function will be
     run in parallel with nthreads. Writes this tab.
     """
     tab = utils.get_empty_df(workbook, tab_name)
-    biosample_accessions = list(set(list(srp_metadata_update['BioSample'])))
-    attribute_lists = utils.fetch_experimental_metadata(biosample_accessions,accession_type='biosample')
+    runs_by_biosample = index_runs(runs, 'biosample')
+    biosamples = utils.fetch_experimental_metadata(list(runs_by_biosample),accession_type='biosample')
+    specimens = [(biosample, runs_by_biosample[biosample.accession]) for biosample in biosamples]
     results = None
-    if attribute_lists:
+    if specimens and nthreads > 1:
         try:
             with utils.poolcontext(processes=nthreads) as pool:
-                results = pool.map(partial(process_specimen_from_organism, srp_metadata_update=srp_metadata_update), attribute_lists)
+                results = pool.starmap(process_specimen_from_organism, specimens)
         except KeyboardInterrupt:
             log.info("Process has been interrupted.")
             pool.terminate()
+    elif specimens:
+        results = [process_specimen_from_organism(biosample, run) for biosample, run in specimens]
     if results:
         df = pd.DataFrame(results)
         tab = tab.append(df,sort=True)
@@ -91,265 +120,324 @@ def get_specimen_from_organism_tab_xls(srp_metadata_update: pd.DataFrame,workboo
         utils.write_to_wb(workbook, tab_name, tab)
 
 
-def get_library_protocol_tab_xls(srp_metadata_update: pd.DataFrame,workbook: object,tab_name: str) -> [{},[]]:
+def library_protocol_row(library_protocol_id: str,library_protocol: str) -> {}:
+    """
+    Fills Library preparation protocol metadata fields for a library construction protocol description. Returns None
+    if the library construction method could not be identified.
+    """
+    tmp_dict = {'library_preparation_protocol.protocol_core.protocol_id':library_protocol_id,
+                'library_preparation_protocol.protocol_core.protocol_description': library_protocol,
+                'library_preparation_protocol.input_nucleic_acid_molecule.text': 'polyA RNA',
+                'library_preparation_protocol.nucleic_acid_source':'single cell'}
+    if "10X" in library_protocol:
+        if "v.2" or "v2" or 'V2' or 'V.2' in library_protocol:
+            if "3'" in library_protocol:
+                tmp_dict.update({'library_preparation_protocol.cell_barcode.barcode_read': 'Read1',
+                                'library_preparation_protocol.cell_barcode.barcode_offset': 0,
+                                'library_preparation_protocol.cell_barcode.barcode_length': 16,
+                                'library_preparation_protocol.library_construction_method.text':"10X 3' v2 sequencing",
+                                'library_preparation_protocol.library_construction_kit.retail_name': 'Single Cell 3’ Reagent Kit v2',
+                                'library_preparation_protocol.library_construction_kit.manufacturer': '10X Genomics',
+                                'library_preparation_protocol.end_bias':'3 prime tag',
+                                'library_preparation_protocol.primer':'poly-dT',
+                                'library_preparation_protocol.strand':'first',
+                                'library_preparation_protocol.umi_barcode.barcode_read':'Read1',
+                                'library_preparation_protocol.umi_barcode.barcode_offset':16,
+                                'library_preparation_protocol.umi_barcode.barcode_length':10})
+            elif "5'" in library_protocol:
+                log.info("Please let Ami know that you have come across a 10X v2 5' dataset")
+                tmp_dict.update({'library_preparation_protocol.cell_barcode.barcode_read': 'Read1',
+                                'library_preparation_protocol.cell_barcode.barcode_offset': 0,
+                                'library_preparation_protocol.cell_barcode.barcode_length': 16,
+                                'library_preparation_protocol.library_construction_method.text':"10X 5' v2 sequencing",
+                                'library_preparation_protocol.library_construction_kit.retail_name': 'Single Cell 5’ Reagent Kit v2',
+                                'library_preparation_protocol.library_construction_kit.manufacturer': '10X Genomics',
+                                'library_preparation_protocol.end_bias':'5 prime tag',
+                                'library_preparation_protocol.primer':'poly-dT',
+                                'library_preparation_protocol.strand':'first',
+                                'library_preparation_protocol.umi_barcode.barcode_read':'Read1',
+                                'library_preparation_protocol.umi_barcode.barcode_offset':16,
+                                'library_preparation_protocol.umi_barcode.barcode_length':10})
+        elif "v.3" or "v3" or 'V3' or 'V.3' in library_protocol:
+            tmp_dict.update({'library_preparation_protocol.cell_barcode.barcode_read': 'Read1',
+                            'library_preparation_protocol.cell_barcode.barcode_offset': 0,
+                            'library_preparation_protocol.cell_barcode.barcode_length': 16,
+                            'library_preparation_protocol.library_construction_method.text':"10X 3' v3 sequencing",
+                            'library_preparation_protocol.library_construction_kit.retail_name': 'Single Cell 3’ Reagent Kit v3',
+                            'library_preparation_protocol.library_construction_kit.manufacturer': '10X Genomics',
+                            'library_preparation_protocol.end_bias':'3 prime tag',
+                            'library_preparation_protocol.primer':'poly-dT',
+                            'library_preparation_protocol.strand':'first',
+                            'library_preparation_protocol.umi_barcode.barcode_read':'"Read1',
+                            'library_preparation_protocol.umi_barcode.barcode_offset':16,
+                            'library_preparation_protocol.umi_barcode.barcode_length':12})
+        elif "v.1" or "v1" or 'V1' or 'V.1' in library_protocol:
+            tmp_dict.update({'library_preparation_protocol.cell_barcode.barcode_read': 'Read1',
+                            'library_preparation_protocol.cell_barcode.barcode_offset': 0,
+                            'library_preparation_protocol.cell_barcode.barcode_length': 14,
+                            'library_preparation_protocol.library_construction_method.text':"10X v1 sequencing",
+                            'library_preparation_protocol.library_construction_kit.retail_name': 'Single Cell Reagent Kit v1',
+                            'library_preparation_protocol.library_construction_kit.manufacturer': '10X Genomics',
+                            'library_preparation_protocol.end_bias':'',
+                            'library_preparation_protocol.primer':'poly-dT',
+                            'library_preparation_protocol.strand':'first',
+                            'library_preparation_protocol.umi_barcode.barcode_read':'Read1',
+                            'library_preparation_protocol.umi_barcode.barcode_offset':14,
+                            'library_preparation_protocol.umi_barcode.barcode_length':10})
+        else:
+            tmp_dict.update({'library_preparation_protocol.library_construction_method.text': "10X sequencing",
+                             'library_preparation_protocol.library_construction_kit.manufacturer': '10X Genomics'})
+        return tmp_dict
+    elif 'Drop-seq' or 'drop-seq' or 'DropSeq' or 'Dropseq' in library_protocol:
+        tmp_dict.update({'library_preparation_protocol.cell_barcode.barcode_read': 'Read1',
+                         'library_preparation_protocol.cell_barcode.barcode_offset': 0,
+                         'library_preparation_protocol.cell_barcode.barcode_length': 12,
+                         'library_preparation_protocol.library_construction_method.text': "Drop-seq",
+                         'library_preparation_protocol.library_construction_kit.retail_name': '',
+                         'library_preparation_protocol.library_construction_kit.manufacturer': '',
+                         'library_preparation_protocol.end_bias': '',
+                         'library_preparation_protocol.primer': 'poly-dT',
+                         'library_preparation_protocol.strand': 'first',
+                         'library_preparation_protocol.umi_barcode.barcode_read': 'Read1',
+                         'library_preparation_protocol.umi_barcode.barcode_offset': 12,
+                         'library_preparation_protocol.umi_barcode.barcode_length': 8})
+        return tmp_dict
+    elif 'Smart-seq' or 'smart-seq' or 'Smartseq' or 'SmartSeq' or 'plate' or 'Plate' in library_protocol:
+        tmp_dict.update({'library_preparation_protocol.cell_barcode.barcode_read': '',
+                         'library_preparation_protocol.cell_barcode.barcode_offset': '',
+                         'library_preparation_protocol.cell_barcode.barcode_length': '',
+                         'library_preparation_protocol.library_construction_method.text': 'Smart-seq2',
+                         'library_preparation_protocol.library_construction_kit.retail_name': '',
+                         'library_preparation_protocol.library_construction_kit.manufacturer': '',
+                         'library_preparation_protocol.end_bias': 'full length',
+                         'library_preparation_protocol.primer': 'poly-dT',
+                         'library_preparation_protocol.strand': 'unstranded',
+                         'library_preparation_protocol.umi_barcode.barcode_read': '',
+                         'library_preparation_protocol.umi_barcode.barcode_offset': '',
+                         'library_preparation_protocol.umi_barcode.barcode_length': ''})
+        return tmp_dict
+    else:
+        return None
+
+
+class LibraryProtocols:
+    """
+    Assigns library preparation protocol ids to experiments: experiments with the same library construction protocol
+    description share a protocol id. Experiments can be registered in several batches (e.g. per chunk of a large study).
+    """
+    def __init__(self):
+        self.count = 0
+        # library construction protocol description -> library preparation protocol id
+        self.library_protocol_ids = {}
+        # experiment accession -> library preparation protocol id
+        self.protocol_ids = {}
+
+    def register(self, experiment: Experiment) -> {}:
+        """
+        Registers the metadata of a single experiment. Returns the Library preparation protocol tab row if the
+        experiment uses a library protocol which was not registered before, otherwise None.
+        """
+        library_protocol = experiment.library_construction_protocol
+        row = None
+        if library_protocol not in self.library_protocol_ids:
+            self.count += 1
+            library_protocol_id = "library_protocol_" + str(self.count)
+            self.library_protocol_ids[library_protocol] = library_protocol_id
+            row = library_protocol_row(library_protocol_id, library_protocol)
+        self.protocol_ids[str(experiment.accession)] = self.library_protocol_ids[library_protocol]
+        return row
+
+
+def get_library_protocol_tab_xls(runs: [Run],workbook: object,tab_name: str) -> [{},[Experiment]]:
     """
     Fills Library preparation protocol metadata fields based on experiment metadata obtained via a request to NCBI SRA
-    database with experiment accessions. Writes this tab.
+    database with experiment accessions. Writes this tab. Returns the library preparation protocol ids of the
+    experiments and the experiment metadata.
     """
     tab = utils.get_empty_df(workbook, tab_name)
-    experiment_accessions = list(set(list(srp_metadata_update['Experiment'])))
-    count = 0
-    library_protocol_set = list()
-    library_protocol_dict = {}
-    attribute_lists = utils.fetch_experimental_metadata(experiment_accessions,accession_type='experiment')
-    for attribute_list in attribute_lists:
-        experiment_accession = str(attribute_list[0])
-        library_protocol = attribute_list[1]
-        if library_protocol not in library_protocol_set:
-            count += 1
-            library_protocol_id = "library_protocol_" + str(count)
-            library_protocol_set.append(library_protocol)
-            tmp_dict = {'library_preparation_protocol.protocol_core.protocol_id':library_protocol_id,
-                              'library_preparation_protocol.protocol_core.protocol_description': library_protocol,
-                              'library_preparation_protocol.input_nucleic_acid_molecule.text': 'polyA RNA',
-                              'library_preparation_protocol.nucleic_acid_source':'single cell'}
-            library_protocol_dict[experiment_accession] = {"library_protocol_id":library_protocol_id,"library_protocol_description":library_protocol}
-            if "10X" in library_protocol:
-                if "v.2" or "v2" or 'V2' or 'V.2' in library_protocol:
-                    if "3'" in library_protocol:
-                        tmp_dict.update({'library_preparation_protocol.cell_barcode.barcode_read': 'Read1',
-                                        'library_preparation_protocol.cell_barcode.barcode_offset': 0,
-                                        'library_preparation_protocol.cell_barcode.barcode_length': 16,
-                                        'library_preparation_protocol.library_construction_method.text':"10X 3' v2 sequencing",
-                                        'library_preparation_protocol.library_construction_kit.retail_name': 'Single Cell 3’ Reagent Kit v2',
-                                        'library_preparation_protocol.library_construction_kit.manufacturer': '10X Genomics',
-                                        'library_preparation_protocol.end_bias':'3 prime tag',
-                                        'library_preparation_protocol.primer':'poly-dT',
-                                        'library_preparation_protocol.strand':'first',
-                                        'library_preparation_protocol.umi_barcode.barcode_read':'Read1',
-                                        'library_preparation_protocol.umi_barcode.barcode_offset':16,
-                                        'library_preparation_protocol.umi_barcode.barcode_length':10})
-                    elif "5'" in library_protocol:
-                        log.info("Please let Ami know that you have come across a 10X v2 5' dataset")
-                        tmp_dict.update({'library_preparation_protocol.cell_barcode.barcode_read': 'Read1',
-                                        'library_preparation_protocol.cell_barcode.barcode_offset': 0,
-                                        'library_preparation_protocol.cell_barcode.barcode_length': 16,
-                                        'library_preparation_protocol.library_construction_method.text':"10X 5' v2 sequencing",
-                                        'library_preparation_protocol.library_construction_kit.retail_name': 'Single Cell 5’ Reagent Kit v2',
-                                        'library_preparation_protocol.library_construction_kit.manufacturer': '10X Genomics',
-                                        'library_preparation_protocol.end_bias':'5 prime tag',
-                                        'library_preparation_protocol.primer':'poly-dT',
-                                        'library_preparation_protocol.strand':'first',
-                                        'library_preparation_protocol.umi_barcode.barcode_read':'Read1',
-                                        'library_preparation_protocol.umi_barcode.barcode_offset':16,
-                                        'library_preparation_protocol.umi_barcode.barcode_length':10})
-                elif "v.3" or "v3" or 'V3' or 'V.3' in library_protocol:
-                    tmp_dict.update({'library_preparation_protocol.cell_barcode.barcode_read': 'Read1',
-                                    'library_preparation_protocol.cell_barcode.barcode_offset': 0,
-                                    'library_preparation_protocol.cell_barcode.barcode_length': 16,
-                                    'library_preparation_protocol.library_construction_method.text':"10X 3' v3 sequencing",
-                                    'library_preparation_protocol.library_construction_kit.retail_name': 'Single Cell 3’ Reagent Kit v3',
-                                    'library_preparation_protocol.library_construction_kit.manufacturer': '10X Genomics',
-                                    'library_preparation_protocol.end_bias':'3 prime tag',
-                                    'library_preparation_protocol.primer':'poly-dT',
-                                    'library_preparation_protocol.strand':'first',
-                                    'library_preparation_protocol.umi_barcode.barcode_read':'"Read1',
-                                    'library_preparation_protocol.umi_barcode.barcode_offset':16,
-                                    'library_preparation_protocol.umi_barcode.barcode_length':12})
-                elif "v.1" or "v1" or 'V1' or 'V.1' in library_protocol:
-                    tmp_dict.update({'library_preparation_protocol.cell_barcode.barcode_read': 'Read1',
-                                    'library_preparation_protocol.cell_barcode.barcode_offset': 0,
-                                    'library_preparation_protocol.cell_barcode.barcode_length': 14,
-                                    'library_preparation_protocol.library_construction_method.text':"10X v1 sequencing",
-                                    'library_preparation_protocol.library_construction_kit.retail_name': 'Single Cell Reagent Kit v1',
-                                    'library_preparation_protocol.library_construction_kit.manufacturer': '10X Genomics',
-                                    'library_preparation_protocol.end_bias':'',
-                                    'library_preparation_protocol.primer':'poly-dT',
-                                    'library_preparation_protocol.strand':'first',
-                                    'library_preparation_protocol.umi_barcode.barcode_read':'Read1',
-                                    'library_preparation_protocol.umi_barcode.barcode_offset':14,
-                                    'library_preparation_protocol.umi_barcode.barcode_length':10})
-                else:
-                    tmp_dict.update({'library_preparation_protocol.library_construction_method.text': "10X sequencing",
-                                     'library_preparation_protocol.library_construction_kit.manufacturer': '10X Genomics'})
-                tab = tab.append(tmp_dict, ignore_index=True)
-            elif 'Drop-seq' or 'drop-seq' or 'DropSeq' or 'Dropseq' in library_protocol:
-                tmp_dict.update({'library_preparation_protocol.cell_barcode.barcode_read': 'Read1',
-                                 'library_preparation_protocol.cell_barcode.barcode_offset': 0,
-                                 'library_preparation_protocol.cell_barcode.barcode_length': 12,
-                                 'library_preparation_protocol.library_construction_method.text': "Drop-seq",
-                                 'library_preparation_protocol.library_construction_kit.retail_name': '',
-                                 'library_preparation_protocol.library_construction_kit.manufacturer': '',
-                                 'library_preparation_protocol.end_bias': '',
-                                 'library_preparation_protocol.primer': 'poly-dT',
-                                 'library_preparation_protocol.strand': 'first',
-                                 'library_preparation_protocol.umi_barcode.barcode_read': 'Read1',
-                                 'library_preparation_protocol.umi_barcode.barcode_offset': 12,
-                                 'library_preparation_protocol.umi_barcode.barcode_length': 8})
-                tab = tab.append(tmp_dict, ignore_index=True)
-            elif 'Smart-seq' or 'smart-seq' or 'Smartseq' or 'SmartSeq' or 'plate' or 'Plate' in library_protocol:
-                tmp_dict.update({'library_preparation_protocol.cell_barcode.barcode_read': '',
-                                 'library_preparation_protocol.cell_barcode.barcode_offset': '',
-                                 'library_preparation_protocol.cell_barcode.barcode_length': '',
-                                 'library_preparation_protocol.library_construction_method.text': 'Smart-seq2',
-                                 'library_preparation_protocol.library_construction_kit.retail_name': '',
-                                 'library_preparation_protocol.library_construction_kit.manufacturer': '',
-                                 'library_preparation_protocol.end_bias': 'full length',
-                                 'library_preparation_protocol.primer': 'poly-dT',
-                                 'library_preparation_protocol.strand': 'unstranded',
-                                 'library_preparation_protocol.umi_barcode.barcode_read': '',
-                                 'library_preparation_protocol.umi_barcode.barcode_offset': '',
-                                 'library_preparation_protocol.umi_barcode.barcode_length': ''})
-                tab = tab.append(tmp_dict, ignore_index=True)
-            else:
-                tab = tab
-        if library_protocol in library_protocol_set:
-            tab = tab
-            for key in library_protocol_dict.keys():
-                if library_protocol_dict[key]["library_protocol_description"] == library_protocol:
-                    library_protocol_id = library_protocol_dict[key]["library_protocol_id"]
-            if not library_protocol_id:
-                library_protocol_id = ''
-            else:
-                library_protocol_dict[experiment_accession] = {"library_protocol_id":library_protocol_id,"library_protocol_description":
-                library_protocol}
+    experiment_accessions = list(index_runs(runs, 'experiment'))
+    experiments = utils.fetch_experimental_metadata(experiment_accessions,accession_type='experiment')
+    library_protocols = LibraryProtocols()
+    rows = [library_protocols.register(experiment) for experiment in experiments]
+    tab = tab.append([row for row in rows if row], ignore_index=True)
     utils.write_to_wb(workbook, tab_name, tab)
-    return library_protocol_dict,attribute_lists
+    return library_protocols.protocol_ids,experiments
 
 
-def get_sequencing_protocol_tab_xls(workbook: object,attribute_lists: [],tab_name: str) -> {}:
+class SequencingProtocols:
     """
-    Fills Sequencing protocol metadata fields based on experiment metadata obtained via a previous request to NCBI SRA
-    database with experiment accessions (attribute_lists). Writes this tab.
+    Assigns sequencing protocol ids to experiments: experiments with the same instrument and sequencing method share
+    a protocol id. Experiments can be registered in several batches (e.g. per chunk of a large study).
     """
-    tab = utils.get_empty_df(workbook, tab_name)
-    count = 0
-    sequencing_protocol_id = "sequencing_protocol_1"
-    sequencing_protocol_set = list()
-    sequencing_protocol_dict = {}
-    for attribute_list in attribute_lists:
-        experiment = attribute_list[0]
-        library_construction_protocol = attribute_list[1]
-        instrument = attribute_list[2]
+    def __init__(self):
+        self.count = 0
+        # (instrument, method) -> sequencing protocol id
+        self.sequencing_protocol_ids = {}
+        # experiment accession -> sequencing protocol id
+        self.protocol_ids = {}
+
+    def register(self, experiment: Experiment) -> {}:
+        """
+        Registers the metadata of a single experiment. Returns the Sequencing protocol tab row if the experiment uses
+        a sequencing protocol which was not registered before, otherwise None.
+        """
+        library_construction_protocol = experiment.library_construction_protocol
+        instrument = experiment.instrument
         if "10X" in library_construction_protocol:
             paired_end = 'no'
             method = 'tag based single cell RNA sequencing'
         elif "10X" not in library_construction_protocol:
             paired_end = ''
             method = ''
-        sequencing_protocol_description = [instrument,method]
-        if sequencing_protocol_description not in sequencing_protocol_set:
-            count += 1
-            sequencing_protocol_id = "sequencing_protocol_" + str(count)
-            sequencing_protocol_set.append(sequencing_protocol_description)
-            sequencing_protocol_dict[experiment] = {"sequencing_protocol_id":sequencing_protocol_id,
-                                                    "sequencing_protocol_description":sequencing_protocol_description}
-            tab = tab.append({'sequencing_protocol.protocol_core.protocol_id': sequencing_protocol_id,
-                              'sequencing_protocol.instrument_manufacturer_model.text': instrument,
-                              'sequencing_protocol.paired_end': paired_end,
-                              'sequencing_protocol.method.text': method}, ignore_index=True)
-        if sequencing_protocol_description in sequencing_protocol_set:
-            tab = tab
-            for key in sequencing_protocol_dict.keys():
-                if sequencing_protocol_dict[key]["sequencing_protocol_description"] == sequencing_protocol_description:
-                    sequencing_protocol_id = sequencing_protocol_dict[key]["sequencing_protocol_id"]
-            if not sequencing_protocol_id:
-                sequencing_protocol_id = ''
-            else:
-                sequencing_protocol_dict[experiment] = {"sequencing_protocol_id":sequencing_protocol_id,
-                                                    "sequencing_protocol_description":sequencing_protocol_description}
+        sequencing_protocol_description = (instrument,method)
+        row = None
+        if sequencing_protocol_description not in self.sequencing_protocol_ids:
+            self.count += 1
+            sequencing_protocol_id = "sequencing_protocol_" + str(self.count)
+            self.sequencing_protocol_ids[sequencing_protocol_description] = sequencing_protocol_id
+            row = {'sequencing_protocol.protocol_core.protocol_id': sequencing_protocol_id,
+                   'sequencing_protocol.instrument_manufacturer_model.text': instrument,
+                   'sequencing_protocol.paired_end': paired_end,
+                   'sequencing_protocol.method.text': method}
+        self.protocol_ids[experiment.accession] = self.sequencing_protocol_ids[sequencing_protocol_description]
+        return row
+
+
+def get_sequencing_protocol_tab_xls(workbook: object,experiments: [Experiment],tab_name: str) -> {}:
+    """
+    Fills Sequencing protocol metadata fields based on experiment metadata obtained via a previous request to NCBI SRA
+    database with experiment accessions. Writes this tab. Returns the sequencing protocol ids of the experiments.
+    """
+    tab = utils.get_empty_df(workbook, tab_name)
+    sequencing_protocols = SequencingProtocols()
+    rows = [sequencing_protocols.register(experiment) for experiment in experiments]
+    tab = tab.append([row for row in rows if row], ignore_index=True)
     utils.write_to_wb(workbook, tab_name, tab)
-    return sequencing_protocol_dict
+    return sequencing_protocols.protocol_ids
+
+
+def sequence_file_protocol_ids(experiment: str,library_protocol_ids: {},sequencing_protocol_ids: {}) -> [str,str]:
+    """
+    Returns the library preparation protocol id and the sequencing protocol id associated with an experiment
+    (Cell suspension), or empty strings if none is known.
+    """
+    return library_protocol_ids.get(experiment, ''),sequencing_protocol_ids.get(experiment, '')
 
 
-def update_sequence_file_tab_xls(sequence_file_tab: pd.DataFrame,library_protocol_dict: {},sequencing_protocol_dict: {},workbook: object,tab_name: str) -> None:
+def update_sequence_file_tab_xls(sequence_file_tab: pd.DataFrame,library_protocol_ids: {},sequencing_protocol_ids: {},workbook: object,tab_name: str) -> None:
     """
     Updates and writes the Sequencing file tab based on the unique Library preparation protocols and Sequencing file protocols obtained previously
-    (stored in the input dictionaries: library_protocol_dict and  sequencing_protocol_dict). Specifically this function adds which unique
+    (stored in the input dictionaries: library_protocol_ids and sequencing_protocol_ids, keyed by experiment). Specifically this function adds which unique
     library protocol id and sequencing protocol id is associated with each Cell suspension and run accession in the Sequence file tab.
     """
     library_protocol_id_list = list()
     sequencing_protocol_id_list = list()
-    for index,row in sequence_file_tab.iterrows():
-        if row["cell_suspension.biomaterial_core.biomaterial_id"] in library_protocol_dict.keys():
-            library_protocol_id_list.append(library_protocol_dict[row["cell_suspension.biomaterial_core.biomaterial_id"]]["library_protocol_id"])
-        else:
-            library_protocol_id_list.append('')
-        if row["cell_suspension.biomaterial_core.biomaterial_id"] in sequencing_protocol_dict.keys():
-            sequencing_protocol_id_list.append(sequencing_protocol_dict[row["cell_suspension.biomaterial_core.biomaterial_id"]]["sequencing_protocol_id"])
-        else:
-            sequencing_protocol_id_list.append('')
+    for experiment in sequence_file_tab["cell_suspension.biomaterial_core.biomaterial_id"]:
+        library_protocol_id,sequencing_protocol_id = sequence_file_protocol_ids(experiment,library_protocol_ids,
+                                                                                sequencing_protocol_ids)
+        library_protocol_id_list.append(library_protocol_id)
+        sequencing_protocol_id_list.append(sequencing_protocol_id)
     sequence_file_tab['library_preparation_protocol.protocol_core.protocol_id'] = library_protocol_id_list
     sequence_file_tab['sequencing_protocol.protocol_core.protocol_id'] = sequencing_protocol_id_list
     utils.write_to_wb(workbook, tab_name, sequence_file_tab)
 
 
-def get_project_main_tab_xls(srp_metadata_update: pd.DataFrame,workbook: object,geo_accession: str,tab_name: str) -> []:
+def project_row(project: Project,run: Run,geo_accession: str) -> {}:
+    """
+    Fills Project (main) metadata fields from the Bioproject metadata and the SRA study of a run.
+    """
+    return {'project.project_core.project_title':project.title,
+            'project.project_core.project_description':project.description,
+            'project.geo_series_accessions':geo_accession,
+            'project.insdc_study_accessions':run.study,
+            'project.insdc_project_accessions':run.bioproject}
+
+
+def get_project_main_tab_xls(runs: [Run],workbook: object,geo_accession: str,tab_name: str) -> Project:
     """
     Fills and writes a Project (main) tab with SRA study and Bioproject metadata obtained via a request to the NCBI SRA database
     with a bioproject accession.
     """
-    study = list(srp_metadata_update['SRAStudy'])[0]
-    project = list(srp_metadata_update['BioProject'])[0]
+    project = None
     try:
         tab = utils.get_empty_df(workbook,tab_name)
-        bioproject = list(set(list(srp_metadata_update['BioProject'])))
+        bioproject = list(dict.fromkeys(run.bioproject for run in runs))
         if len(bioproject) > 1:
-            log.info("more than 1 bioproject, check this")
-        else:
-            bioproject = bioproject[0]
-        project_name,project_title,project_description,project_pubmed_id = utils.get_bioproject_metadata(bioproject)
-        tab = tab.append({'project.project_core.project_title':project_title,
-                        'project.project_core.project_description':project_description,
-                        'project.geo_series_accessions':geo_accession,
-                        'project.insdc_study_accessions':study,
-                        'project.insdc_project_accessions':project}, ignore_index=True)
+            # e.g. the studies of the SubSeries of a SuperSeries: the project is described by the first one
+            log.info(f"more than 1 bioproject ({', '.join(map(str, bioproject))}), check this: using {bioproject[0]}")
+        bioproject = bioproject[0]
+        project = utils.get_bioproject_metadata(bioproject)
+        tab = tab.append(project_row(project,runs[0],geo_accession), ignore_index=True)
         utils.write_to_wb(workbook, tab_name, tab)
     except AttributeError:
         pass
-    return project_name, project_title, project_description, project_pubmed_id
+    return project
 
 
-def get_project_publication_tab_xls(workbook: object,tab_name: str,project_pubmed_id: str) -> None:
+def publication_row(project_pubmed_id: str,publication: Publication) -> {}:
     """
-    Fills and writes the Project publication tab with publication metadata obtained via a request to the NCBI SRA database
-    with a bioporject accession.
+    Fills Project publication metadata fields from the publication metadata.
     """
-    tab = utils.get_empty_df(workbook,tab_name)
-    title,author_list,grant_list,article_doi_id = utils.get_pubmed_metadata(project_pubmed_id,iteration=1)
     name_list = list()
-    for author in author_list:
-        name = author[0] + ' ' + author[2] + "||"
+    for author in publication.authors:
+        name = author.last_name + ' ' + author.initials + "||"
         name_list.append(name)
     name_list = ''.join(name_list)
     name_list = name_list[:len(name_list)-2]
-    tab = tab.append({'project.publications.authors':name_list,
-                      'project.publications.title':title,
-                      'project.publications.doi':article_doi_id,
-                      'project.publications.pmid':project_pubmed_id,
-                      'project.publications.url':''}, ignore_index=True)
+    return {'project.publications.authors':name_list,
+            'project.publications.title':publication.title,
+            'project.publications.doi':publication.doi,
+            'project.publications.pmid':project_pubmed_id,
+            'project.publications.url':''}
+
+
+def contributor_rows(authors: [Author]) -> [{}]:
+    """
+    Fills Project contributors metadata fields, one row per publication author.
+    """
+    return [{'project.contributors.name':author.fore_name + ',,' + author.last_name,
+             'project.contributors.institution':author.affiliation} for author in authors]
+
+
+def funder_rows(grants: [Grant]) -> [{}]:
+    """
+    Fills Project funders metadata fields, one row per publication grant.
+    """
+    return [{'project.funders.grant_id':grant.grant_id,'project.funders.organization':grant.agency} for grant in grants]
+
+
+def get_project_publication_tab_xls(workbook: object,tab_name: str,project_pubmed_id: str,
+                                    publication: Publication = None) -> None:
+    """
+    Fills and writes the Project publication tab with publication metadata obtained via a request to the NCBI SRA database
+    with a bioporject accession.
+    """
+    tab = utils.get_empty_df(workbook,tab_name)
+    if publication is None:
+        publication = utils.get_pubmed_metadata(project_pubmed_id,iteration=1)
+    tab = tab.append(publication_row(project_pubmed_id,publication), ignore_index=True)
     utils.write_to_wb(workbook, tab_name, tab)
 
 
-def get_project_contributors_tab_xls(workbook: object,tab_name: str,project_pubmed_id: str) -> None:
+def get_project_contributors_tab_xls(workbook: object,tab_name: str,project_pubmed_id: str,
+                                     publication: Publication = None) -> None:
     """
     Function to fetch publication metadata, specifically about the publication contributors from an xml following a request to NCBI.
     """
     tab = utils.get_empty_df(workbook,tab_name)
-    title, author_list, grant_list, article_doi_id = utils.get_pubmed_metadata(project_pubmed_id,iteration=2)
-    for author in author_list:
-        name = author[1] + ',,' + list(author)[0]
-        affiliation = author[3]
-        tab = tab.append({'project.contributors.name':name,'project.contributors.institution':affiliation}, ignore_index=True)
+    if publication is None:
+        publication = utils.get_pubmed_metadata(project_pubmed_id,iteration=2)
+    tab = tab.append(contributor_rows(publication.authors), ignore_index=True)
     utils.write_to_wb(workbook, tab_name, tab)
 
 
-def get_project_funders_tab_xls(workbook: object,tab_name: str,project_pubmed_id: str) -> None:
+def get_project_funders_tab_xls(workbook: object,tab_name: str,project_pubmed_id: str,
+                                publication: Publication = None) -> None:
     """
     Function to fetch publication metadata, specifically about the project funders, from an xml following a request to NCBI.
     """
     tab = utils.get_empty_df(workbook,tab_name)
-    title, author_list, grant_list, article_doi_id = utils.get_pubmed_metadata(project_pubmed_id,iteration=3)
-    for grant in grant_list:
-        tab = tab.append({'project.funders.grant_id':grant[0],'project.funders.organization':grant[1]}, ignore_index=True)
+    if publication is None:
+        publication = utils.get_pubmed_metadata(project_pubmed_id,iteration=3)
+    tab = tab.append(funder_rows(publication.grants), ignore_index=True)
     utils.write_to_wb(workbook, tab_name, tab)
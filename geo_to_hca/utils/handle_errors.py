@@ -45,13 +45,30 @@ class NotFoundENA(Exception):
                 f"The provided project title or name was:\n{self.title}\n\n")
 
 
+class NoRelatedStudy(ValueError):
+    """
+    Raised when a GEO accession is linked to no SRA study, as opposed to a lookup which could not be completed.
+    """
+
+
 def no_related_study_err(geo_accession):
-    return ValueError(f"Could not find an an object with accession type SRP associated with "
+    return NoRelatedStudy(f"Could not find an an object with accession type SRP associated with "
                       f"the given accession {geo_accession}. "
                       f"Go to {config.NCBI_WEB_HOST}/geo/query/acc.cgi?acc={geo_accession} and if possible, find "
                       f"the related study accession, and run the tool with it.")
 
 
+class OfflineError(RuntimeError):
+    """
+    Raised when a request is about to be sent while rendering from bundles, i.e. the bundle lacks data.
+    """
+    def __init__(self, url):
+        self.url = url
+
+    def __str__(self):
+        return f'{self.url} requested while offline: the data is missing from the bundle, fetch it again'
+
+
 class TermNotFound(RuntimeError):
     def __init__(self, term, error_key, db='sra'):
         self.error_key = error_key
@@ -0,0 +1,122 @@
+# --- core imports
+import contextvars
+import logging
+import resource
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+_active_recorder = contextvars.ContextVar('stage_recorder', default=None)
+# the peak traced memory seen by each stage in progress before the peak was reset by a stage nested in it
+_open_peaks = contextvars.ContextVar('open_stage_peaks', default=())
+
+
+def peak_rss_mb() -> float:
+    """
+    Returns the peak resident set size of the current process in MiB (ru_maxrss is reported in KiB on linux).
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def rss_mb() -> float:
+    """
+    Returns the current resident set size of the current process in MiB, read from /proc/self/statm, or None where it
+    cannot be read (e.g. on macOS).
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            resident_pages = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * resource.getpagesize() / 2 ** 20
+
+
+class StageRecorder:
+    """
+    Collects the wall-clock duration and, optionally, the peak traced python memory of each pipeline stage run while
+    the recorder is active (see recording()). Stages with the same name are accumulated. Attributes of the run, e.g.
+    the source of the fastq file names, are recorded with annotate().
+    """
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.attributes = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        if self.trace_memory:
+            # the peak is reset for this stage: the stages it is nested in keep the peak they saw until now
+            _, peak = tracemalloc.get_traced_memory()
+            for peak_seen in _open_peaks.get():
+                peak_seen[0] = max(peak_seen[0], peak)
+            tracemalloc.reset_peak()
+            peak_seen = [0]
+            token = _open_peaks.set(_open_peaks.get() + (peak_seen,))
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            entry = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+            entry['seconds'] += elapsed
+            entry['calls'] += 1
+            if self.trace_memory:
+                _open_peaks.reset(token)
+                _, peak = tracemalloc.get_traced_memory()
+                peak = max(peak, peak_seen[0])
+                entry['peak_traced_mb'] = max(entry.get('peak_traced_mb', 0.0), peak / 2 ** 20)
+            log.debug(f'stage {name} took {elapsed:.3f}s')
+
+    def as_dict(self) -> {}:
+        return {name: dict(entry) for name, entry in self.stages.items()}
+
+
+@contextmanager
+def recording(recorder: StageRecorder):
+    """
+    Activates the given recorder for all stages run in the current context.
+    """
+    started_tracing = recorder.trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    token = _active_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _active_recorder.reset(token)
+        if started_tracing:
+            tracemalloc.stop()
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Marks a pipeline stage. This is a no-op unless a StageRecorder is active.
+    """
+    recorder = _active_recorder.get()
+    if recorder is None:
+        yield
+        return
+    with recorder.stage(name):
+        yield
+
+
+def annotate(name: str, value) -> None:
+    """
+    Records an attribute of the current run, e.g. the source of its fastq file names. This is a no-op unless a
+    StageRecorder is active.
+    """
+    recorder = _active_recorder.get()
+    if recorder is not None:
+        recorder.attributes[name] = value
+
+
+def attribute(name: str, default=None):
+    """
+    Returns an attribute recorded for the current run with annotate(), or default if it was not recorded or no
+    StageRecorder is active.
+    """
+    recorder = _active_recorder.get()
+    return recorder.attributes.get(name, default) if recorder is not None else default
@@ -0,0 +1,222 @@
+"""
+Local store of the metadata fetched for studies: the runs of each SRA study and the experiments, biosamples,
+bioprojects and publications they link to, kept in a sqlite database in config.CACHE_DIR (metadata.sqlite).
+
+The functions fetching these records (sra_utils.get_study_runs, utils.fetch_experimental_metadata,
+utils.get_bioproject_metadata and utils.get_pubmed_metadata) read them from the store first and only request the
+missing ones from NCBI, so biosamples, bioprojects and publications shared by related studies are fetched once.
+Records older than config.CACHE_TTL_DAYS are fetched again. As records are reused without checking whether they were
+updated upstream, the store is only used when enabled (config.METADATA_STORE, --metadata_store). The runs table is indexed on each accession it links to,
+so questions like "which studies share this biosample?" are answered locally (see studies_with_biosample).
+"""
+# --- core imports
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+# --- application imports
+from geo_to_hca import config
+from geo_to_hca.utils import cache
+from geo_to_hca.utils.records import Author, BioSample, Experiment, Grant, Project, Publication, Run
+
+STORE_FILE_NAME = 'metadata.sqlite'
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_metadata_store = None
+
+
+def _value(value):
+    """
+    Returns a run info value as stored in sqlite: numpy scalars as python values, missing values (NaN) as NULL.
+    """
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def _run_value(value):
+    """
+    Returns a stored run info value as read from the run info table, where missing values are NaN.
+    """
+    return float('nan') if value is None else value
+
+
+class MetadataStore(cache.SqliteDatabase):
+    schema = (
+        'CREATE TABLE IF NOT EXISTS studies (accession TEXT PRIMARY KEY, n_runs INTEGER NOT NULL, stored REAL NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS runs (accession TEXT PRIMARY KEY, experiment TEXT, study TEXT, bioproject TEXT, '
+        'sample TEXT, biosample TEXT, taxon_id, scientific_name, sample_name, srp_accession TEXT NOT NULL, '
+        'position INTEGER NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS runs_srp_accession ON runs (srp_accession, position)',
+        'CREATE INDEX IF NOT EXISTS runs_study ON runs (study)',
+        'CREATE INDEX IF NOT EXISTS runs_experiment ON runs (experiment)',
+        'CREATE INDEX IF NOT EXISTS runs_biosample ON runs (biosample)',
+        'CREATE INDEX IF NOT EXISTS runs_bioproject ON runs (bioproject)',
+        'CREATE TABLE IF NOT EXISTS experiments (accession TEXT PRIMARY KEY, library_construction_protocol TEXT, '
+        'instrument TEXT, stored REAL NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS biosamples (accession TEXT PRIMARY KEY, title TEXT, attributes TEXT, '
+        'stored REAL NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS bioprojects (accession TEXT PRIMARY KEY, name TEXT, title TEXT, description TEXT, '
+        'pubmed_id TEXT, stored REAL NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS bioprojects_pubmed_id ON bioprojects (pubmed_id)',
+        'CREATE TABLE IF NOT EXISTS publications (pubmed_id TEXT PRIMARY KEY, title TEXT, authors TEXT, grants TEXT, '
+        'doi TEXT, stored REAL NOT NULL)',
+    )
+
+    def __init__(self, path: str, read_only: bool = False):
+        super().__init__(path, read_only)
+        self.hits = 0
+        self.misses = 0
+
+    def _count(self, found: int, requested: int) -> None:
+        self.hits += found
+        self.misses += requested - found
+
+    @staticmethod
+    def _oldest() -> float:
+        return time.time() - cache.max_age()
+
+    # --- runs
+
+    def put_runs(self, study_accession: str, runs: [Run]) -> None:
+        """
+        Stores the runs of the run info table of an SRA study accession, in order, replacing the runs stored before.
+        """
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute('DELETE FROM runs WHERE srp_accession = ?', (study_accession,))
+                connection.executemany(
+                    'INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    ([_value(run.accession), _value(run.experiment), _value(run.study), _value(run.bioproject),
+                      _value(run.sample), _value(run.biosample), _value(run.taxon_id), _value(run.scientific_name),
+                      _value(run.sample_name), study_accession, position] for position, run in enumerate(runs)))
+                connection.execute('INSERT OR REPLACE INTO studies VALUES (?, ?, ?)',
+                                   (study_accession, len(runs), time.time()))
+
+    def get_runs(self, study_accession: str) -> [Run]:
+        """
+        Returns the runs of a study, or None if they are not stored (or are too old).
+        """
+        study = self.query('SELECT n_runs FROM studies WHERE accession = ? AND stored >= ?',
+                           (study_accession, self._oldest()))
+        rows = self.query('SELECT accession, experiment, study, bioproject, sample, biosample, taxon_id, '
+                          'scientific_name, sample_name FROM runs WHERE srp_accession = ? ORDER BY position',
+                          (study_accession,)) if study else []
+        if not study or len(rows) != study[0][0]:
+            self._count(0, 1)
+            return None
+        self._count(1, 1)
+        return [Run(*(_run_value(value) for value in row)) for row in rows]
+
+    # --- experiments and biosamples
+
+    def put_experiments(self, experiments: [Experiment]) -> None:
+        stored = time.time()
+        self.execute_many('INSERT OR REPLACE INTO experiments VALUES (?, ?, ?, ?)',
+                          [(experiment.accession, experiment.library_construction_protocol, experiment.instrument,
+                            stored) for experiment in experiments if experiment.accession])
+
+    def get_experiments(self, accessions: []) -> {}:
+        rows = self._select_by_accession('experiments', 'accession, library_construction_protocol, instrument',
+                                         accessions)
+        return {row[0]: Experiment(*row) for row in rows}
+
+    def put_biosamples(self, biosamples: [BioSample]) -> None:
+        stored = time.time()
+        self.execute_many('INSERT OR REPLACE INTO biosamples VALUES (?, ?, ?, ?)',
+                          [(biosample.accession, biosample.title, json.dumps(biosample.attributes), stored)
+                           for biosample in biosamples if biosample.accession])
+
+    def get_biosamples(self, accessions: []) -> {}:
+        rows = self._select_by_accession('biosamples', 'accession, title, attributes', accessions)
+        return {row[0]: BioSample(row[0], row[1], json.loads(row[2])) for row in rows}
+
+    def _select_by_accession(self, table: str, columns: str, accessions: []) -> []:
+        rows = []
+        oldest = self._oldest()
+        # sqlite limits the number of parameters of a statement
+        for i in range(0, len(accessions), 500):
+            part = list(accessions[i:i + 500])
+            rows.extend(self.query(f'SELECT {columns} FROM {table} WHERE accession IN '
+                                   f'({",".join("?" * len(part))}) AND stored >= ?', (*part, oldest)))
+        self._count(len(rows), len(accessions))
+        return rows
+
+    # --- bioprojects and publications
+
+    def put_project(self, bioproject_accession: str, project: Project) -> None:
+        self.execute('INSERT OR REPLACE INTO bioprojects VALUES (?, ?, ?, ?, ?, ?)',
+                     (bioproject_accession, project.name, project.title, project.description, project.pubmed_id,
+                      time.time()))
+
+    def get_project(self, bioproject_accession: str) -> Project:
+        rows = self._select_by_accession('bioprojects', 'name, title, description, pubmed_id', [bioproject_accession])
+        return Project(*rows[0]) if rows else None
+
+    def put_publication(self, pubmed_id: str, publication: Publication) -> None:
+        self.execute('INSERT OR REPLACE INTO publications VALUES (?, ?, ?, ?, ?, ?)',
+                     (str(pubmed_id), publication.title,
+                      json.dumps([[author.last_name, author.fore_name, author.initials, author.affiliation]
+                                  for author in publication.authors]),
+                      json.dumps([[grant.grant_id, grant.agency] for grant in publication.grants]),
+                      publication.doi, time.time()))
+
+    def get_publication(self, pubmed_id: str) -> Publication:
+        rows = self.query('SELECT title, authors, grants, doi FROM publications WHERE pubmed_id = ? AND stored >= ?',
+                          (str(pubmed_id), self._oldest()))
+        self._count(len(rows), 1)
+        if not rows:
+            return None
+        title, authors, grants, doi = rows[0]
+        return Publication(title, [Author(*author) for author in json.loads(authors)],
+                           [Grant(*grant) for grant in json.loads(grants)], doi)
+
+    # --- local queries
+
+    def studies_with_biosample(self, biosample_accession: str) -> []:
+        """
+        Returns the SRA studies with runs of the biosample.
+        """
+        return [row[0] for row in self.query('SELECT DISTINCT study FROM runs WHERE biosample = ? ORDER BY study',
+                                             (biosample_accession,))]
+
+    def studies_with_experiment(self, experiment_accession: str) -> []:
+        return [row[0] for row in self.query('SELECT DISTINCT study FROM runs WHERE experiment = ? ORDER BY study',
+                                             (experiment_accession,))]
+
+    def studies_with_pubmed_id(self, pubmed_id: str) -> []:
+        """
+        Returns the SRA studies whose bioproject is linked to the publication.
+        """
+        return [row[0] for row in self.query('SELECT DISTINCT runs.study FROM bioprojects JOIN runs '
+                                             'ON runs.bioproject = bioprojects.accession '
+                                             'WHERE bioprojects.pubmed_id = ? ORDER BY runs.study',
+                                             (str(pubmed_id),))]
+
+    def stats(self) -> {}:
+        return {'path': self.path, 'hits': self.hits, 'misses': self.misses}
+
+
+def store() -> MetadataStore:
+    """
+    Returns the metadata store of the process, in config.CACHE_DIR, or None if the store is not enabled
+    (config.METADATA_STORE) or CACHE_DIR is not set. The store is only read while offline (config.OFFLINE).
+    """
+    global _metadata_store
+    if not config.METADATA_STORE or not config.CACHE_DIR:
+        return None
+    path = os.path.join(os.path.expanduser(config.CACHE_DIR), STORE_FILE_NAME)
+    with _lock:
+        if _metadata_store is None or _metadata_store.path != path or _metadata_store.read_only != config.OFFLINE:
+            if _metadata_store is not None:
+                _metadata_store.close()
+            _metadata_store = MetadataStore(path, read_only=config.OFFLINE)
+        return _metadata_store
@@ -0,0 +1,52 @@
+"""
+Persistent record of lookups known to lead nowhere: GEO accessions without an SRA study, esearch terms which are not
+found, pubmed ids without an article and EuropePMC searches without results. They are kept in the persistent cache,
+by kind of lookup and key, for config.NEGATIVE_CACHE_TTL_DAYS days, so that re-runs of a batch fail on them
+immediately instead of repeating the rate limited calls which led to the failure. With config.RECHECK_NEGATIVE (--recheck_negative), the recorded
+failures are ignored and the lookups are sent again.
+"""
+# --- core imports
+import logging
+
+# --- application imports
+from geo_to_hca import config
+from geo_to_hca.utils import cache
+
+NAMESPACE_PREFIX = 'negative_'
+
+# kinds of lookups
+GEO_WITHOUT_SRA_STUDY = 'geo_without_sra_study'
+ESEARCH_TERM_NOT_FOUND = 'esearch_term_not_found'
+PUBMED_ID_NOT_FOUND = 'pubmed_id_not_found'
+EUROPEPMC_NO_RESULTS = 'europepmc_no_results'
+
+log = logging.getLogger(__name__)
+
+
+def known_failure(kind: str, key: str) -> str:
+    """
+    Returns the reason recorded for the failure of a lookup, or None if it did not fail recently or failures are
+    being rechecked.
+    """
+    persistent_cache = cache.persistent_cache()
+    if not persistent_cache or config.RECHECK_NEGATIVE:
+        return None
+    reason = persistent_cache.get(NAMESPACE_PREFIX + kind, str(key), config.NEGATIVE_CACHE_TTL_DAYS * 24 * 3600)
+    if reason is not None:
+        log.info(f'{kind} {key} is a known failure (use --recheck_negative to look it up again)')
+    return reason
+
+
+def record_failure(kind: str, key: str, reason: str = '') -> None:
+    persistent_cache = cache.persistent_cache()
+    if persistent_cache:
+        persistent_cache.put(NAMESPACE_PREFIX + kind, str(key), reason)
+
+
+def clear_failure(kind: str, key: str) -> None:
+    """
+    Forgets the failure of a lookup, e.g. once it was rechecked and succeeded.
+    """
+    persistent_cache = cache.persistent_cache()
+    if persistent_cache:
+        persistent_cache.delete(NAMESPACE_PREFIX + kind, str(key))
@@ -1,39 +1,106 @@
 # --- core imports
+import functools
 import logging
-import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # --- third-party imports
-import pandas as pd
 import urllib.parse
 
 # ---application imports
+from geo_to_hca import config
+from geo_to_hca.utils import deadline
+from geo_to_hca.utils import fastq_names
 from geo_to_hca.utils import sra_utils
+from geo_to_hca.utils import transport
+from geo_to_hca.utils.records import FastqFile
 
 log = logging.getLogger(__name__)
 
 
+# fields of the ENA file report with a value per fastq file of a run, separated by ';'
+ENA_FILE_FIELDS = ('fastq_ftp', 'fastq_bytes', 'fastq_md5')
+ENA_FILE_REPORT_FIELDS = ('fastq_ftp',)
+
+
+def request_ena_file_report(srp_accession: str, fields: (str,) = ENA_FILE_REPORT_FIELDS) -> {}:
+    """
+    Returns the values of the given fields of the ENA file report of a study, as a tuple by run accession. The fields
+    with a value per fastq file (see ENA_FILE_FIELDS) are tuples with an item per file, fastq_bytes and read_count are
+    integers (None when missing).
+    """
+    params = {
+        'accession': srp_accession,
+        'result': 'read_run',
+        'fields': ','.join(('run_accession',) + tuple(fields))
+    }
+    file_report_url = f'{config.ENA_PORTAL_API_URL}/filereport?{urllib.parse.urlencode(params)}'
+    # cached rather than streamed from the socket, so that the report is revalidated rather than downloaded again;
+    # the lines of the (decompressed) body are parsed in turn, without a dataframe
+    response = transport.get(file_report_url, cache=True)
+    response.raise_for_status()
+    return parse_ena_file_report(response.iter_lines(chunk_size=2 ** 16), fields)
+
+
+def parse_ena_file_report(lines, fields: (str,) = ENA_FILE_REPORT_FIELDS) -> {}:
+    """
+    Parses the lines (bytes) of an ENA file report in a single pass. See request_ena_file_report.
+    """
+    lines = iter(lines)
+    header = next(lines, b'').decode().rstrip('\r').split('\t')
+    missing = [field for field in ('run_accession',) + tuple(fields) if field not in header]
+    if missing:
+        raise ValueError(f'ENA file report without the fields {", ".join(missing)}')
+    run_column = header.index('run_accession')
+    columns = [(header.index(field), _ENA_FIELD_PARSERS.get(field, _text)) for field in fields]
+    width = len(header)
+    report = {}
+    for line in lines:
+        values = line.decode().rstrip('\r').split('\t')
+        if len(values) < width:
+            # trailing empty values may be left out
+            values += [''] * (width - len(values))
+        if values[run_column]:
+            report[values[run_column]] = tuple([parse(values[column]) for column, parse in columns])
+    return report
+
+
+def _text(value: str) -> str:
+    return value
+
+
+def _count(value: str) -> int:
+    return int(value) if value else None
+
+
+def _files(value: str) -> (str,):
+    return tuple(value.split(';')) if value else ()
+
+
+def _file_counts(value: str) -> (int,):
+    return tuple(_count(count) for count in value.split(';')) if value else ()
+
+
+_ENA_FIELD_PARSERS = {
+    'fastq_ftp': _files,
+    'fastq_md5': _files,
+    'fastq_bytes': _file_counts,
+    'read_count': _count,
+    'base_count': _count,
+}
+
+
 def request_fastq_from_ENA(srp_accession: str) -> {}:
     """
-    Function to retrieve fastq file paths from ENA given an SRA study accession. The request returns a
-    dataframe with a list of run accessions and their associated fastq file paths. The multiple file paths for
-    each run are stored in a single string. This string is then stored in a dictionary with the associated
-    run accessions as keys.
+    Function to retrieve fastq file paths from ENA given an SRA study accession. The file report lists the run
+    accessions with their fastq file paths, which are parsed line by line into the fastq files of each run.
     """
     try:
-        params = {
-            'accession': srp_accession,
-            'result': 'read_run',
-            'fields': 'run_accession,fastq_ftp'
-        }
-        request_params_str = urllib.parse.urlencode(params)
-        file_report_url = f'https://www.ebi.ac.uk/ena/portal/api/filereport?{request_params_str}'
-        fastq_results = pd.read_csv(file_report_url, delimiter='\t')
-        run_accessions = list(fastq_results['run_accession'])
-        ftps = list(fastq_results['fastq_ftp'])
-        fastq_map = {run_accessions[i]: extract_reads_ENA(ftps[i]) for i in range(0, len(run_accessions))}
-        return fastq_map
+        file_report = request_ena_file_report(srp_accession)
+        return fastq_files_by_run({run_accession: [path.rpartition('/')[2] for path in fastq_ftp]
+                                   for run_accession, (fastq_ftp,) in file_report.items()})
     except Exception as e:
-        log.error(f'no ena file report for accession {srp_accession}. url: {file_report_url}')
+        log.error(f'no ena file report for accession {srp_accession}')
         log.exception(e)
         return None
 
@@ -68,12 +135,12 @@ def extract_reads_SRA(read_values:str,accession:str,fastq_map:{}) -> {}:
                     fastq_map[accession] = [split_read[1]]
     return fastq_map
 
-def get_file_names_from_SRA(experiment_package: object) -> {}:
+def get_file_names_from_SRA(experiment_package: object, fastq_map: {} = None) -> {}:
     """
     Gets fastq file names from an xml returned from SRA following a request with a list
-    of run accessions.
+    of run accessions, adding them to fastq_map if given.
     """
-    fastq_map = {}
+    fastq_map = {} if fastq_map is None else fastq_map
     run_set = experiment_package.find('RUN_SET')
     for run in run_set:
         try:
@@ -87,43 +154,91 @@ def get_file_names_from_SRA(experiment_package: object) -> {}:
             continue
     return fastq_map
 
-def get_fastq_from_SRA(srr_accessions: []) -> {}:
+def request_file_names_from_SRA(srr_accessions: [], cancelled: threading.Event = None) -> {}:
     """
-    Function to parse the xml output following a request for run accession metadata to the NCBI SRA database.
-    A list of SRA run accessions is given as input to the request. The fastq file paths are extracted from
-    this xml and the file names are added to a dictionary with the associated run accessions as keys (fastq_map).
+    Function to get the fastq file names of a chunk of SRA run accessions from the NCBI SRA database, parsing the
+    experiment packages of the xml response as they are received. Returns the fastq file names by run accession, or
+    None if the request failed or was cancelled (cancelled is set) before the whole response was parsed. Raises
+    DeadlineExceeded once the deadline of the accession has passed.
     """
-    xml_content = sra_utils.request_fastq_from_SRA(srr_accessions)
-    if not xml_content:
-        fastq_map = None
-    else:
-        experiment_packages = sra_utils.parse_xml_SRA_runs(xml_content)
-        for experiment_package in experiment_packages:
+    fastq_map = {}
+    if cancelled is not None and cancelled.is_set():
+        return None
+    try:
+        for experiment_package in sra_utils.iter_SRA_experiment_packages(srr_accessions):
+            if cancelled is not None and cancelled.is_set():
+                return None
+            deadline.check()
             try:
-                fastq_map = get_file_names_from_SRA(experiment_package)
+                get_file_names_from_SRA(experiment_package, fastq_map)
             except:
                 continue
+    except deadline.DeadlineExceeded:
+        raise
+    except Exception as e:
+        if cancelled is None or not cancelled.is_set():
+            log.error(f'no SRA fastq file names for {len(srr_accessions)} run accessions from {srr_accessions[0]}: {e}')
+        return None
+    return fastq_map
+
+def get_fastq_from_SRA(srr_accessions: [], cancelled: threading.Event = None) -> {}:
+    """
+    Function to parse the xml output following requests for run accession metadata to the NCBI SRA database.
+    The run accessions are requested in chunks of config.SRA_RUN_CHUNK_SIZE, config.FETCH_WORKERS chunks at a time.
+    The fastq file paths are extracted from the xml of each chunk and the fastq files of all chunks are added to a
+    single dictionary with the associated run accessions as keys (fastq_map). Returns None if no chunk could be
+    requested, or if the lookup was cancelled (cancelled is set) before it completed.
+    """
+    parts_list = [srr_accessions[i:i + config.SRA_RUN_CHUNK_SIZE]
+                  for i in range(0, len(srr_accessions), config.SRA_RUN_CHUNK_SIZE)]
+    if not parts_list:
+        return None
+    fastq_map = {}
+    requested = False
+    with ThreadPoolExecutor(max_workers=max(1, min(config.FETCH_WORKERS, len(parts_list)))) as executor:
+        for part_fastq_map in executor.map(deadline.propagate(functools.partial(request_file_names_from_SRA,
+                                                                             cancelled=cancelled)), parts_list):
+            if part_fastq_map is None:
+                continue
+            requested = True
+            for accession, file_names in part_fastq_map.items():
+                fastq_map.setdefault(accession, []).extend(file_names)
+    if not requested or (cancelled is not None and cancelled.is_set()):
+        return None
+    return fastq_files_by_run(fastq_map)
+
+def fastq_files(run_accession: str, file_names: []) -> [FastqFile]:
+    """
+    Builds the fastq file records of a run from its fastq file names, parsing the read index and lane index of
+    each file name.
+    """
+    return fastq_files_by_run({run_accession: file_names})[run_accession]
+
+def fastq_files_by_run(file_names_by_run: {}) -> {}:
+    """
+    Builds the fastq file records of runs from their fastq file names by run accession. The read index and lane
+    index of the file names of all runs are parsed as one column (see fastq_names).
+    """
+    run_accessions = [accession for accession, file_names in file_names_by_run.items() for _ in file_names]
+    all_file_names = [file_name for file_names in file_names_by_run.values() for file_name in file_names]
+    files = [FastqFile(accession, file_name, read_index, lane_index)
+             for accession, file_name, (read_index, lane_index)
+             in zip(run_accessions, all_file_names, fastq_names.parse_file_names(run_accessions, all_file_names))]
+    fastq_map = {}
+    start = 0
+    for accession, file_names in file_names_by_run.items():
+        fastq_map[accession] = files[start:start + len(file_names)]
+        start += len(file_names)
     return fastq_map
 
 def get_lane_index(file: str) -> str:
     """
     Looks for a lane index inside a fastq file name and returns the lane index if found.
     """
-    result = re.search('_L[0-9]{3}', file)
-    return result
+    return fastq_names.LANE_INDEX_PATTERN.search(file)
 
 def get_file_index(file: str) -> str:
     """
     Looks for a read index inside a fastq file name (R1,R2,I1,etc.). Returns the read index if found.
     """
-    if "_I1" in file or "_R3" in file or "_3" in file:
-        ind = 'index1'
-    elif "_R1" in file or "_1" in file:
-        ind = 'read1'
-    elif "_R2" in file or "_2" in file:
-        ind = 'read2'
-    elif "_I2" in file or "_R4" in file or "_4" in file:
-        ind = 'index2'
-    else:
-         ind = ''
-    return ind
+    return fastq_names.read_index(file)
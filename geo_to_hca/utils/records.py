@@ -0,0 +1,117 @@
+"""
+Compact records of the metadata fetched for a study.
+
+The parsers of the SRA run info table, the ENA and SRA fastq file reports, the GEO family files and the NCBI
+biosample, experiment, bioproject and pubmed xml return these records and the tab builders in get_tab read their named
+fields. The classes use __slots__, so a record holds its values without a per instance dictionary, and records of
+different kinds are joined on their accessions (e.g. runs on Run.experiment or Run.biosample) rather than by scanning
+a table.
+"""
+# --- core imports
+from dataclasses import dataclass
+
+
+@dataclass
+class Run:
+    """
+    A run of the SRA run info table of a study.
+    """
+    __slots__ = ('accession', 'experiment', 'study', 'bioproject', 'sample', 'biosample', 'taxon_id',
+                 'scientific_name', 'sample_name')
+    accession: str
+    experiment: str
+    study: str
+    bioproject: str
+    sample: str
+    biosample: str
+    taxon_id: int
+    scientific_name: str
+    sample_name: str
+
+
+@dataclass
+class FastqFile:
+    """
+    A fastq file of a run, with the read index (read1, index1, etc.) and lane index parsed from its name.
+    """
+    __slots__ = ('run', 'name', 'read_index', 'lane_index')
+    run: str
+    name: str
+    read_index: str
+    lane_index: str
+
+
+@dataclass
+class Experiment:
+    """
+    The library construction protocol and sequencing instrument of an SRA experiment.
+    """
+    __slots__ = ('accession', 'library_construction_protocol', 'instrument')
+    accession: str
+    library_construction_protocol: str
+    instrument: str
+
+
+@dataclass
+class BioSample:
+    """
+    The title and attribute values of a biosample.
+    """
+    __slots__ = ('accession', 'title', 'attributes')
+    accession: str
+    title: str
+    attributes: list
+
+
+@dataclass
+class GeoSample:
+    """
+    A GEO sample (GSM) of a series, with the SRA experiment and biosample it is related to (None when it has none)
+    and its characteristics as (tag, value) pairs.
+    """
+    __slots__ = ('accession', 'title', 'experiment', 'biosample', 'characteristics')
+    accession: str
+    title: str
+    experiment: str
+    biosample: str
+    characteristics: list
+
+
+@dataclass
+class Project:
+    """
+    The metadata of a bioproject and the pubmed id of its publication, if any was found.
+    """
+    __slots__ = ('name', 'title', 'description', 'pubmed_id')
+    name: str
+    title: str
+    description: str
+    pubmed_id: str
+
+
+@dataclass
+class Author:
+    __slots__ = ('last_name', 'fore_name', 'initials', 'affiliation')
+    last_name: str
+    fore_name: str
+    initials: str
+    affiliation: str
+
+
+@dataclass
+class Grant:
+    __slots__ = ('grant_id', 'agency')
+    grant_id: str
+    agency: str
+
+
+@dataclass
+class Publication:
+    """
+    The metadata of a pubmed publication.
+    """
+    __slots__ = ('title', 'authors', 'grants', 'doi')
+    title: str
+    authors: list
+    grants: list
+    doi: str
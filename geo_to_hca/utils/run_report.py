@@ -0,0 +1,51 @@
+"""
+Report of a geo_to_hca run over a list of accessions: the outcome of each accession, how long it took, where its fastq
+file names came from and the error if it failed. The report is written as a tab-delimited file in the output directory
+unless --output_log is False.
+"""
+# --- core imports
+import csv
+import logging
+from dataclasses import asdict, dataclass, fields
+
+# --- application imports
+from geo_to_hca.utils import instrumentation
+
+REPORT_FILE_NAME = 'geo_to_hca_report.tsv'
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class AccessionReport:
+    accession: str
+    status: str
+    seconds: float
+    fastq_source: str = ''
+    out_file: str = ''
+    error: str = ''
+
+
+class RunReport:
+    """
+    Collects an AccessionReport per accession processed, in order.
+    """
+    def __init__(self):
+        self.accessions = []
+
+    def add(self, accession: str, status: str, seconds: float, recorder: instrumentation.StageRecorder = None,
+            out_file: str = '', error: str = '') -> AccessionReport:
+        attributes = recorder.attributes if recorder else {}
+        report = AccessionReport(accession, status, round(seconds, 3), attributes.get('fastq_source', ''),
+                                 out_file or '', error or '')
+        self.accessions.append(report)
+        return report
+
+    def write(self, path: str) -> None:
+        with open(path, 'w', newline='') as report_file:
+            writer = csv.DictWriter(report_file, fieldnames=[field.name for field in fields(AccessionReport)],
+                                    delimiter='\t')
+            writer.writeheader()
+            for report in self.accessions:
+                writer.writerow(asdict(report))
+        log.info(f'run report written to {path}')
@@ -0,0 +1,79 @@
+"""
+Scheduling of the accessions of a batch.
+
+Before a batch is processed, the size of each accession (its number of runs) is probed cheaply, without its run info
+table, e.g. from the esummaries of its experiments (see geo_to_hca.estimate_accession_size), and the accessions are ordered by config.BATCH_SCHEDULE:
+
+- smallest: smallest studies first, so that most spreadsheets are written early (shortest job first)
+- largest: largest studies first
+- input: in the order they were given
+
+Accessions with at least config.LARGE_STUDY_RUNS runs are set apart on a lane of their own, processed alongside the
+lane of the other accessions, so that a huge study does not hold up the small ones. Accessions whose size could not be
+probed come last on the lane of the small studies.
+"""
+# --- core imports
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# --- application imports
+from geo_to_hca import config
+from geo_to_hca.utils import deadline
+
+SCHEDULES = ('smallest', 'largest', 'input')
+
+log = logging.getLogger(__name__)
+
+
+def probe_sizes(accessions: [str], size_of) -> {}:
+    """
+    Returns the size of each accession as given by size_of(accession), or None if it could not be probed. The probes
+    run concurrently, config.FETCH_WORKERS at a time.
+    """
+    def probe(accession):
+        try:
+            return size_of(accession)
+        except Exception as e:
+            log.info(f'size of {accession} unknown: {e}')
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(config.FETCH_WORKERS, len(accessions))),
+                            thread_name_prefix='size-probe') as executor:
+        sizes = list(executor.map(deadline.propagate(probe), accessions))
+    return dict(zip(accessions, sizes))
+
+
+def order(accessions: [str], sizes: {}, schedule: str) -> [str]:
+    """
+    Returns the accessions in the order of the schedule, those of unknown size last. The order of accessions of the
+    same size is kept.
+    """
+    if schedule not in SCHEDULES:
+        raise ValueError(f'unknown schedule {schedule}: one of {", ".join(SCHEDULES)} expected')
+    if schedule == 'input':
+        return list(accessions)
+    known = [accession for accession in accessions if sizes.get(accession) is not None]
+    unknown = [accession for accession in accessions if sizes.get(accession) is None]
+    return sorted(known, key=sizes.get, reverse=schedule == 'largest') + unknown
+
+
+def plan(accessions: [str], size_of, schedule: str = None, large_study_runs: int = None) -> [[str], [str]]:
+    """
+    Returns the accessions of a batch on two lanes, in the order they should be processed: the lane of the small
+    studies and the lane of the studies with at least large_study_runs runs (config.LARGE_STUDY_RUNS by default; 0
+    puts every study on the first lane). A single accession is not probed.
+    """
+    schedule = schedule or config.BATCH_SCHEDULE
+    large_study_runs = config.LARGE_STUDY_RUNS if large_study_runs is None else large_study_runs
+    accessions = list(accessions)
+    if len(accessions) < 2 or (schedule == 'input' and not large_study_runs):
+        return accessions, []
+    sizes = probe_sizes(accessions, size_of)
+    ordered = order(accessions, sizes, schedule)
+    large = [accession for accession in ordered
+             if large_study_runs and sizes.get(accession) is not None and sizes[accession] >= large_study_runs]
+    small = [accession for accession in ordered if accession not in large]
+    log.info(f'batch of {len(accessions)} accessions, schedule {schedule}: '
+             f'{", ".join(f"{accession} ({sizes[accession]})" for accession in ordered)}'
+             + (f'; {len(large)} large studies on their own lane' if large else ''))
+    return small, large
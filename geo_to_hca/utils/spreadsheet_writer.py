@@ -0,0 +1,95 @@
+"""
+Serialization of the spreadsheets of a batch in writer processes.
+
+Saving a large workbook (workbook.save) is CPU bound and takes seconds, during which a batch would send no request. A
+SpreadsheetWriter takes the completed workbooks of a batch and saves them on a pool of writer processes while the next
+accessions are fetched, so that a batch takes about as long as the slower of its network and CPU work rather than their
+sum. A workbook is not pickled to a writer process as it is (which takes about as long as saving it): only the values
+of its cells and its properties are sent, and the writer process fills them in a workbook loaded from the same template
+before saving it. At most queue_size workbooks wait to be written; further submissions block until one is written
+(backpressure), which bounds the memory held by the queue.
+"""
+# --- core imports
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+# --- third-party imports
+from openpyxl import load_workbook, Workbook
+
+# --- application imports
+from geo_to_hca.utils import instrumentation
+
+log = logging.getLogger(__name__)
+
+
+def cell_values(workbook: Workbook) -> {}:
+    """
+    Returns the (row, column, value) of the cells with a value of each worksheet of a workbook, by worksheet title.
+    """
+    # the empty cells created by iter_rows are only added to the rendered workbook, which is not saved
+    return {worksheet.title: [(row, column, value)
+                              for row, values in enumerate(worksheet.iter_rows(min_row=1, max_row=worksheet.max_row,
+                                                                               values_only=True), start=1)
+                              for column, value in enumerate(values, start=1) if value is not None]
+            for worksheet in workbook.worksheets}
+
+
+def write_spreadsheet(hca_template, values: {}, properties, out_file: str) -> str:
+    """
+    Saves to out_file the workbook loaded from hca_template with the cell values and properties of a workbook rendered
+    from it (see cell_values). Run in a writer process. Returns out_file.
+    """
+    workbook = load_workbook(filename=hca_template)
+    for title, cells in values.items():
+        worksheet = workbook[title]
+        for row, column, value in cells:
+            worksheet.cell(row=row, column=column).value = value
+    workbook.properties = properties
+    workbook.save(out_file)
+    return out_file
+
+
+class SpreadsheetWriter:
+    """
+    Saves the workbooks rendered from a template on `processes` writer processes, with at most queue_size workbooks
+    waiting to be written. Used as a context manager, which waits for the queued workbooks on exit.
+    """
+    def __init__(self, hca_template, processes: int = 1, queue_size: int = 2):
+        self.hca_template = hca_template
+        self.processes = max(1, processes)
+        self.queue_size = max(1, queue_size)
+        self._slots = threading.BoundedSemaphore(self.processes + self.queue_size)
+        # spawned rather than forked: the writer processes are started while other threads are fetching
+        self._executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context('spawn'))
+        self.written = 0
+
+    def submit(self, workbook: Workbook, out_file: str) -> Future:
+        """
+        Queues a workbook to be saved to out_file, waiting for room in the queue first. Returns a future of out_file.
+        """
+        with instrumentation.stage('queue_spreadsheet'):
+            self._slots.acquire()
+            try:
+                future = self._executor.submit(write_spreadsheet, self.hca_template, cell_values(workbook),
+                                               workbook.properties, out_file)
+            except BaseException:
+                self._slots.release()
+                raise
+        future.add_done_callback(self._written)
+        return future
+
+    def _written(self, future: Future) -> None:
+        self._slots.release()
+        if future.exception() is None:
+            self.written += 1
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,19 +1,38 @@
 # --- core imports
+import io
 import logging
 import re
+import time
 import xml.etree.ElementTree as xm
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
 
 # ---application imports
-
+from geo_to_hca import config
 # --- third-party imports
 from geo_to_hca.utils.entrez_client import call_esearch, call_esummary, get_entrez_esearch, call_efetch
-from geo_to_hca.utils.handle_errors import no_related_study_err
+from geo_to_hca.utils.entrez_client import ESUMMARY_PAGE_SIZE, call_esummary_history
+from geo_to_hca.utils.handle_errors import NoRelatedStudy, no_related_study_err
+from geo_to_hca.utils import accession_index
+from geo_to_hca.utils import chunking
+from geo_to_hca.utils import deadline
+from geo_to_hca.utils import geo_family
+from geo_to_hca.utils import metadata_store
+from geo_to_hca.utils import negative_cache
+from geo_to_hca.utils import transport
+from geo_to_hca.utils.records import Run
 
 """
 Define constants.
 """
+# run info table columns, in the order of the Run record fields
+RUNINFO_COLUMNS = ['Run', 'Experiment', 'SRAStudy', 'BioProject', 'Sample', 'BioSample', 'TaxID', 'ScientificName',
+                   'SampleName']
+# dtypes of the run info table columns: the accessions and names are read as strings rather than inferred (the values
+# repeated across the runs of an experiment or study share one string object per parsed chunk, so a categorical dtype
+# would save little and takes longer to parse); TaxID is left to be inferred as integers, or floats with NaN when missing
+RUNINFO_DTYPES = {column: str for column in RUNINFO_COLUMNS if column != 'TaxID'}
 
 """
 Functions to handle requests from NCBI SRA database or NCBI eutils.
@@ -22,38 +41,118 @@ Functions to handle requests from NCBI SRA database or NCBI eutils.
 log = logging.getLogger(__name__)
 
 
-def get_srp_accession_from_geo(geo_accession: str) -> [str]:
+def get_srp_accession_from_geo(geo_accession: str) -> str:
+    """
+    Function to retrieve the SRA database study accession for a given input GEO accession: the first one, if the GEO
+    accession is a SuperSeries linked to several studies (see get_srp_accessions_from_geo).
+    """
+    return get_srp_accessions_from_geo(geo_accession)[0]
+
+
+def get_srp_accessions_from_geo(geo_accession: str) -> [str]:
     """
-    Function to retrieve any SRA database study accessions for a given input GEO accession.
+    Function to retrieve all SRA database study accessions for a given input GEO accession, from the accession index
+    if it was built or else from NCBI. A SuperSeries is expanded into the studies of its SubSeries, which are resolved
+    concurrently. Returns the study accessions in order, without duplicates.
     """
     regex = re.compile('^GSE.*$')
     if not regex.match(geo_accession):
         raise AssertionError(f'{geo_accession} is not a valid GEO accession')
 
+    index = accession_index.index()
+    related_studies = index.studies_for_geo_accession(geo_accession) if index else []
+    if related_studies:
+        log.debug(f'{geo_accession} is linked to {related_studies} in the accession index')
+        return related_studies
+
+    known_failure = negative_cache.known_failure(negative_cache.GEO_WITHOUT_SRA_STUDY, geo_accession)
+    if known_failure is not None:
+        raise NoRelatedStudy(f'Failed to get SRP accessions for GEO accession {geo_accession}: {known_failure}')
+    related_studies = request_srp_accessions_from_geo(geo_accession)
+    if config.RECHECK_NEGATIVE:
+        negative_cache.clear_failure(negative_cache.GEO_WITHOUT_SRA_STUDY, geo_accession)
+    return related_studies
+
+
+def request_srp_accessions_from_geo(geo_accession: str) -> [str]:
+    """
+    Function to request all SRA database study accessions of a GEO accession from NCBI (see
+    get_srp_accessions_from_geo).
+    """
     try:
         response_json = call_esearch(geo_accession, db='gds')
 
         for summary_id in response_json['idlist']:
-            related_study = find_related_object(summary_id, accession_type='SRP')
-            if related_study:
-                return related_study
-
-            # NOTE: this is a bit too complex, requires some cleanup
-            for sample in find_related_samples(summary_id):
-                sample_esearch_result = call_esearch(sample['accession'], db='gds')
-                for sample_id in sample_esearch_result['idlist']:
-                    experiment_accession = find_related_object(sample_id, accession_type='SRX')
-                    if experiment_accession:
-                        log.debug(f'sample {sample["accession"]} is linked to experiment {experiment_accession}')
-                        related_study = find_study_by_experiment_accession(experiment_accession)
-                        if related_study:
-                            return related_study
-        raise no_related_study_err(geo_accession)
+            related_studies = find_related_objects(summary_id, accession_type='SRP')
+            if related_studies:
+                return related_studies
+
+            subseries = find_subseries(summary_id)
+            if subseries:
+                log.info(f'{geo_accession} is a SuperSeries of {", ".join(subseries)}')
+                with ThreadPoolExecutor(max_workers=max(1, min(config.FETCH_WORKERS, len(subseries))),
+                                        thread_name_prefix='subseries') as executor:
+                    subseries_studies = list(executor.map(deadline.propagate(get_subseries_srp_accessions),
+                                                          subseries))
+                related_studies = list(dict.fromkeys(study for studies in subseries_studies for study in studies))
+                if related_studies:
+                    return related_studies
+
+            for experiment_accession in find_sample_experiments(geo_accession, summary_id):
+                related_study = find_study_by_experiment_accession(experiment_accession)
+                if related_study:
+                    return [related_study]
+        # every lookup was completed (the failure of a SubSeries lookup was raised)
+        error = no_related_study_err(geo_accession)
+        negative_cache.record_failure(negative_cache.GEO_WITHOUT_SRA_STUDY, geo_accession, str(error))
+        raise error
 
+    except NoRelatedStudy as e:
+        raise NoRelatedStudy(f'Failed to get SRP accessions for GEO accession {geo_accession}: {e}')
     except Exception as e:
         raise Exception(f'Failed to get SRP accessions for GEO accession {geo_accession}: {e}')
 
 
+def get_subseries_srp_accessions(geo_accession: str) -> [str]:
+    """
+    Function to retrieve the SRA study accessions of a SubSeries, or none if it has no SRA study (e.g. the SubSeries
+    of a SuperSeries which are microarray experiments). A lookup which could not be completed, e.g. after a request
+    timed out, is raised: the SuperSeries is not known to be without SRA study.
+    """
+    try:
+        return get_srp_accessions_from_geo(geo_accession)
+    except NoRelatedStudy as e:
+        log.info(f'no SRA study for SubSeries {geo_accession}: {e}')
+        return []
+
+
+def find_sample_experiments(geo_accession: str, summary_id: str):
+    """
+    Function to iterate over the SRA experiment accessions of the samples of a GEO series (given its accession and gds
+    id), in turn: looked up with an esearch and an esummary per sample or, when config.GEO_SAMPLE_SOURCE is 'family',
+    read from the family file of the series in one download (see geo_family).
+    """
+    if config.GEO_SAMPLE_SOURCE == 'family':
+        try:
+            samples = geo_family.request_family_samples(geo_accession)
+        except Exception as e:
+            deadline.check()
+            log.warning(f'no family file for {geo_accession}, its samples are looked up one by one: {e}')
+        else:
+            for sample in samples:
+                if sample.experiment:
+                    log.debug(f'sample {sample.accession} is linked to experiment {sample.experiment}')
+                    yield sample.experiment
+            return
+    for sample in find_related_samples(summary_id):
+        sample_esearch_result = call_esearch(sample['accession'], db='gds')
+        for sample_id in sample_esearch_result['idlist']:
+            experiment_accession = find_related_object(sample_id, accession_type='SRX')
+            if experiment_accession:
+                log.debug(f'sample {sample["accession"]} is linked to experiment {experiment_accession}')
+                yield experiment_accession
+
+
 def find_study_by_experiment_accession(experiment_accession):
     # search for accession in sra db using esearch
     experiment_esearch_result = call_esearch(experiment_accession, db='sra')
@@ -73,11 +172,7 @@ def find_related_samples(accession):
 
 
 def find_related_object(accession, accession_type):
-    esummary_response_json = call_esummary(accession, db='gds')
-    results = [x for x in esummary_response_json['result'].values() if type(x) is dict]
-    extrelations = [x for x in [x.get('extrelations') for x in results] for x in x]
-
-    related_objects = [relation['targetobject'] for relation in extrelations if accession_type in relation.get('targetobject', '')]
+    related_objects = find_related_objects(accession, accession_type)
     if not related_objects:
         return None
     if len(related_objects) > 1:
@@ -85,10 +180,30 @@ def find_related_object(accession, accession_type):
     return related_objects[0]
 
 
-def get_srp_metadata(srp_accession: str) -> pd.DataFrame:
+def find_related_objects(accession, accession_type):
+    esummary_response_json = call_esummary(accession, db='gds')
+    results = [x for x in esummary_response_json['result'].values() if type(x) is dict]
+    extrelations = [x for x in [x.get('extrelations') or [] for x in results] for x in x]
+
+    related_objects = [relation['targetobject'] for relation in extrelations if accession_type in relation.get('targetobject', '')]
+    return list(dict.fromkeys(related_objects))
+
+
+def find_subseries(accession):
     """
-    Function to retrieve a dataframe with multiple lists of experimental and sample accessions
-    associated with a particular SRA study accession from the SRA database.
+    Returns the GEO accessions of the SubSeries of a SuperSeries (given its gds id), or an empty list.
+    """
+    esummary_response_json = call_esummary(accession, db='gds')
+    results = [x for x in esummary_response_json['result'].values() if type(x) is dict]
+    relations = [x for x in [x.get('relations') or [] for x in results] for x in x]
+    return list(dict.fromkeys(relation['targetobject'] for relation in relations
+                              if relation.get('relationtype') == 'SuperSeries of'
+                              and relation.get('targetobject', '').startswith('GSE')))
+
+
+def get_srp_metadata_url(srp_accession: str) -> str:
+    """
+    Function to build the SRA efetch url of the run info table associated with a particular SRA study accession.
     """
     esearch_result = get_entrez_esearch(srp_accession)
     efetch_request = call_efetch(db="sra",
@@ -98,33 +213,131 @@ def get_srp_metadata(srp_accession: str) -> pd.DataFrame:
                                  retmode="text",
                                  mode='prepare')
     log.debug(f'srp_metadata url: {efetch_request.url}')
-    srp_metadata = pd.read_csv(efetch_request.url)
+    return efetch_request.url
+
+
+def get_srp_metadata(srp_accession: str) -> pd.DataFrame:
+    """
+    Function to retrieve a dataframe with multiple lists of experimental and sample accessions
+    associated with a particular SRA study accession from the SRA database. Only the columns used to build the HCA
+    spreadsheet (RUNINFO_COLUMNS) are read, with the dtypes of RUNINFO_DTYPES.
+    """
+    srp_metadata_url = get_srp_metadata_url(srp_accession)
+    response = transport.get(srp_metadata_url)
+    response.raise_for_status()
+    # columns selected by a callable, which does not fail on a missing column: a table without a Run column is
+    # reported below
+    srp_metadata = pd.read_csv(io.BytesIO(response.content), usecols=lambda column: column in RUNINFO_COLUMNS,
+                               dtype=RUNINFO_DTYPES)
     if 'Run' not in srp_metadata.columns:
-        raise RuntimeError(f'cannot build the srp_metadata from {efetch_request.url}: '
+        raise RuntimeError(f'cannot build the srp_metadata from {srp_metadata_url}: '
                            f'invalid response from efetch form {srp_accession}: missing Run column\n content: {srp_metadata}')
     return srp_metadata
 
 
-def parse_xml_SRA_runs(xml_content: object) -> object:
-    for experiment_package in xml_content.findall('EXPERIMENT_PACKAGE'):
-        yield experiment_package
+def iter_srp_metadata(srp_accession: str, chunksize: int) -> pd.io.parsers.TextFileReader:
+    """
+    Function to read the run info table associated with a particular SRA study accession in chunks of chunksize runs,
+    keeping only the columns used to build the HCA spreadsheet (RUNINFO_COLUMNS). Different chunk sizes can be
+    requested from the returned reader with get_chunk(size).
+    """
+    srp_metadata_url = get_srp_metadata_url(srp_accession)
+    response = transport.get(srp_metadata_url, stream=True)
+    response.raise_for_status()
+    response.raw.decode_content = True
+    try:
+        return pd.read_csv(response.raw, chunksize=chunksize, usecols=RUNINFO_COLUMNS, dtype=RUNINFO_DTYPES)
+    except ValueError as e:
+        raise RuntimeError(f'cannot build the srp_metadata from {srp_metadata_url}: '
+                           f'invalid response from efetch form {srp_accession}: {e}') from e
 
 
-def request_fastq_from_SRA(srr_accessions: []) -> object:
+def get_runs(srp_metadata: pd.DataFrame) -> [Run]:
     """
-    Function to retrieve an xml file containing information associated with a list of NCBI SRA run accessions.
-    In particular, the xml contains the paths to the data (if available) in fastq or other format.
+    Function to build the Run records of the rows of a run info table (dataframe), in the order of the table.
+    """
+    return [Run(*row) for row in srp_metadata[RUNINFO_COLUMNS].itertuples(index=False, name=None)]
+
+
+def get_study_runs(srp_accession: str) -> [Run]:
+    """
+    Function to get the Run records of an SRA study from the accession index or the metadata store or, if they are in
+    neither, from its run info table (which are then stored).
+    """
+    index = accession_index.index()
+    runs = index.get_runs(srp_accession) if index else None
+    if runs is not None:
+        log.info(f'{len(runs)} runs of {srp_accession} read from the accession index')
+        return runs
+    store = metadata_store.store()
+    runs = store.get_runs(srp_accession) if store else None
+    if runs is None:
+        runs = get_runs(get_srp_metadata(srp_accession))
+        if store:
+            store.put_runs(srp_accession, runs)
+    else:
+        log.info(f'{len(runs)} runs of {srp_accession} read from the metadata store')
+    return runs
+
+
+def get_study_size(srp_accession: str) -> int:
+    """
+    Function to count the runs of an SRA study cheaply, without its run info table: from the accession index or the
+    metadata store if they have its runs, otherwise from the runs listed in the esummaries of the experiments of the
+    study. The count of an esearch of the study is its number of experiments, which may have many runs each (e.g. one
+    per sequencing lane).
+    """
+    index = accession_index.index()
+    runs = index.get_runs(srp_accession) if index else None
+    if runs is None:
+        store = metadata_store.store()
+        runs = store.get_runs(srp_accession) if store else None
+    if runs is not None:
+        return len(runs)
+    esearch_result = get_entrez_esearch(srp_accession, db='sra')
+    n_runs = 0
+    for retstart in range(0, int(esearch_result['count']), ESUMMARY_PAGE_SIZE):
+        result = call_esummary_history(esearch_result['webenv'], esearch_result['querykey'], db='sra',
+                                       retstart=retstart, retmax=ESUMMARY_PAGE_SIZE)['result']
+        n_runs += sum(result[uid].get('runs', '').count('<Run ') for uid in result.get('uids', []))
+    return n_runs
+
+
+def iter_SRA_experiment_packages(srr_accessions: []) -> object:
+    """
+    Function to request the xml associated with a list of NCBI SRA run accessions, which contains the paths to the
+    data (if available) in fastq or other format. The response is parsed as it is received: each EXPERIMENT_PACKAGE
+    element is yielded once it has been parsed and is discarded afterwards, so the whole xml is never held in memory.
     """
     esearch_result = get_entrez_esearch(",".join(srr_accessions))
-    srr_metadata_url = call_efetch(db='sra',
-                                   accessions=srr_accessions,
-                                   webenv=esearch_result['webenv'],
-                                   query_key=esearch_result['querykey'])
+    srr_metadata_response = call_efetch(db='sra',
+                                        accessions=srr_accessions,
+                                        webenv=esearch_result['webenv'],
+                                        query_key=esearch_result['querykey'],
+                                        stream=True)
     try:
-        xml_content = xm.fromstring(srr_metadata_url.content)
-    except:
-        xml_content = None
-    return xml_content
+        srr_metadata_response.raise_for_status()
+        srr_metadata_response.raw.decode_content = True
+        root = None
+        for event, element in xm.iterparse(srr_metadata_response.raw, events=('start', 'end')):
+            if root is None:
+                root = element
+            if event == 'end' and element.tag == 'EXPERIMENT_PACKAGE':
+                yield element
+                root.clear()
+    finally:
+        srr_metadata_response.close()
+
+
+def accession_type_db(accession_type: str) -> str:
+    """
+    Returns the eutils database of biosample or experiment accessions.
+    """
+    if accession_type == 'biosample':
+        return 'biosample'
+    elif accession_type == 'experiment':
+        return 'sra'
+    raise ValueError(f'unsupported accession_type: {accession_type}')
 
 
 def request_accession_info(accessions: [], accession_type: str) -> object:
@@ -132,13 +345,10 @@ def request_accession_info(accessions: [], accession_type: str) -> object:
     Function which sends a request to NCBI SRA database to get an xml file with metadata about a
     given list of biosample or experiment accessions. The xml contains various metadata fields.
     """
-    if accession_type == 'biosample':
-        db = f'biosample'
-    elif accession_type == 'experiment':
-        db = f'sra'
-    else:
-        raise ValueError(f'unsupported accession_type: {accession_type}')
+    db = accession_type_db(accession_type)
+    start = time.perf_counter()
     sra_url = call_efetch(db, accessions)
+    chunking.chunker(db).record(len(accessions), len(sra_url.content), time.perf_counter() - start)
     return xm.fromstring(sra_url.content)
 
 
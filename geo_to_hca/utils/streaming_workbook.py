@@ -0,0 +1,75 @@
+# --- core imports
+import logging
+from collections import Counter
+
+# --- third-party imports
+from openpyxl import load_workbook, Workbook
+from openpyxl.xml import LXML
+
+log = logging.getLogger(__name__)
+
+
+class StreamingWorkbook:
+    """
+    Write-only copy of an HCA metadata spreadsheet template. The header rows of every tab are copied from the template
+    and metadata rows are appended to the tabs as they are produced, so rows are streamed to disk instead of being
+    held in memory. Rows are kept in the order they are appended and the cell styles of the template are not copied.
+
+    openpyxl only streams the rows of write-only worksheets when lxml is installed, otherwise each tab is buffered
+    until the workbook is saved.
+    """
+    def __init__(self, hca_template, header_row: int = 4, input_row1: int = 6):
+        if not LXML:
+            log.warning('lxml is not available: write-only worksheet rows are buffered in memory until saved')
+        template = load_workbook(filename=hca_template, read_only=True)
+        self.workbook = Workbook(write_only=True)
+        self.worksheets = {}
+        self.columns = {}
+        self.row_counts = Counter()
+        for sheet in template.worksheets:
+            worksheet = self.workbook.create_sheet(sheet.title)
+            header_rows = list(sheet.iter_rows(min_row=1, max_row=input_row1 - 1, values_only=True))
+            for row in header_rows:
+                worksheet.append(row)
+            self.worksheets[sheet.title] = worksheet
+            self.columns[sheet.title] = self._programmatic_names(header_rows, header_row)
+        template.close()
+
+    @staticmethod
+    def _programmatic_names(header_rows: [], header_row: int) -> []:
+        """
+        Returns the programmatic names of the tab columns, up to the first empty header cell.
+        """
+        names = []
+        if len(header_rows) >= header_row:
+            for name in header_rows[header_row - 1]:
+                if not name:
+                    break
+                names.append(name)
+        return names
+
+    @property
+    def properties(self):
+        return self.workbook.properties
+
+    def append_rows(self, tab_name: str, rows: [{}]) -> None:
+        """
+        Appends rows (dictionaries keyed by programmatic name) to a tab. Keys that are not columns of the tab are
+        ignored.
+        """
+        worksheet = self.worksheets[tab_name]
+        columns = self.columns[tab_name]
+        for row in rows:
+            worksheet.append([self._cell_value(row.get(column)) for column in columns])
+            self.row_counts[tab_name] += 1
+
+    @staticmethod
+    def _cell_value(value):
+        # NaN (the only value not equal to itself) is left as an empty cell
+        if value != value:
+            return None
+        return value
+
+    def save(self, out_file: str) -> None:
+        log.debug(f'saving streamed workbook with rows per tab: {dict(self.row_counts)}')
+        self.workbook.save(out_file)
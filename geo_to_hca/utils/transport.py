@@ -0,0 +1,436 @@
+"""
+HTTP transport shared by all requests to NCBI eutils, ENA and EuropePMC.
+
+Requests go through a single requests session, so connections are pooled and reused across requests and threads.
+Calls to eutils are spaced by a rate limiter shared by all threads of the process (eutils allows 3 calls per second
+without an api key, otherwise they return 429). Successful responses of requests which are safe to repeat can be
+kept in an in-memory cache, bounded by the total size of their content, and in the http cache of config.CACHE_DIR,
+from which later runs revalidate them with conditional requests rather than downloading them again. Responses are
+requested gzip compressed. Every request has a timeout, capped to the time left before the deadline of the accession
+being processed.
+
+The number of requests in flight to each host is limited by a ConcurrencyLimiter, which adapts the limit to what the
+host tolerates: it grows additively while requests succeed and is cut multiplicatively when the host answers 429 or
+503 or when its latency rises well above its usual latency (AIMD). Requests answered 429 or 503 are retried after a
+backoff.
+"""
+# --- core imports
+import logging
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+
+# --- third-party imports
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+# --- application imports
+from geo_to_hca import config
+from geo_to_hca.utils import cache
+from geo_to_hca.utils import deadline
+from geo_to_hca.utils import handle_errors
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_session = None
+_response_cache = None
+_rate_limiters = {}
+_concurrency_limiters = {}
+_http_cache_stats = {'fresh': 0, 'revalidated': 0, 'stored': 0}
+
+# statuses of a host asking for fewer requests, which are retried after a backoff
+THROTTLED_STATUSES = (429, 503)
+# weights of the latest request in the fast (current) and slow (usual) latency averages of a host
+FAST_SMOOTHING = 0.3
+SLOW_SMOOTHING = 0.02
+# the limit of a host is cut by this factor on a 429/503 or a rise in latency
+DECREASE_FACTOR = 0.5
+# the usual latency of a host is only trusted after this many requests
+LATENCY_WARMUP_REQUESTS = 10
+
+# request headers of the conditional requests revalidating a stored response, by response header
+VALIDATORS = {'ETag': 'If-None-Match', 'Last-Modified': 'If-Modified-Since'}
+STORED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+
+class RateLimiter:
+    """
+    Spaces the calls to a service so that at most `rate` calls per second are started, across all threads.
+    """
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate else 0
+        self.calls = 0
+        self.waited_seconds = 0.0
+        self._next_call = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_call)
+            self._next_call = start + self.interval
+            self.calls += 1
+            self.waited_seconds += start - now
+        if start > now:
+            time.sleep(start - now)
+
+    def stats(self) -> {}:
+        return {'calls': self.calls, 'waited_seconds': round(self.waited_seconds, 3), 'interval': self.interval}
+
+
+class ConcurrencyLimiter:
+    """
+    Limits the number of requests in flight to a host, adapting the limit to the responses (additive increase,
+    multiplicative decrease): each successful request raises the limit by 1/limit, i.e. by about one request per round
+    of `limit` requests, and a 429/503 answer or a current latency above latency_tolerance times the usual latency of
+    the host cuts it by half, at most once per round trip so that the requests of one burst only cut it once.
+
+    Latencies are the time to the response headers, averaged per endpoint (e.g. esearch and efetch have very different
+    usual latencies) over the last few requests (current) and over many requests (usual).
+    """
+    def __init__(self, host: str, initial: int, min_limit: int, max_limit: int, latency_tolerance: float):
+        self.host = host
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial)))
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+        self.throttled = 0
+        self.decreases = 0
+        self.latencies = {}
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        """
+        Waits until a request to the host can be sent without exceeding the limit, or until the deadline of the
+        accession being processed has passed.
+        """
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait(timeout=1.0)
+                deadline.check()
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def release(self, status_code: int = None, seconds: float = None, endpoint: str = '') -> None:
+        """
+        Records the outcome of a request sent after acquire: its status (None if it failed without a response) and
+        the latency of the endpoint (path) it was sent to.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            self.requests += 1
+            if status_code in THROTTLED_STATUSES:
+                self.throttled += 1
+                self._decrease(f'{status_code} response')
+            elif status_code is not None and seconds is not None:
+                self._observe(endpoint, seconds)
+            self._condition.notify_all()
+
+    def _observe(self, endpoint: str, seconds: float) -> None:
+        latency = self.latencies.get(endpoint)
+        if latency is None:
+            latency = self.latencies[endpoint] = {'current': seconds, 'usual': seconds, 'requests': 0}
+        latency['current'] = FAST_SMOOTHING * seconds + (1 - FAST_SMOOTHING) * latency['current']
+        latency['usual'] = SLOW_SMOOTHING * seconds + (1 - SLOW_SMOOTHING) * latency['usual']
+        latency['requests'] += 1
+        if latency['requests'] > LATENCY_WARMUP_REQUESTS and \
+                latency['current'] > self.latency_tolerance * latency['usual']:
+            self._decrease(f'latency of {latency["current"]:.3f}s (usually {latency["usual"]:.3f}s) of {endpoint}',
+                           latency['current'])
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def _decrease(self, reason: str, round_trip_seconds: float = 0.0) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < max([round_trip_seconds] + [latency['current']
+                                                                    for latency in self.latencies.values()]):
+            return
+        self._last_decrease = now
+        limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+        if int(limit) != int(self.limit):
+            log.info(f'{reason} from {self.host}: in-flight requests limited to {int(limit)}')
+        self.limit = limit
+        self.decreases += 1
+
+    def stats(self) -> {}:
+        with self._condition:
+            return {'limit': int(self.limit), 'in_flight': self.in_flight, 'max_in_flight': self.max_in_flight,
+                    'requests': self.requests, 'throttled': self.throttled, 'decreases': self.decreases,
+                    'latencies': {endpoint: {'current': round(latency['current'], 3),
+                                             'usual': round(latency['usual'], 3)}
+                                  for endpoint, latency in self.latencies.items()}}
+
+
+class ResponseCache:
+    """
+    Least recently used cache of responses, keyed by request url and bounded by the total size of their content.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> requests.Response:
+        with self._lock:
+            response = self._responses.get(key)
+            if response is None:
+                self.misses += 1
+                return None
+            self._responses.move_to_end(key)
+            self.hits += 1
+            return response
+
+    def put(self, key: str, response: requests.Response) -> None:
+        size = len(response.content)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._responses:
+                self.size -= len(self._responses.pop(key).content)
+            self._responses[key] = response
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self._responses.popitem(last=False)
+                self.size -= len(evicted.content)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._responses.clear()
+            self.size = 0
+
+    def stats(self) -> {}:
+        return {'entries': len(self._responses), 'bytes': self.size, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses}
+
+
+def session() -> requests.Session:
+    """
+    Returns the requests session shared by the process, with a connection pool of config.HTTP_POOL_SIZE connections
+    per host.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            # also decoded by the streaming parsers, which read response.raw with decode_content
+            _session.headers['Accept-Encoding'] = 'gzip, deflate'
+            adapter = HTTPAdapter(pool_connections=config.HTTP_POOL_SIZE, pool_maxsize=config.HTTP_POOL_SIZE)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
+def response_cache() -> ResponseCache:
+    global _response_cache
+    with _lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(config.RESPONSE_CACHE_MB * 2 ** 20)
+        return _response_cache
+
+
+def rate_limiter(url: str) -> RateLimiter:
+    """
+    Returns the rate limiter of the service of a url, or None if calls to that service are not rate limited.
+    """
+    if not url.startswith(config.EUTILS_BASE_URL):
+        return None
+    with _lock:
+        limiter = _rate_limiters.get(config.EUTILS_BASE_URL)
+        if limiter is None:
+            limiter = _rate_limiters[config.EUTILS_BASE_URL] = RateLimiter(config.EUTILS_RATE_LIMIT)
+        return limiter
+
+
+def concurrency_limiter(url: str) -> ConcurrencyLimiter:
+    """
+    Returns the concurrency limiter of the host of a url.
+    """
+    host = urllib.parse.urlsplit(url).netloc
+    with _lock:
+        limiter = _concurrency_limiters.get(host)
+        if limiter is None:
+            limiter = _concurrency_limiters[host] = ConcurrencyLimiter(
+                host, config.HTTP_CONCURRENCY_INITIAL, config.HTTP_CONCURRENCY_MIN, config.HTTP_CONCURRENCY_MAX,
+                config.HTTP_LATENCY_TOLERANCE)
+        return limiter
+
+
+def get(url: str, params: {} = None, cache: bool = False, stream: bool = False, **kwargs) -> requests.Response:
+    """
+    Sends a GET request through the shared session, waiting for the rate limiter of the service first. With
+    cache=True, a successful response is kept in the response cache and returned again for the same url and params
+    (see send).
+    """
+    key = requests.Request('GET', url, params=params).prepare().url if cache and not stream else None
+    return send('GET', url, key, params=params, stream=stream, **kwargs)
+
+
+def post(url: str, data: {} = None, cache: bool = False, stream: bool = False, **kwargs) -> requests.Response:
+    """
+    Sends a POST request through the shared session, like get, with the parameters form encoded in the body rather
+    than in the url, e.g. for long lists of ids. With cache=True, a successful response is cached by url and
+    parameters, as a GET request with the same parameters would be.
+    """
+    key = 'POST ' + requests.Request('GET', url, params=data).prepare().url if cache and not stream else None
+    return send('POST', url, key, data=data, stream=stream, **kwargs)
+
+
+def send(method: str, url: str, key: str = None, **kwargs) -> requests.Response:
+    """
+    Sends a request through the shared session, waiting for the rate limiter of the service first. Responses to
+    requests with a cache key are looked up in the in-memory response cache, then in the http cache of
+    config.CACHE_DIR: stored responses younger than config.HTTP_CACHE_FRESH_HOURS are returned as they are and older
+    ones are revalidated with a conditional request (If-None-Match / If-Modified-Since), so that a response which did
+    not change is not downloaded again.
+
+    Requests time out after config.HTTP_CONNECT_TIMEOUT_SECONDS without a connection and
+    config.HTTP_READ_TIMEOUT_SECONDS without data, or earlier when the deadline of the accession being processed is
+    closer (see deadline); once that deadline has passed, no request is sent and DeadlineExceeded is raised. With
+    config.OFFLINE, only cached responses are returned and OfflineError is raised instead of sending a request.
+    """
+    stored = None
+    if key:
+        response = response_cache().get(key)
+        if response is not None:
+            log.debug(f'cached response for {key}')
+            return response
+        http_cache = cache.http_cache()
+        stored = http_cache.get(key) if http_cache else None
+        if stored:
+            headers, content, stored_time = stored
+            # when known failures are rechecked, stored responses are revalidated even if they are fresh
+            if not config.RECHECK_NEGATIVE and time.time() - stored_time < config.HTTP_CACHE_FRESH_HOURS * 3600:
+                _count('fresh')
+                return _cache_response(key, _stored_response(url, headers, content))
+            validators = {name: headers[header] for header, name in VALIDATORS.items() if headers.get(header)}
+            if not validators:
+                stored = None
+            kwargs['headers'] = {**kwargs.get('headers', {}), **validators}
+    if config.OFFLINE:
+        raise handle_errors.OfflineError(url)
+    response = _send_with_retries(method, url, **kwargs)
+    if stored and response.status_code == 304:
+        _count('revalidated')
+        cache.http_cache().touch(key)
+        headers, content, _ = stored
+        return _cache_response(key, _stored_response(url, headers, content))
+    if key and response.status_code == 200:
+        _cache_response(key, response)
+        http_cache = cache.http_cache()
+        if http_cache:
+            _count('stored')
+            http_cache.put(key, {header: response.headers[header] for header in STORED_HEADERS
+                                 if header in response.headers}, response.content)
+    return response
+
+
+def _send_with_retries(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Sends a request within the rate limit of its service and the concurrency limit of its host, retrying it up to
+    config.HTTP_RETRIES times when the host answers 429 or 503.
+    """
+    limiter = concurrency_limiter(url)
+    service_limiter = rate_limiter(url)
+    endpoint = urllib.parse.urlsplit(url).path
+    for attempt in range(config.HTTP_RETRIES + 1):
+        deadline.check()
+        limiter.acquire()
+        try:
+            if service_limiter:
+                service_limiter.wait()
+                deadline.check()
+            response = session().request(method, url, timeout=deadline.timeout(config.HTTP_CONNECT_TIMEOUT_SECONDS,
+                                                                                config.HTTP_READ_TIMEOUT_SECONDS),
+                                         **kwargs)
+        except requests.exceptions.Timeout:
+            limiter.release()
+            # the timeout was cut short by the deadline of the accession
+            deadline.check()
+            raise
+        except Exception:
+            limiter.release()
+            raise
+        limiter.release(response.status_code, response.elapsed.total_seconds(), endpoint)
+        if response.status_code not in THROTTLED_STATUSES or attempt == config.HTTP_RETRIES:
+            return response
+        backoff = _retry_after(response)
+        if backoff is None:
+            backoff = config.HTTP_RETRY_BACKOFF_SECONDS * 2 ** attempt
+        log.info(f'{response.status_code} from {url}, retrying in {backoff:g}s')
+        response.close()
+        current_deadline = deadline.current()
+        time.sleep(min(backoff, current_deadline.remaining()) if current_deadline else backoff)
+    return response
+
+
+def _retry_after(response: requests.Response) -> float:
+    """
+    Returns the delay in seconds asked for by the Retry-After header of a response, if given as a number.
+    """
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _cache_response(key: str, response: requests.Response) -> requests.Response:
+    response_cache().put(key, response)
+    return response
+
+
+def _stored_response(url: str, headers: {}, content: bytes) -> requests.Response:
+    """
+    Builds a response from the headers and (decoded) content of a response of the http cache.
+    """
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = get_encoding_from_headers(response.headers)
+    response._content = content
+    return response
+
+
+def _count(name: str) -> None:
+    with _lock:
+        _http_cache_stats[name] += 1
+
+
+def stats() -> {}:
+    """
+    Returns the statistics of the response cache, of the rate limiters and of the concurrency limit of each host.
+    """
+    with _lock:
+        limiters = {base_url: limiter.stats() for base_url, limiter in _rate_limiters.items()}
+        concurrency_limiters = list(_concurrency_limiters.items())
+        http_cache_stats = dict(_http_cache_stats)
+    return {'response_cache': response_cache().stats(), 'http_cache': http_cache_stats, 'rate_limiters': limiters,
+            'concurrency': {host: limiter.stats() for host, limiter in concurrency_limiters}}
+
+
+def reset() -> None:
+    """
+    Closes the session and drops the response cache and the rate and concurrency limiters, e.g. after the
+    configuration changed.
+    """
+    global _session, _response_cache
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _response_cache = None
+        _rate_limiters.clear()
+        _concurrency_limiters.clear()
+        for name in _http_cache_stats:
+            _http_cache_stats[name] = 0
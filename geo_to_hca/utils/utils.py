@@ -1,8 +1,7 @@
 # --- core imports
-import argparse
 import logging
 import multiprocessing
-import os
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 
 # --- third-party imports
@@ -13,7 +12,13 @@ from openpyxl.utils.cell import get_column_letter
 import geo_to_hca.utils.entrez_client
 from geo_to_hca.utils import get_attribs
 # ---application imports
+from geo_to_hca import config
+from geo_to_hca.utils import chunking
+from geo_to_hca.utils import deadline
+from geo_to_hca.utils import metadata_store
+from geo_to_hca.utils import negative_cache
 from geo_to_hca.utils import sra_utils
+from geo_to_hca.utils.records import Project, Publication
 
 log = logging.getLogger(__name__)
 
@@ -48,70 +53,136 @@ def test_number_fastq_files(fastq_map: {}) -> {}:
     return fastq_map
 
 
-def get_pubmed_metadata(project_pubmed_id: str, iteration: int) -> []:
+def get_pubmed_metadata(project_pubmed_id: str, iteration: int) -> Publication:
     """
     Function to fetch publication metadata from an xml following a request to NCBI.
     A pubmed id is provided in the request url. If a project title or name is found but not publication title is found,
     a further request is sent to Europe PMC to try to find the publication title given the project title or project name.
-    """
-    xml_content = geo_to_hca.utils.entrez_client.request_pubmed_metadata(project_pubmed_id)
-    title, author_list, grant_list, article_doi_id = get_attribs.get_attributes_pubmed(xml_content, iteration)
-    return title, author_list, grant_list, article_doi_id
-
-
-def get_bioproject_metadata(bioproject_accession: str) -> []:
+    Publications found are kept in the metadata store.
+    """
+    store = metadata_store.store()
+    publication = store.get_publication(project_pubmed_id) if store else None
+    if publication is None:
+        if negative_cache.known_failure(negative_cache.PUBMED_ID_NOT_FOUND, project_pubmed_id) is not None:
+            return Publication('', [], [], '')
+        xml_content = geo_to_hca.utils.entrez_client.request_pubmed_metadata(project_pubmed_id)
+        if not geo_to_hca.utils.entrez_client.has_pubmed_article(xml_content):
+            negative_cache.record_failure(negative_cache.PUBMED_ID_NOT_FOUND, project_pubmed_id)
+        elif config.RECHECK_NEGATIVE:
+            negative_cache.clear_failure(negative_cache.PUBMED_ID_NOT_FOUND, project_pubmed_id)
+        publication = get_attribs.get_attributes_pubmed(xml_content, iteration)
+        if store and publication.title:
+            store.put_publication(project_pubmed_id, publication)
+    return publication
+
+
+def get_pubmed_metadata_batch(pubmed_ids: [str], nthreads: int = 1) -> {}:
+    """
+    Function to fetch the publication metadata of many pubmed IDs, requesting them from NCBI in batches of
+    PUBMED_BATCH_SIZE IDs (up to nthreads batches at a time) rather than one request per ID. Returns the
+    publications by pubmed ID; pubmed IDs which were not found are left out. Publications in the metadata store are
+    not requested again.
+    """
+    pubmed_ids = list(dict.fromkeys(str(pubmed_id).strip() for pubmed_id in pubmed_ids if str(pubmed_id).strip()))
+    store = metadata_store.store()
+    stored = {}
+    if store:
+        for pubmed_id in pubmed_ids:
+            publication = store.get_publication(pubmed_id)
+            if publication is not None:
+                stored[pubmed_id] = publication
+    known_failures = {pubmed_id for pubmed_id in pubmed_ids if pubmed_id not in stored and
+                      negative_cache.known_failure(negative_cache.PUBMED_ID_NOT_FOUND, pubmed_id) is not None}
+    parts_list = split_list([pubmed_id for pubmed_id in pubmed_ids
+                             if pubmed_id not in stored and pubmed_id not in known_failures],
+                            n=geo_to_hca.utils.entrez_client.PUBMED_BATCH_SIZE)
+    with ThreadPoolExecutor(max_workers=max(1, min(nthreads, len(parts_list) or 1))) as executor:
+        parts = list(executor.map(deadline.propagate(geo_to_hca.utils.entrez_client.request_pubmed_articles),
+                                  parts_list))
+    fetched = {}
+    for articles in parts:
+        for pubmed_id, xml_content in articles.items():
+            fetched[pubmed_id] = get_attribs.get_attributes_pubmed(xml_content, iteration=1)
+            if config.RECHECK_NEGATIVE:
+                negative_cache.clear_failure(negative_cache.PUBMED_ID_NOT_FOUND, pubmed_id)
+            if store and fetched[pubmed_id].title:
+                store.put_publication(pubmed_id, fetched[pubmed_id])
+    publications = {pubmed_id: stored.get(pubmed_id) or fetched[pubmed_id] for pubmed_id in pubmed_ids
+                    if pubmed_id in stored or pubmed_id in fetched}
+    for pubmed_id in pubmed_ids:
+        if pubmed_id not in publications:
+            log.info(f'no publication found for pubmed id {pubmed_id}')
+            if pubmed_id not in known_failures:
+                negative_cache.record_failure(negative_cache.PUBMED_ID_NOT_FOUND, pubmed_id)
+    return publications
+
+
+def get_bioproject_metadata(bioproject_accession: str) -> Project:
     """
     Function to fetch project metadata from an xml following a request to NCBI.
-    An SRA Bioproject accession is provided in the request url.
+    An SRA Bioproject accession is provided in the request url. Projects are kept in the metadata store.
     """
-    xml_content = geo_to_hca.utils.entrez_client.request_bioproject_metadata(bioproject_accession)
-    project_name, project_title, project_description, project_pubmed_id = get_attribs.get_attributes_bioproject(
-        xml_content, bioproject_accession)
-    return project_name, project_title, project_description, project_pubmed_id
+    store = metadata_store.store()
+    project = store.get_project(bioproject_accession) if store else None
+    if project is None:
+        xml_content = geo_to_hca.utils.entrez_client.request_bioproject_metadata(bioproject_accession)
+        project = get_attribs.get_attributes_bioproject(xml_content, bioproject_accession)
+        if store:
+            store.put_project(bioproject_accession, project)
+    return project
 
 
-def get_experimental_metadata(accessions: [], accession_type: str) -> [[], str]:
+def get_experimental_metadata(accessions: [], accession_type: str):
     """
-    Function to decide which accessions to send per request, if more than 1 is needed, to the SRA database
-    via the request_info function. This decision is made based on the length of the accession list. If the accession list
-    is >100 accessions in length, the list will first be split into a nested list of smaller
-    lists of accessions and a nested list will be returned. Otherwise, an unnested list will be returned.
+    Function to decide which accessions to send per request to the SRA database via the request_accession_info
+    function. The accessions are sent in chunks sized by the adaptive chunker of the database from the bytes and
+    seconds per accession of the previous responses. Yields the xml of each chunk.
     """
-    if len(accessions) < 100:
-        xml = sra_utils.request_accession_info(accessions, accession_type=accession_type)
-        size = 'small'
-        return xml, size
-    else:
-        size = 'large'
-        parts_list = split_list(accessions, n=100)
-        xmls = []
-        for p in range(0, len(parts_list)):
-            xml = sra_utils.request_accession_info(parts_list[p], accession_type=accession_type)
-            xmls.append(xml)
-        return xmls, size
+    db_chunker = chunking.chunker(sra_utils.accession_type_db(accession_type))
+    for part in db_chunker.chunks(accessions):
+        yield sra_utils.request_accession_info(part, accession_type=accession_type)
 
 
 def fetch_experimental_metadata(accessions_list: [], accession_type: str) -> []:
+    """
+    Function to get the metadata attributes associated with a list of either biosample or experiment accessions
+    (biosample & experiment are accession types) from the metadata store, fetching the ones which are not stored
+    (unless config.OFFLINE, e.g. when rendering from a bundle, which lacks the accessions NCBI did not return).
+    Returns BioSample or Experiment records; when the metadata store is used, in the order of the accessions.
+    """
+    store = metadata_store.store()
+    if not store:
+        return request_experimental_metadata(accessions_list, accession_type)
+    get_stored, put = {
+        'biosample': (store.get_biosamples, store.put_biosamples),
+        'experiment': (store.get_experiments, store.put_experiments),
+    }[accession_type]
+    records = get_stored(accessions_list)
+    missing = [accession for accession in accessions_list if accession not in records]
+    fetched = request_experimental_metadata(missing, accession_type) if missing and not config.OFFLINE else []
+    put(fetched)
+    unlisted = []
+    for record in fetched:
+        if record.accession in records or not record.accession:
+            unlisted.append(record)
+        else:
+            records[record.accession] = record
+    accessions = set(accessions_list)
+    return ([records[accession] for accession in accessions_list if accession in records] +
+            [record for accession, record in records.items() if accession not in accessions] + unlisted)
+
+
+def request_experimental_metadata(accessions_list: [], accession_type: str) -> []:
     """
     Function to fetch metadata attributes associated with a list of either biosample or
-    experiment accessions (biosample & experiment are accession types).
+    experiment accessions (biosample & experiment are accession types). Returns BioSample or Experiment records.
     """
-    xml_content_result, size = get_experimental_metadata(accessions_list, accession_type=accession_type)
-    if size == 'large':
-        nested_list = []
-        if accession_type == 'biosample':
-            for xml_content in xml_content_result:
-                nested_list.extend([get_attribs.get_attributes_biosample(element) for element in xml_content])
-        elif accession_type == 'experiment':
-            for xml_content in xml_content_result:
-                for experiment_package in xml_content.findall('EXPERIMENT_PACKAGE'):
-                    nested_list.extend([get_attribs.get_attributes_library_protocol(experiment_package)])
-    else:
+    nested_list = []
+    for xml_content in get_experimental_metadata(accessions_list, accession_type=accession_type):
         if accession_type == 'biosample':
-            nested_list = [get_attribs.get_attributes_biosample(element) for element in xml_content_result]
+            nested_list.extend([get_attribs.get_attributes_biosample(element) for element in xml_content])
         elif accession_type == 'experiment':
-            nested_list = []
-            for experiment_package in xml_content_result.findall('EXPERIMENT_PACKAGE'):
+            for experiment_package in xml_content.findall('EXPERIMENT_PACKAGE'):
                 nested_list.extend([get_attribs.get_attributes_library_protocol(experiment_package)])
     return nested_list
 
@@ -126,34 +197,6 @@ def poolcontext(*args, **kwargs):
     pool.terminate()
 
 
-def check_list_str(values: str) -> []:
-    """
-    Checks if an input accession list is a list of comma-separated strings (accessions). Returns a list
-    of accessions if True.
-    """
-    if "," not in values:
-        raise argparse.ArgumentTypeError("Argument list not valid: comma separated list required")
-    return values.split(',')
-
-
-def check_file(path: str) -> []:
-    """
-    Checks if an input file with a list of accessions is in the required format. The file should consist of a
-    single column (list) of accessions with the column name "accession".
-    """
-    if not os.path.exists(path):
-        raise argparse.ArgumentTypeError("file %s does not exist" % (path))
-    try:
-        df = pd.read_csv(path, sep="\t")
-    except:
-        raise argparse.ArgumentTypeError("file %s is not a valid format" % (path))
-    try:
-        geo_accession_list = list(df["accession"])
-    except:
-        raise argparse.ArgumentTypeError("accession list column not found in file %s" % (path))
-    return geo_accession_list
-
-
 def get_empty_df(workbook: object, tab_name: str) -> pd.DataFrame:
     """
     Initialise an empty dataframe for the tab name specified. The tab name is a tab expected to be
@@ -184,5 +227,6 @@ def write_to_wb(workbook: Workbook, tab_name: str, tab_content: pd.DataFrame) ->
             break
         if key.value not in tab_content.keys():
             continue
-        for i in range(len(tab_content[key.value])):
-            worksheet[f"{get_column_letter(index + 1)}{i + row_not_filled}"] = list(tab_content[key.value])[i]
+        values = list(tab_content[key.value])
+        for i in range(len(values)):
+            worksheet[f"{get_column_letter(index + 1)}{i + row_not_filled}"] = values[i]
@@ -21,12 +21,14 @@ setup(
         "Programming Language :: Python :: 3.10",
         "License :: OSI Approved :: Apache Software License",
     ],
-    packages=find_packages(exclude=["tests", "tests.*"]),
+    packages=find_packages(exclude=["tests", "tests.*", "benchmarks", "benchmarks.*"]),
     install_requires=install_requires,
     include_package_data=True,
     entry_points={
         "console_scripts": [
-            "geo-to-hca=geo_to_hca.geo_to_hca:main",
+            "geo-to-hca=geo_to_hca.cli:main",
+            "geo-to-hca-service=geo_to_hca.service:main",
+            "geo-to-hca-index=geo_to_hca.index:main",
         ]
     },
 )
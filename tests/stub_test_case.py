@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+
+from benchmarks.stub_server import StubServer
+from geo_to_hca import config
+
+
+class StubTestCase(unittest.TestCase):
+    """
+    A test case run against a StubServer (see benchmarks/stub_server.py), with helpers for the temporary directories,
+    configuration and module state of a test, all restored when the test ends.
+    """
+
+    def start_stub(self, studies, superseries=(), **kwargs) -> StubServer:
+        """
+        Serves the given studies (and SuperSeries) until the end of the test, with the configuration pointed at them.
+        """
+        stub = StubServer(studies, superseries=superseries, **kwargs)
+        stub.__enter__()
+        self.addCleanup(stub.__exit__, None, None, None)
+        return stub
+
+    def temporary_dir(self) -> str:
+        """
+        Returns the path of a directory removed at the end of the test.
+        """
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return directory.name
+
+    def set_env(self, **variables) -> None:
+        """
+        Sets environment variables, e.g. CACHE_DIR, and reloads the configuration from them until the end of the test.
+        """
+        saved = {name: os.environ.get(name) for name in variables}
+        self.addCleanup(self._restore_env, saved)
+        os.environ.update(variables)
+        config.reload()
+
+    def set_config(self, **fields) -> None:
+        """
+        Sets configuration fields until the end of the test.
+        """
+        for name, value in fields.items():
+            self.addCleanup(setattr, config, name, getattr(config, name))
+            setattr(config, name, value)
+
+    def reset_modules(self, *modules) -> None:
+        """
+        Resets the state of modules (e.g. the response cache of transport) now and at the end of the test.
+        """
+        for module in modules:
+            module.reset()
+            self.addCleanup(module.reset)
+
+    @staticmethod
+    def _restore_env(saved: {}) -> None:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        config.reload()
@@ -0,0 +1,73 @@
+import io
+import os
+import unittest
+
+from benchmarks.synthetic import SyntheticStudy
+from geo_to_hca import index as index_cli
+from geo_to_hca.utils import accession_index, sra_utils
+from tests.stub_test_case import StubTestCase
+
+
+def write_sra_accessions(path, study):
+    with open(path, 'w') as dump_file:
+        dump_file.write('Accession\tSubmission\tStatus\tType\tAlias\tExperiment\tSample\tStudy\tBioSample\tBioProject\n')
+        dump_file.write(f'{study.srp_accession}\tSRA900001\tlive\tSTUDY\t{study.geo_accession}\t-\t-\t-\t-\t'
+                        f'{study.bioproject_accession}\n')
+        for i in range(study.n_runs):
+            e = study.experiment_index(i)
+            dump_file.write(f'{study.run_accession(i)}\tSRA900001\tlive\tRUN\t-\t{study.experiment_accession(e)}\t'
+                            f'{study.sample_accession(e)}\t{study.srp_accession}\t{study.biosample_accession(e)}\t'
+                            f'{study.bioproject_accession}\n')
+
+
+def write_ena_read_run(path, study):
+    with open(path, 'w') as dump_file:
+        dump_file.write('run_accession\texperiment_accession\tstudy_accession\tsecondary_study_accession\t'
+                        'study_alias\tsample_accession\tsecondary_sample_accession\ttax_id\tscientific_name\t'
+                        'sample_alias\n')
+        for i in range(study.n_runs):
+            e = study.experiment_index(i)
+            dump_file.write(f'{study.run_accession(i)}\t{study.experiment_accession(e)}\t'
+                            f'{study.bioproject_accession}\t{study.srp_accession}\t{study.geo_accession}\t'
+                            f'{study.biosample_accession(e)}\t{study.sample_accession(e)}\t9606\tHomo sapiens\t'
+                            f'{study.sample_name(e)}\n')
+
+
+class AccessionIndexTest(StubTestCase):
+
+    def setUp(self):
+        self.study = SyntheticStudy(12)
+        self.stub = self.start_stub([self.study])
+        self.tmp_dir = self.temporary_dir()
+        self.set_env(ACCESSION_INDEX=os.path.join(self.tmp_dir, 'index.sqlite'))
+        self.sra_accessions = os.path.join(self.tmp_dir, 'SRA_Accessions.tab')
+        write_sra_accessions(self.sra_accessions, self.study)
+        self.read_run = os.path.join(self.tmp_dir, 'read_run.tsv')
+        write_ena_read_run(self.read_run, self.study)
+
+    def test_geo_series_resolved_without_ncbi(self):
+        self.assertIsNone(accession_index.index())
+        index_cli.import_files([self.sra_accessions])
+        self.assertEqual(sra_utils.get_srp_accession_from_geo(self.study.geo_accession), self.study.srp_accession)
+        self.assertEqual(self.stub.request_counts['esearch.fcgi'], 0)
+
+        out = io.StringIO()
+        studies = index_cli.lookup([self.study.geo_accession, 'GSE1'], out=out)
+        self.assertEqual(studies, {self.study.geo_accession: [self.study.srp_accession], 'GSE1': []})
+        self.assertEqual(out.getvalue(), f'{self.study.geo_accession}\t{self.study.srp_accession}\nGSE1\t\n')
+
+    def test_runs_read_from_the_index_once_complete(self):
+        expected = sra_utils.get_runs(sra_utils.get_srp_metadata(self.study.srp_accession))
+        index_cli.import_files([self.sra_accessions])
+        # SRA_Accessions.tab has no taxon or sample name
+        self.assertIsNone(accession_index.index().get_runs(self.study.srp_accession))
+
+        stats = index_cli.import_files([self.read_run])
+        self.assertEqual(stats, {'studies': 1, 'experiments': 0, 'runs': self.study.n_runs})
+        requests = sum(self.stub.request_counts.values())
+        self.assertEqual(sra_utils.get_study_runs(self.study.srp_accession), expected)
+        self.assertEqual(sum(self.stub.request_counts.values()), requests)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+
+from benchmarks.stub_server import StubServer
+from benchmarks.synthetic import SyntheticStudy
+from geo_to_hca import bundles, config, geo_to_hca
+from geo_to_hca.utils import handle_errors, transport
+from tests.test_large_study import read_rows
+
+TEMPLATE_DIR = os.path.dirname(geo_to_hca.DEFAULT_HCA_TEMPLATE)
+
+
+class BundlesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.studies = [SyntheticStudy(8, study_number=1), SyntheticStudy(6, study_number=2, ena_mirrored=False)]
+        self.accessions = [study.geo_accession for study in self.studies]
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.work_dir.cleanup)
+        self.bundle_dir = os.path.join(self.work_dir.name, 'bundles')
+        self.online_dir = os.path.join(self.work_dir.name, 'online')
+        self.offline_dir = os.path.join(self.work_dir.name, 'offline')
+        os.makedirs(self.online_dir)
+        os.makedirs(self.offline_dir)
+
+    def test_bundles_render_offline_like_online(self):
+        with StubServer(self.studies):
+            geo_to_hca.create_spreadsheet_using_accessions(self.accessions, self.online_dir, output_log=False)
+            bundles.fetch_bundles(self.accessions, self.bundle_dir)
+        # the stub server is gone: rendering must not send any request
+        bundle_paths = bundles.find_bundles(self.bundle_dir)
+        self.assertEqual([os.path.basename(path) for path in bundle_paths], sorted(self.accessions))
+        bundles.render_bundles(bundle_paths, self.offline_dir, processes=1)
+        # nothing was written to the bundles
+        for path in bundle_paths:
+            self.assertEqual(sorted(os.listdir(path)), [bundles.BUNDLE_FILE_NAME, 'metadata.sqlite'])
+        for accession in self.accessions:
+            self.assertEqual(read_rows(os.path.join(self.offline_dir, f'{accession}.xlsx')),
+                             read_rows(os.path.join(self.online_dir, f'{accession}.xlsx')))
+
+    def test_templates_rendered_from_one_fetch(self):
+        templates = [os.path.join(TEMPLATE_DIR, name) for name in
+                     ('hca_template.xlsx', 'hca_gut_template.xlsx', 'hca_lung_template.xlsx')]
+        studies = [SyntheticStudy(6, study_number=3), SyntheticStudy(6, study_number=4)]
+        requests = []
+        with StubServer(studies) as stub:
+            # each study is converted against a different number of templates
+            for study, study_templates in zip(studies, (templates[:1], templates)):
+                before = sum(stub.request_counts.values())
+                geo_to_hca.create_spreadsheet_using_accessions([study.geo_accession], self.online_dir,
+                                                               hca_template=study_templates, output_log=False)
+                requests.append(sum(stub.request_counts.values()) - before)
+            geo_to_hca.create_spreadsheet_using_accessions([studies[1].geo_accession], self.offline_dir,
+                                                           hca_template=templates[1], output_log=False)
+        self.assertEqual(requests[1], requests[0])
+        accession = studies[1].geo_accession
+        self.assertEqual(sorted(os.listdir(self.online_dir)),
+                         sorted([f'{studies[0].geo_accession}.xlsx'] +
+                                [f'{accession}_{geo_to_hca.template_name(template)}.xlsx' for template in templates]))
+        self.assertEqual(read_rows(os.path.join(self.online_dir, f'{accession}_hca_gut_template.xlsx')),
+                         read_rows(os.path.join(self.offline_dir, f'{accession}.xlsx')))
+
+    def test_templates_with_the_same_name(self):
+        with self.assertRaises(ValueError):
+            geo_to_hca.template_list([os.path.join('a', 'hca_template.xlsx'), os.path.join('b', 'hca_template.xlsx')])
+
+    def test_offline_restores_the_configuration(self):
+        cache_dir, offline = config.CACHE_DIR, config.OFFLINE
+        with bundles.offline(self.bundle_dir):
+            self.assertTrue(config.OFFLINE)
+            self.assertEqual(config.CACHE_DIR, self.bundle_dir)
+            with self.assertRaises(handle_errors.OfflineError):
+                transport.send('get', 'http://localhost:1/missing')
+        self.assertEqual((config.CACHE_DIR, config.OFFLINE), (cache_dir, offline))
+
+    def test_missing_bundle(self):
+        os.makedirs(self.bundle_dir)
+        with self.assertRaises(FileNotFoundError):
+            bundles.find_bundles(self.bundle_dir, ['GSE999999999'])
+
+
+if __name__ == '__main__':
+    unittest.main()
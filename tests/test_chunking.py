@@ -0,0 +1,46 @@
+import unittest
+
+from benchmarks.synthetic import SyntheticStudy
+from geo_to_hca.utils import chunking, transport, utils
+from geo_to_hca.utils.chunking import AdaptiveChunker
+from tests.stub_test_case import StubTestCase
+
+
+class AdaptiveChunkerTest(unittest.TestCase):
+
+    def test_chunks_grow_while_responses_are_fast_and_small(self):
+        chunker = AdaptiveChunker('test', min_size=10, max_size=500, target_seconds=2.0, target_bytes=2 ** 20)
+        sizes = []
+        for chunk in chunker.chunks(list(range(1000))):
+            sizes.append(len(chunk))
+            chunker.record(len(chunk), n_bytes=100 * len(chunk), seconds=0.1)
+        self.assertEqual(sizes, [100, 200, 400, 300])
+
+    def test_chunks_shrink_to_the_target_bytes_and_seconds(self):
+        chunker = AdaptiveChunker('test', min_size=10, max_size=500, target_seconds=2.0, target_bytes=2 ** 20)
+        chunker.record(100, n_bytes=100 * 2 ** 15, seconds=1.0)
+        self.assertEqual(chunker.size, 32)
+        chunker = AdaptiveChunker('test', min_size=10, max_size=500, target_seconds=2.0, target_bytes=2 ** 20)
+        chunker.record(100, n_bytes=1000, seconds=100.0)
+        self.assertEqual(chunker.size, 10)
+
+
+class EfetchChunksTest(StubTestCase):
+
+    def setUp(self):
+        self.study = SyntheticStudy(1000)
+        self.stub = self.start_stub([self.study])
+        self.set_config(EFETCH_POST_MIN_LENGTH=100)
+        self.reset_modules(chunking, transport)
+
+    def test_biosamples_fetched_in_adaptive_chunks_with_post(self):
+        accessions = [self.study.biosample_accession(e) for e in range(self.study.n_experiments)]
+        biosamples = utils.request_experimental_metadata(accessions, accession_type='biosample')
+        self.assertEqual([biosample.accession for biosample in biosamples], accessions)
+        # 100, 200 and 200 ids rather than five chunks of 100
+        self.assertEqual(self.stub.request_counts['fcgi'], 3)
+        self.assertEqual(chunking.stats()['biosample']['requests'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
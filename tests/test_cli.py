@@ -0,0 +1,61 @@
+import argparse
+import os
+import tempfile
+import unittest
+
+from benchmarks import startup
+from geo_to_hca import cli
+
+
+class StartupTest(unittest.TestCase):
+
+    def test_help_does_not_import_heavy_modules(self):
+        _, imported = startup.time_help()
+        self.assertEqual(imported, [])
+
+
+class CheckFileTest(unittest.TestCase):
+
+    def write_input_file(self, content):
+        input_file = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False)
+        input_file.write(content)
+        input_file.close()
+        self.addCleanup(os.remove, input_file.name)
+        return input_file.name
+
+    def test_accession_column(self):
+        path = self.write_input_file('accession\tnote\nGSE132509\tfirst\nSRP123456\t\n')
+        self.assertEqual(cli.check_file(path), ['GSE132509', 'SRP123456'])
+
+    def test_missing_accession_column(self):
+        path = self.write_input_file('geo\nGSE132509\n')
+        with self.assertRaises(argparse.ArgumentTypeError):
+            cli.check_file(path)
+
+    def test_missing_file(self):
+        with self.assertRaises(argparse.ArgumentTypeError):
+            cli.check_file('does/not/exist.txt')
+
+
+class ParserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = cli.build_parser()
+
+    def test_options_before_the_subcommand_are_kept(self):
+        args = self.parser.parse_args(['--accession', 'GSE1', '--recheck_negative', 'fetch'])
+        self.assertEqual((args.command, args.accession, args.recheck_negative, args.bundle_dir),
+                         ('fetch', 'GSE1', True, 'bundles/'))
+        args = self.parser.parse_args(['--output_dir', 'o/', '--output_log', 'false', 'render'])
+        self.assertEqual((args.command, args.output_dir, args.output_log), ('render', 'o/', False))
+
+    def test_options_after_the_subcommand(self):
+        args = self.parser.parse_args(['--output_dir', 'o/', 'render', '--output_dir', 'p/', '--accession', 'GSE2'])
+        self.assertEqual((args.output_dir, args.accession), ('p/', 'GSE2'))
+        args = self.parser.parse_args(['render'])
+        self.assertEqual((args.output_dir, args.template, args.output_log, args.accession, args.processes),
+                         ('spreadsheets/', [cli.DEFAULT_HCA_TEMPLATE], True, None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+from benchmarks.synthetic import SyntheticStudy
+from geo_to_hca.utils import europepmc_client, get_attribs
+from tests.stub_test_case import StubTestCase
+
+
+class EuropePMCClientTest(StubTestCase):
+
+    def setUp(self):
+        self.study = SyntheticStudy(1)
+        self.stub = self.start_stub([self.study])
+        self.set_env(CACHE_DIR=self.temporary_dir())
+        self.reset_modules(europepmc_client)
+
+    def test_normalized_queries_are_searched_once(self):
+        results = europepmc_client.search(self.study.project_title)
+        self.assertEqual(results[0]['pmid'], self.study.pubmed_id)
+        self.assertEqual(europepmc_client.search(f'  {self.study.project_title.upper()}. '), results)
+        self.assertEqual(self.stub.request_counts['search'], 1)
+        self.assertEqual(europepmc_client.search(''), [])
+        self.assertEqual(europepmc_client.stats()['memo_hits'], 1)
+
+    def test_searches_are_reused_across_runs(self):
+        europepmc_client.search(self.study.project_title)
+        europepmc_client.reset()
+        self.assertEqual(europepmc_client.search(self.study.project_title)[0]['pmid'], self.study.pubmed_id)
+        self.assertEqual(self.stub.request_counts['search'], 1)
+        self.assertEqual(europepmc_client.stats()['cache_hits'], 1)
+
+    def test_searches_without_results_are_known_failures(self):
+        self.assertEqual(europepmc_client.search('an unpublished project'), [])
+        europepmc_client.reset()
+        self.assertEqual(europepmc_client.search('an unpublished project'), [])
+        self.assertEqual(self.stub.request_counts['search'], 1)
+        self.assertEqual(europepmc_client.stats()['cache_hits'], 0)
+
+        self.set_config(RECHECK_NEGATIVE=True)
+        europepmc_client.reset()
+        self.assertEqual(europepmc_client.search('an unpublished project'), [])
+        self.assertEqual(self.stub.request_counts['search'], 2)
+
+    def test_publication_found_from_project_title(self):
+        pubmed_id = get_attribs.search_europepmc_for_publication(self.study.project_title, key='project_title')
+        self.assertEqual(pubmed_id, self.study.pubmed_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+
+from benchmarks.synthetic import SyntheticStudy
+from geo_to_hca import config
+from geo_to_hca.utils import geo_family, sra_utils, transport
+from tests.stub_test_case import StubTestCase
+
+
+class GeoFamilyTest(StubTestCase):
+
+    def setUp(self):
+        # a series linked to its SRA study only through its samples
+        self.study = SyntheticStudy(12, sra_linked=False)
+        self.stub = self.start_stub([self.study])
+        self.set_config(GEO_SAMPLE_SOURCE=config.GEO_SAMPLE_SOURCE)
+        self.addCleanup(transport.reset)
+
+    def test_samples_read_from_the_family_file(self):
+        samples = geo_family.request_family_samples(self.study.geo_accession)
+        self.assertEqual([sample.accession for sample in samples],
+                         [self.study.sample_name(e) for e in range(self.study.n_experiments)])
+        sample = samples[3]
+        self.assertEqual(sample.title, 'synthetic sample 3')
+        self.assertEqual(sample.experiment, self.study.experiment_accession(3))
+        self.assertEqual(sample.biosample, self.study.biosample_accession(3))
+        self.assertEqual(sample.characteristics, [('tissue', 'lung'), ('donor', 'D3')])
+
+    def test_study_resolved_from_the_samples_of_the_family_file(self):
+        request_counts = {}
+        for source in ('esummary', 'family'):
+            config.GEO_SAMPLE_SOURCE = source
+            # the eutils responses of the first resolution would be reused
+            transport.reset()
+            before = self.stub.request_counts.copy()
+            self.assertEqual(sra_utils.request_srp_accessions_from_geo(self.study.geo_accession),
+                             [self.study.srp_accession])
+            request_counts[source] = self.stub.request_counts - before
+        family_file = f'{self.study.geo_accession}_family.soft.gz'
+        self.assertEqual(request_counts['family'][family_file], 1)
+        self.assertEqual(request_counts['esummary'][family_file], 0)
+        # no esearch and esummary of a sample
+        self.assertEqual(request_counts['family']['esummary.fcgi'], request_counts['esummary']['esummary.fcgi'] - 1)
+        self.assertEqual(request_counts['family']['esearch.fcgi'], request_counts['esummary']['esearch.fcgi'] - 1)
+
+    def test_tables_are_skipped(self):
+        lines = ['^SAMPLE = GSM1', '!Sample_title = first', '!sample_table_begin', 'ID_REF\tVALUE',
+                 '!Sample_title = not a title', '!sample_table_end',
+                 '!Sample_relation = SRA: https://www.ncbi.nlm.nih.gov/sra?term=SRX1',
+                 '^SAMPLE = GSM2', '!Sample_characteristics_ch1 = untagged']
+        samples = geo_family.parse_family_soft(line + '\n' for line in lines)
+        self.assertEqual([(sample.accession, sample.title, sample.experiment, sample.characteristics)
+                          for sample in samples],
+                         [('GSM1', 'first', 'SRX1', []), ('GSM2', '', None, [('', 'untagged')])])
+
+
+if __name__ == '__main__':
+    unittest.main()
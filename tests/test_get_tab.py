@@ -0,0 +1,59 @@
+import unittest
+
+from geo_to_hca.utils import get_tab
+from geo_to_hca.utils.records import BioSample, Experiment, FastqFile, Run
+
+
+def run(accession, experiment, biosample):
+    return Run(accession, experiment, 'SRP000001', 'PRJNA000001', f'SRS{biosample[4:]}', biosample, 9606,
+               'Homo sapiens', f'sample {biosample}')
+
+
+class GetTabTest(unittest.TestCase):
+    runs = [run('SRR1', 'SRX1', 'SAMN1'), run('SRR2', 'SRX1', 'SAMN1'), run('SRR3', 'SRX2', 'SAMN2')]
+
+    def test_index_runs_keeps_first_run(self):
+        runs_by_experiment = get_tab.index_runs(self.runs, 'experiment')
+        self.assertEqual(list(runs_by_experiment), ['SRX1', 'SRX2'])
+        self.assertEqual(runs_by_experiment['SRX1'].accession, 'SRR1')
+
+    def test_sequence_file_row(self):
+        fastq_file = FastqFile('SRR1', 'sample_S1_L001_R2_001.fastq.gz', 'read2', 'L001')
+        row = get_tab.sequence_file_row(self.runs[0], fastq_file)
+        self.assertEqual(row['sequence_file.file_core.file_name'], 'sample_S1_L001_R2_001.fastq.gz')
+        self.assertEqual(row['sequence_file.read_index'], 'read2')
+        self.assertEqual(row['sequence_file.lane_index'], 'L001')
+        self.assertEqual(row['cell_suspension.biomaterial_core.biomaterial_id'], 'SRX1')
+        row = get_tab.sequence_file_row(self.runs[0], None)
+        self.assertEqual(row['sequence_file.file_core.file_name'], '')
+
+    def test_specimen_from_organism_row(self):
+        biosample = BioSample('SAMN2', 'donor 2', ['lung', 'adult'])
+        row = get_tab.process_specimen_from_organism(biosample, get_tab.index_runs(self.runs, 'biosample')['SAMN2'])
+        self.assertEqual(row['specimen_from_organism.biomaterial_core.biomaterial_description'], 'lung,adult')
+        self.assertEqual(row['specimen_from_organism.biomaterial_core.insdc_sample_accession'], 'SRS2')
+        self.assertEqual(row['process.insdc_experiment.insdc_experiment_accession'], 'SRX2')
+
+    def test_protocols_are_shared_by_experiments(self):
+        library_protocols = get_tab.LibraryProtocols()
+        sequencing_protocols = get_tab.SequencingProtocols()
+        experiments = [Experiment('SRX1', "10X 3' v2", 'Illumina NovaSeq 6000'),
+                       Experiment('SRX2', 'Smart-seq2', 'Illumina HiSeq 2500'),
+                       Experiment('SRX3', "10X 3' v2", 'Illumina NovaSeq 6000')]
+        library_rows = [library_protocols.register(experiment) for experiment in experiments]
+        sequencing_rows = [sequencing_protocols.register(experiment) for experiment in experiments]
+        self.assertEqual([row is not None for row in library_rows], [True, True, False])
+        self.assertEqual([row is not None for row in sequencing_rows], [True, True, False])
+        self.assertEqual(get_tab.sequence_file_protocol_ids('SRX3', library_protocols.protocol_ids,
+                                                            sequencing_protocols.protocol_ids),
+                         ('library_protocol_1', 'sequencing_protocol_1'))
+        self.assertEqual(get_tab.sequence_file_protocol_ids('SRX2', library_protocols.protocol_ids,
+                                                            sequencing_protocols.protocol_ids),
+                         ('library_protocol_2', 'sequencing_protocol_2'))
+        self.assertEqual(get_tab.sequence_file_protocol_ids('SRX9', library_protocols.protocol_ids,
+                                                            sequencing_protocols.protocol_ids),
+                         ('', ''))
+
+
+if __name__ == '__main__':
+    unittest.main()
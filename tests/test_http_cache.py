@@ -0,0 +1,68 @@
+import os
+import time
+import unittest
+
+from benchmarks.synthetic import SyntheticStudy
+from geo_to_hca.utils import cache, parse_reads, transport
+from tests.stub_test_case import StubTestCase
+
+
+class HttpCacheTest(StubTestCase):
+
+    def setUp(self):
+        self.study = SyntheticStudy(500)
+        self.stub = self.start_stub([self.study])
+        self.set_env(CACHE_DIR=self.temporary_dir())
+        self.reset_modules(transport)
+
+    def fetch_twice(self, fresh_hours: float):
+        self.set_config(HTTP_CACHE_FRESH_HOURS=fresh_hours)
+        first = parse_reads.request_fastq_from_ENA(self.study.srp_accession)
+        bytes_sent = self.stub.bytes_sent
+        # a new run: nothing in the in-memory cache
+        transport.reset()
+        second = parse_reads.request_fastq_from_ENA(self.study.srp_accession)
+        self.assertEqual(second, first)
+        return self.stub.bytes_sent - bytes_sent
+
+    def test_fresh_responses_reused_without_request(self):
+        self.assertEqual(self.fetch_twice(24), 0)
+        self.assertEqual(self.stub.request_counts['filereport'], 1)
+        self.assertEqual(transport.stats()['http_cache']['fresh'], 1)
+
+    def test_stale_responses_revalidated(self):
+        self.assertEqual(self.fetch_twice(0), 0)
+        self.assertEqual(self.stub.request_counts['filereport'], 2)
+        self.assertEqual(self.stub.request_counts['not_modified'], 1)
+        self.assertEqual(transport.stats()['http_cache']['revalidated'], 1)
+
+
+class PruneTest(StubTestCase):
+
+    def setUp(self):
+        self.http_cache = cache.HttpCache(os.path.join(self.temporary_dir(), cache.HTTP_CACHE_FILE_NAME))
+        self.addCleanup(self.http_cache.close)
+
+    def test_old_and_oldest_responses_beyond_the_size_cap_are_removed(self):
+        for n in range(5):
+            self.http_cache.put(f'url{n}', {}, bytes(100))
+            # stored n hours ago
+            self.http_cache.execute('UPDATE responses SET stored = ? WHERE key = ?',
+                                    (time.time() - n * 3600, f'url{n}'))
+        self.assertEqual(self.http_cache.prune(max_age=3.5 * 3600, max_bytes=250), 3)
+        self.assertEqual([key for key, in self.http_cache.query('SELECT key FROM responses ORDER BY key')],
+                         ['url0', 'url1'])
+
+    def test_expired_lookups_are_removed(self):
+        persistent_cache = cache.PersistentCache(os.path.join(self.temporary_dir(), cache.CACHE_FILE_NAME))
+        self.addCleanup(persistent_cache.close)
+        persistent_cache.put('namespace', 'old', 'value')
+        persistent_cache.execute('UPDATE entries SET stored = ?', (time.time() - 3600,))
+        persistent_cache.put('namespace', 'new', 'value')
+        self.assertEqual(persistent_cache.prune(max_age=60), 1)
+        self.assertIsNone(persistent_cache.get('namespace', 'old'))
+        self.assertEqual(persistent_cache.get('namespace', 'new'), 'value')
+
+
+if __name__ == '__main__':
+    unittest.main()
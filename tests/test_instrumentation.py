@@ -0,0 +1,23 @@
+import unittest
+
+from geo_to_hca.utils import instrumentation
+
+
+class StageRecorderTest(unittest.TestCase):
+
+    def test_nested_stage_keeps_the_peak_of_the_enclosing_stage(self):
+        recorder = instrumentation.StageRecorder(trace_memory=True)
+        with instrumentation.recording(recorder):
+            with instrumentation.stage('outer'):
+                buffer = bytearray(8 * 2 ** 20)
+                del buffer
+                with instrumentation.stage('inner'):
+                    small = bytearray(2 ** 20)
+                    del small
+        stages = recorder.as_dict()
+        self.assertGreaterEqual(stages['outer']['peak_traced_mb'], 8)
+        self.assertLess(stages['inner']['peak_traced_mb'], 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
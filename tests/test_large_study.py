@@ -0,0 +1,123 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from openpyxl import load_workbook
+
+from benchmarks.stub_server import StubServer
+from benchmarks.synthetic import SyntheticStudy
+from geo_to_hca import geo_to_hca
+from geo_to_hca import large_study
+from geo_to_hca.utils import instrumentation
+from geo_to_hca.utils import sra_utils
+
+
+def read_rows(path):
+    """
+    Reads the metadata rows of every tab, without trailing empty cells.
+    """
+    workbook = load_workbook(path, read_only=True)
+    rows = {}
+    for sheet in workbook.worksheets:
+        rows[sheet.title] = []
+        for row in sheet.iter_rows(min_row=6, values_only=True):
+            row = list(row)
+            while row and row[-1] is None:
+                row.pop()
+            if row:
+                rows[sheet.title].append(tuple(row))
+    workbook.close()
+    return rows
+
+
+class LargeStudyTest(unittest.TestCase):
+
+    def test_chunked_output_matches_in_memory_output(self):
+        study = SyntheticStudy(30)
+        with StubServer([study]), tempfile.TemporaryDirectory() as output_dir:
+            workbook = geo_to_hca.create_spreadsheet_using_accession(study.geo_accession)
+            in_memory_file = os.path.join(output_dir, 'in_memory.xlsx')
+            workbook.save(in_memory_file)
+            chunked_dir = os.path.join(output_dir, 'chunked')
+            os.mkdir(chunked_dir)
+            chunked_file = large_study.create_spreadsheet_in_chunks(study.geo_accession, chunked_dir, chunk_size=7)
+
+            expected = read_rows(in_memory_file)
+            actual = read_rows(chunked_file)
+        for tab, rows in expected.items():
+            with self.subTest(tab=tab):
+                self.assertCountEqual(rows, actual[tab])
+
+    def test_one_pool_for_every_chunk(self):
+        study = SyntheticStudy(30)
+        with StubServer([study]), tempfile.TemporaryDirectory() as output_dir:
+            serial_file = large_study.create_spreadsheet_in_chunks(study.geo_accession, output_dir, chunk_size=7)
+            expected = read_rows(serial_file)
+            parallel_dir = os.path.join(output_dir, 'parallel')
+            os.mkdir(parallel_dir)
+            with mock.patch.object(large_study.multiprocessing, 'Pool',
+                                   wraps=large_study.multiprocessing.Pool) as pool:
+                parallel_file = large_study.create_spreadsheet_in_chunks(study.geo_accession, parallel_dir,
+                                                                         nthreads=2, chunk_size=7)
+            actual = read_rows(parallel_file)
+        self.assertEqual(pool.call_count, 1)
+        self.assertEqual(expected['Specimen from organism'], actual['Specimen from organism'])
+
+    def test_chunked_output_has_every_run(self):
+        study = SyntheticStudy(2_000)
+        with StubServer([study]), tempfile.TemporaryDirectory() as output_dir:
+            out_file = large_study.create_spreadsheet_in_chunks(study.geo_accession, output_dir, chunk_size=300)
+            rows = read_rows(out_file)
+        self.assertEqual(len(rows['Sequence file']), 3 * study.n_runs)
+        self.assertEqual(len(rows['Cell suspension']), study.n_experiments)
+        self.assertEqual(len(rows['Specimen from organism']), study.n_experiments)
+        self.assertEqual(len(rows['Library preparation protocol']), 1)
+        self.assertEqual(len(rows['Project']), 1)
+
+    def test_runs_chunked_within_memory_budget(self):
+        # a scaled down version of test_100k_runs_within_memory_budget: chunks of 128 runs, halved down to 100 runs
+        # as the rss of the test process is over the budget
+        memory_budget_mb = 32
+        study = SyntheticStudy(2_000)
+        recorder = instrumentation.StageRecorder(trace_memory=True)
+        with StubServer([study]), tempfile.TemporaryDirectory() as output_dir, instrumentation.recording(recorder):
+            large_study.create_spreadsheet_in_chunks(study.geo_accession, output_dir,
+                                                     memory_budget_mb=memory_budget_mb)
+        stages = recorder.as_dict()
+        self.assertGreaterEqual(stages['integrate_metadata']['calls'],
+                                -(-study.n_runs // large_study.chunk_size_for_budget(memory_budget_mb)))
+        peak_traced_mb = max(stage['peak_traced_mb'] for stage in stages.values())
+        self.assertLess(peak_traced_mb, memory_budget_mb / 2)
+
+    @unittest.skipUnless(os.environ.get('GEO_TO_HCA_LARGE_TESTS'), 'set GEO_TO_HCA_LARGE_TESTS=1 to run')
+    def test_100k_runs_within_memory_budget(self):
+        memory_budget_mb = 1024
+        study = SyntheticStudy(100_000)
+        with StubServer([study]), tempfile.TemporaryDirectory() as output_dir:
+            out_file = large_study.create_spreadsheet_in_chunks(study.geo_accession, output_dir,
+                                                               memory_budget_mb=memory_budget_mb)
+            workbook = load_workbook(out_file, read_only=True)
+            sequence_file_rows = sum(1 for _ in workbook['Sequence file'].iter_rows(min_row=6, values_only=True))
+            workbook.close()
+        self.assertEqual(sequence_file_rows, 3 * study.n_runs)
+        self.assertLess(instrumentation.peak_rss_mb(), memory_budget_mb)
+
+
+class RunInfoTest(unittest.TestCase):
+
+    def test_only_the_used_columns_are_read(self):
+        study = SyntheticStudy(25)
+        with StubServer([study]):
+            srp_metadata = sra_utils.get_srp_metadata(study.srp_accession)
+            chunks = list(sra_utils.iter_srp_metadata(study.srp_accession, chunksize=10))
+        self.assertEqual(sorted(srp_metadata.columns), sorted(sra_utils.RUNINFO_COLUMNS))
+        for column, dtype in srp_metadata.dtypes.items():
+            self.assertEqual(dtype.kind, 'i' if column == 'TaxID' else 'O')
+        runs = sra_utils.get_runs(srp_metadata)
+        self.assertEqual([run for chunk in chunks for run in sra_utils.get_runs(chunk)], runs)
+        self.assertEqual(runs[3].taxon_id, 9606)
+
+
+if __name__ == '__main__':
+    unittest.main()
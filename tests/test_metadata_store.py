@@ -0,0 +1,42 @@
+import os
+import unittest
+
+from benchmarks.synthetic import SyntheticStudy
+from geo_to_hca import geo_to_hca
+from geo_to_hca.utils import europepmc_client, metadata_store, sra_utils
+from tests.stub_test_case import StubTestCase
+from tests.test_large_study import read_rows
+
+
+class MetadataStoreTest(StubTestCase):
+
+    def setUp(self):
+        self.study = SyntheticStudy(12)
+        self.stub = self.start_stub([self.study])
+        self.cache_dir = self.temporary_dir()
+        self.set_env(CACHE_DIR=self.cache_dir, METADATA_STORE='true')
+        self.reset_modules(europepmc_client)
+
+    def test_second_run_reads_the_metadata_from_the_store(self):
+        first_file = os.path.join(self.cache_dir, 'first.xlsx')
+        geo_to_hca.create_spreadsheet_using_accession(self.study.geo_accession).save(first_file)
+        efetch_requests = self.stub.request_counts['fcgi']
+
+        second_file = os.path.join(self.cache_dir, 'second.xlsx')
+        geo_to_hca.create_spreadsheet_using_accession(self.study.geo_accession).save(second_file)
+
+        self.assertEqual(self.stub.request_counts['fcgi'], efetch_requests)
+        self.assertEqual(read_rows(second_file), read_rows(first_file))
+
+    def test_studies_sharing_a_biosample(self):
+        runs = sra_utils.get_study_runs(self.study.srp_accession)
+        self.assertEqual([run.accession for run in sra_utils.get_study_runs(self.study.srp_accession)],
+                         [run.accession for run in runs])
+        store = metadata_store.store()
+        self.assertEqual(store.studies_with_biosample(runs[0].biosample), [runs[0].study])
+        self.assertEqual(store.studies_with_biosample('SAMN_UNKNOWN'), [])
+        self.assertEqual(store.stats()['hits'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
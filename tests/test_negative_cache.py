@@ -0,0 +1,69 @@
+import unittest
+import xml.etree.ElementTree as xm
+from unittest.mock import patch
+
+from benchmarks.synthetic import SyntheticStudy
+from geo_to_hca import config
+from geo_to_hca.utils import entrez_client, negative_cache, sra_utils, transport, utils
+from geo_to_hca.utils.handle_errors import TermNotFound
+from tests.stub_test_case import StubTestCase
+
+
+class NegativeCacheTest(StubTestCase):
+
+    def setUp(self):
+        self.study = SyntheticStudy(4)
+        self.stub = self.start_stub([self.study])
+        self.set_env(CACHE_DIR=self.temporary_dir())
+        # every lookup reaches the stub unless it is a known failure
+        self.reset_modules(transport)
+
+    def requests(self):
+        return sum(self.stub.request_counts.values())
+
+    def test_geo_accession_without_sra_study_fails_immediately(self):
+        with self.assertRaisesRegex(Exception, 'Could not find'):
+            sra_utils.get_srp_accessions_from_geo('GSE1')
+        requests = self.requests()
+        transport.reset()
+        with self.assertRaisesRegex(Exception, 'Could not find'):
+            sra_utils.get_srp_accessions_from_geo('GSE1')
+        self.assertEqual(self.requests(), requests)
+
+        self.addCleanup(setattr, config, 'RECHECK_NEGATIVE', False)
+        config.RECHECK_NEGATIVE = True
+        with self.assertRaisesRegex(Exception, 'Could not find'):
+            sra_utils.get_srp_accessions_from_geo('GSE1')
+        self.assertGreater(self.requests(), requests)
+
+    def test_term_not_found_fails_immediately(self):
+        with self.assertRaises(TermNotFound):
+            entrez_client.get_entrez_esearch('SRP1')
+        requests = self.requests()
+        with self.assertRaises(TermNotFound) as raised:
+            entrez_client.get_entrez_esearch('SRP1')
+        self.assertEqual(raised.exception.error_key, 'phrasesnotfound')
+        self.assertEqual(self.requests(), requests)
+        # other terms are still looked up
+        self.assertIn('webenv', entrez_client.get_entrez_esearch(self.study.srp_accession))
+
+    def test_pubmed_id_without_article_not_requested_again(self):
+        self.assertEqual(utils.get_pubmed_metadata_batch(['1', self.study.pubmed_id]).keys(), {self.study.pubmed_id})
+        requests = self.requests()
+        transport.reset()
+        self.assertEqual(utils.get_pubmed_metadata('1', iteration=1).title, '')
+        self.assertEqual(self.requests(), requests)
+
+    def test_pubmed_book_is_not_a_failure(self):
+        book = xm.fromstring('<PubmedArticleSet><PubmedBookArticle><BookDocument><PMID Version="1">2</PMID>'
+                             '</BookDocument></PubmedBookArticle></PubmedArticleSet>')
+        with patch.object(entrez_client, 'request_pubmed_metadata', return_value=book):
+            utils.get_pubmed_metadata('2', iteration=1)
+        self.assertIsNone(negative_cache.known_failure(negative_cache.PUBMED_ID_NOT_FOUND, '2'))
+        # an empty PubmedArticleSet is
+        utils.get_pubmed_metadata('1', iteration=1)
+        self.assertIsNotNone(negative_cache.known_failure(negative_cache.PUBMED_ID_NOT_FOUND, '1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
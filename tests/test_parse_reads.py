@@ -0,0 +1,146 @@
+import csv
+import os
+import time
+import unittest
+
+from benchmarks.stub_server import StubServer
+from benchmarks.synthetic import SyntheticStudy
+from geo_to_hca import geo_to_hca
+from geo_to_hca.utils import fastq_names
+from geo_to_hca.utils import instrumentation
+from geo_to_hca.utils import parse_reads
+from tests.stub_test_case import StubTestCase
+
+FASTQ_NAMES = os.path.join(os.path.dirname(__file__), 'data', 'fastq_names.tsv')
+
+
+class SRAFastqFallbackTest(StubTestCase):
+
+    def setUp(self):
+        self.study = SyntheticStudy(450)
+        self.stub = self.start_stub([self.study])
+        self.set_env(SRA_RUN_CHUNK_SIZE='100')
+
+    def test_runs_of_all_chunks_and_packages_are_merged(self):
+        fastq_map = parse_reads.get_fastq_from_SRA(self.study.run_accessions())
+        self.assertEqual(self.stub.request_counts['esearch.fcgi'], 5)
+        self.assertEqual(list(fastq_map), self.study.run_accessions())
+        run = self.study.run_accession(7)
+        self.assertEqual([fastq_file.name for fastq_file in fastq_map[run]], self.study.fastq_names(7)[1:])
+        self.assertEqual([fastq_file.read_index for fastq_file in fastq_map[run]], ['read1', 'read2'])
+
+    def test_no_runs(self):
+        self.assertIsNone(parse_reads.get_fastq_from_SRA([]))
+
+
+class FetchFastqNamesTest(unittest.TestCase):
+
+    def fetch_fastq_names(self, study):
+        recorder = instrumentation.StageRecorder()
+        with StubServer([study]) as stub, instrumentation.recording(recorder):
+            fastq_map = geo_to_hca.fetch_fastq_names(study.srp_accession, study.run_accessions())
+            return fastq_map, recorder.attributes['fastq_source'], stub.request_counts
+
+    def test_ena_file_names_are_preferred(self):
+        study = SyntheticStudy(40)
+        fastq_map, fastq_source, request_counts = self.fetch_fastq_names(study)
+        self.assertEqual(fastq_source, 'ENA')
+        self.assertEqual(request_counts['esearch.fcgi'], 0)
+        self.assertEqual([fastq_file.name for fastq_file in fastq_map[study.run_accession(3)]], study.fastq_names(3))
+
+    def test_sra_is_queried_while_waiting_for_ena(self):
+        # 4 chunks of rate limited esearch and efetch calls take over 2 seconds, about as long as ENA takes to answer
+        for name, value in (('SRA_RUN_CHUNK_SIZE', '10'), ('ENA_HEAD_START_SECONDS', '0.5')):
+            self.addCleanup(os.environ.pop, name, None)
+            os.environ[name] = value
+        study = SyntheticStudy(40, ena_mirrored=False, ena_delay_seconds=2.5)
+        start = time.monotonic()
+        fastq_map, fastq_source, request_counts = self.fetch_fastq_names(study)
+        self.assertLess(time.monotonic() - start, 3.8)
+        self.assertEqual(fastq_source, 'SRA')
+        self.assertEqual(request_counts['filereport'], 1)
+        self.assertEqual(list(fastq_map), study.run_accessions())
+
+    def test_no_file_names(self):
+        study = SyntheticStudy(4, ena_mirrored=False)
+        with StubServer([study]):
+            fastq_map = geo_to_hca.fetch_fastq_names(study.srp_accession, [])
+        self.assertFalse(fastq_map)
+
+
+
+class ENAFileReportTest(unittest.TestCase):
+
+    def test_extra_fields_in_one_pass(self):
+        study = SyntheticStudy(30)
+        with StubServer([study]) as stub:
+            file_report = parse_reads.request_ena_file_report(
+                study.srp_accession, ('fastq_ftp', 'fastq_bytes', 'fastq_md5', 'read_count'))
+            fastq_map = parse_reads.request_fastq_from_ENA(study.srp_accession)
+            self.assertEqual(stub.request_counts['filereport'], 2)
+        self.assertEqual(list(file_report), study.run_accessions())
+        fastq_ftp, fastq_bytes, fastq_md5, read_count = file_report[study.run_accession(3)]
+        self.assertEqual([path.rpartition('/')[2] for path in fastq_ftp], study.fastq_names(3))
+        self.assertEqual(len(fastq_bytes), len(fastq_ftp))
+        self.assertTrue(all(isinstance(size, int) for size in fastq_bytes))
+        self.assertEqual(len(fastq_md5), len(fastq_ftp))
+        self.assertEqual(read_count, 250000000)
+        self.assertEqual([fastq_file.name for fastq_file in fastq_map[study.run_accession(3)]], study.fastq_names(3))
+
+    def test_missing_values(self):
+        lines = [b'run_accession\tfastq_ftp\tread_count\r', b'SRR1\t\t', b'SRR2\ta/SRR2_1.fastq.gz;a/SRR2_2.fastq.gz', b'']
+        self.assertEqual(parse_reads.parse_ena_file_report(lines, ('fastq_ftp', 'read_count')),
+                         {'SRR1': ((), None), 'SRR2': (('a/SRR2_1.fastq.gz', 'a/SRR2_2.fastq.gz'), None)})
+        with self.assertRaises(ValueError):
+            parse_reads.parse_ena_file_report(lines, ('fastq_md5',))
+
+
+class FastqNamesTest(unittest.TestCase):
+    """
+    The corpus holds 10x, Smart-seq and SRA style names with the read and lane indices parsed name by name.
+    """
+
+    def setUp(self):
+        fastq_names.reset()
+        self.addCleanup(fastq_names.reset)
+        with open(FASTQ_NAMES, newline='') as corpus:
+            self.corpus = list(csv.DictReader(corpus, delimiter='\t'))
+
+    def expected(self, rows):
+        return [(row['read_index'], row['lane_index']) for row in rows]
+
+    def test_column_of_names(self):
+        parsed = fastq_names.parse_file_names([row['run'] for row in self.corpus],
+                                              [row['file_name'] for row in self.corpus])
+        self.assertEqual(parsed, self.expected(self.corpus))
+
+    def test_names_are_parsed_once_per_scheme(self):
+        sra_rows = [row for row in self.corpus if row['scheme'] == 'sra' and row['run'] != 'SRR5555555']
+        fastq_names.parse_file_names([row['run'] for row in sra_rows], [row['file_name'] for row in sra_rows])
+        # the names of the 5 files of 4 runs and SRR5555556_R1.fastq.gz
+        self.assertEqual(fastq_names.stats()['schemes'], 6)
+        parsed = fastq_names.parse_file_names(['SRR0000042'] * 2, ['SRR0000042_1.fastq.gz', 'SRR0000042_R1.fastq.gz'])
+        self.assertEqual(parsed, [('read1', ''), ('read1', '')])
+        self.assertEqual(fastq_names.stats()['schemes'], 6)
+
+    def test_single_names(self):
+        for row in self.corpus:
+            self.assertEqual(parse_reads.get_file_index(row['file_name']), row['read_index'], row['file_name'])
+            lane_index = parse_reads.get_lane_index(row['file_name'])
+            self.assertEqual(lane_index.group().split('_')[1] if lane_index else '', row['lane_index'])
+
+    def test_fastq_files_by_run(self):
+        rows = [row for row in self.corpus if row['scheme'] == 'smart-seq']
+        file_names_by_run = {}
+        for row in rows:
+            file_names_by_run.setdefault(row['run'], []).append(row['file_name'])
+        fastq_map = parse_reads.fastq_files_by_run(file_names_by_run)
+        self.assertEqual(list(fastq_map), list(file_names_by_run))
+        self.assertEqual([(fastq_file.run, fastq_file.name, fastq_file.read_index, fastq_file.lane_index)
+                          for fastq_files in fastq_map.values() for fastq_file in fastq_files],
+                         [(row['run'], row['file_name'], row['read_index'], row['lane_index']) for row in rows])
+        self.assertEqual(parse_reads.fastq_files('SRR1', []), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import unittest
+
+from openpyxl import load_workbook
+
+from benchmarks.synthetic import SyntheticStudy
+from geo_to_hca import pubmed_id_to_hca_publication
+from geo_to_hca.cli import DEFAULT_HCA_TEMPLATE
+from geo_to_hca.utils import entrez_client, run_report, transport
+from tests.stub_test_case import StubTestCase
+
+
+def filled_rows(worksheet):
+    return [row for row in worksheet.iter_rows(min_row=6, values_only=True) if any(row)]
+
+
+class PubmedBatchTest(StubTestCase):
+
+    def setUp(self):
+        self.studies = [SyntheticStudy(1, study_number=n) for n in range(1, entrez_client.PUBMED_BATCH_SIZE + 11)]
+        self.stub = self.start_stub(self.studies)
+        self.reset_modules(transport)
+        self.output_dir = self.temporary_dir()
+
+    def test_publications_are_fetched_in_batches(self):
+        pubmed_ids = [study.pubmed_id for study in self.studies] + ['1']
+        publications = pubmed_id_to_hca_publication.utils.get_pubmed_metadata_batch(pubmed_ids, nthreads=2)
+        self.assertEqual(self.stub.request_counts['fcgi'], 2)
+        self.assertEqual(list(publications), [study.pubmed_id for study in self.studies])
+        publication = publications[self.studies[3].pubmed_id]
+        self.assertEqual(publication.title, f'{self.studies[3].project_title}.')
+        self.assertEqual(len(publication.authors), 12)
+        self.assertEqual(publication.doi, f'10.9999/synthetic.{self.studies[3].pubmed_id}')
+
+    def test_one_workbook_per_pubmed_id(self):
+        pubmed_ids = [study.pubmed_id for study in self.studies[:3]]
+        out_files = pubmed_id_to_hca_publication.create_publication_spreadsheets(
+            pubmed_ids, self.output_dir, DEFAULT_HCA_TEMPLATE, nthreads=2)
+        self.assertEqual(sorted(os.path.basename(out_file) for out_file in out_files),
+                         sorted(f'{pubmed_id}.xlsx' for pubmed_id in pubmed_ids))
+        workbook = load_workbook(out_files[0], read_only=True)
+        self.assertEqual(len(filled_rows(workbook['Project - Publications'])), 1)
+        self.assertEqual(len(filled_rows(workbook['Project - Contributors'])), 12)
+        self.assertEqual(len(filled_rows(workbook['Project - Funders'])), 3)
+
+    def test_combined_workbook(self):
+        pubmed_ids = [study.pubmed_id for study in self.studies[:3]]
+        out_files = pubmed_id_to_hca_publication.create_publication_spreadsheets(
+            pubmed_ids, self.output_dir, DEFAULT_HCA_TEMPLATE, combined=True)
+        self.assertEqual(len(out_files), 1)
+        workbook = load_workbook(out_files[0], read_only=True)
+        self.assertEqual(len(filled_rows(workbook['Project - Publications'])), 3)
+        self.assertEqual(len(filled_rows(workbook['Project - Contributors'])), 36)
+
+    def test_outcome_of_each_pubmed_id_is_reported(self):
+        pubmed_ids = [self.studies[0].pubmed_id, '1']
+        report = run_report.RunReport()
+        out_files = pubmed_id_to_hca_publication.create_publication_spreadsheets(
+            pubmed_ids, self.output_dir, DEFAULT_HCA_TEMPLATE, report=report)
+        self.assertEqual([(entry.accession, entry.status, entry.out_file) for entry in report.accessions],
+                         [(pubmed_ids[0], 'done', out_files[0]), ('1', 'failed', '')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import csv
+import os
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.synthetic import SyntheticStudy
+from geo_to_hca import config, geo_to_hca
+from geo_to_hca.utils import run_report
+from tests.stub_test_case import StubTestCase
+
+
+class RunReportTest(StubTestCase):
+
+    def setUp(self):
+        self.studies = [SyntheticStudy(6, study_number=1), SyntheticStudy(6, study_number=2, ena_mirrored=False)]
+        self.stub = self.start_stub(self.studies)
+        self.output_dir = self.temporary_dir()
+
+    def read_report(self):
+        with open(os.path.join(self.output_dir, run_report.REPORT_FILE_NAME), newline='') as report_file:
+            return list(csv.DictReader(report_file, delimiter='\t'))
+
+    def test_report_of_each_accession(self):
+        geo_to_hca.create_spreadsheet_using_accessions([study.geo_accession for study in self.studies],
+                                                       self.output_dir)
+        report = self.read_report()
+        self.assertEqual([row['accession'] for row in report], [study.geo_accession for study in self.studies])
+        self.assertEqual([row['status'] for row in report], ['done', 'done'])
+        self.assertEqual([row['fastq_source'] for row in report], ['ENA', 'SRA'])
+        self.assertTrue(os.path.exists(report[0]['out_file']))
+
+    def test_failed_accession_is_reported(self):
+        with self.assertRaises(Exception):
+            geo_to_hca.create_spreadsheet_using_accessions([self.studies[0].geo_accession, 'GSE999999999'],
+                                                           self.output_dir)
+        report = self.read_report()
+        self.assertEqual([row['status'] for row in report], ['done', 'failed'])
+        self.assertIn('GSE999999999', report[1]['error'])
+
+    def test_accession_past_its_deadline_is_reported_as_timed_out(self):
+        # ENA answers the file report of the first study long after its deadline
+        straggler = SyntheticStudy(6, study_number=3, ena_delay_seconds=10)
+        self.stub.server.studies.append(straggler)
+        self.addCleanup(setattr, config, 'ACCESSION_DEADLINE_SECONDS', config.ACCESSION_DEADLINE_SECONDS)
+        config.ACCESSION_DEADLINE_SECONDS = 4
+        start = time.perf_counter()
+        geo_to_hca.create_spreadsheet_using_accessions([straggler.geo_accession, self.studies[0].geo_accession],
+                                                       self.output_dir)
+        self.assertLess(time.perf_counter() - start, 10)
+        report = self.read_report()
+        self.assertEqual([row['status'] for row in report], ['timed out', 'done'])
+        self.assertLess(float(report[0]['seconds']), 6)
+        self.assertTrue(os.path.exists(report[1]['out_file']))
+
+    def test_file_written_in_the_background_is_timed_until_written(self):
+        self.set_config(BATCH_SCHEDULE='input', LARGE_STUDY_RUNS=0)
+        report = run_report.RunReport()
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            def process(accession):
+                if accession == 'GSE2':
+                    # the batch ends long after the file of GSE1 was written
+                    time.sleep(0.5)
+                    return 'GSE2.xlsx'
+                return writer.submit(lambda: 'GSE1.xlsx')
+
+            geo_to_hca.run_batch(['GSE1', 'GSE2'], process, report)
+        written = report.accessions[0]
+        self.assertEqual((written.accession, written.status, written.out_file), ('GSE1', 'done', 'GSE1.xlsx'))
+        self.assertLess(written.seconds, 0.4)
+
+    def test_no_report(self):
+        geo_to_hca.create_spreadsheet_using_accessions([self.studies[0].geo_accession], self.output_dir,
+                                                       output_log=False)
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, run_report.REPORT_FILE_NAME)))
+
+
+if __name__ == '__main__':
+    unittest.main()
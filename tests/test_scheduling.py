@@ -0,0 +1,74 @@
+import csv
+import os
+import unittest
+
+from benchmarks.synthetic import SyntheticStudy
+from geo_to_hca import config, geo_to_hca
+from geo_to_hca.utils import run_report, scheduling, sra_utils, transport
+from tests.stub_test_case import StubTestCase
+
+
+class OrderTest(unittest.TestCase):
+    sizes = {'GSE1': 500, 'GSE2': 20, 'GSE3': None, 'GSE4': 20, 'GSE5': 60000}
+
+    def test_smallest_first_with_unknown_sizes_last(self):
+        self.assertEqual(scheduling.order(list(self.sizes), self.sizes, 'smallest'),
+                         ['GSE2', 'GSE4', 'GSE1', 'GSE5', 'GSE3'])
+
+    def test_largest_first(self):
+        self.assertEqual(scheduling.order(list(self.sizes), self.sizes, 'largest'),
+                         ['GSE5', 'GSE1', 'GSE2', 'GSE4', 'GSE3'])
+
+    def test_input_order(self):
+        self.assertEqual(scheduling.order(list(self.sizes), self.sizes, 'input'), list(self.sizes))
+
+    def test_large_studies_on_their_own_lane(self):
+        small, large = scheduling.plan(list(self.sizes), self.sizes.get, 'smallest', large_study_runs=10000)
+        self.assertEqual(small, ['GSE2', 'GSE4', 'GSE1', 'GSE3'])
+        self.assertEqual(large, ['GSE5'])
+
+    def test_single_accession_is_not_probed(self):
+        self.assertEqual(scheduling.plan(['GSE1'], None), (['GSE1'], []))
+
+
+class BatchScheduleTest(StubTestCase):
+
+    def setUp(self):
+        self.large = SyntheticStudy(60, study_number=1)
+        self.small = [SyntheticStudy(4, study_number=2), SyntheticStudy(8, study_number=3)]
+        self.stub = self.start_stub([self.large, *self.small])
+        self.reset_modules(transport)
+        self.output_dir = self.temporary_dir()
+        self.accessions = [self.large.geo_accession, self.small[1].geo_accession, self.small[0].geo_accession]
+
+    def test_sizes_probed_from_the_runs_of_the_experiments(self):
+        # an esearch of the large study counts its 30 experiments, of 2 runs each
+        self.assertEqual(sra_utils.get_study_size(self.large.srp_accession), 60)
+        small, large = scheduling.plan(self.accessions, geo_to_hca.estimate_accession_size, 'smallest',
+                                       large_study_runs=50)
+        self.assertEqual(small, [self.small[0].geo_accession, self.small[1].geo_accession])
+        self.assertEqual(large, [self.large.geo_accession])
+
+    def run_batch(self, large_study_runs: int) -> [{}]:
+        self.addCleanup(setattr, config, 'LARGE_STUDY_RUNS', config.LARGE_STUDY_RUNS)
+        config.LARGE_STUDY_RUNS = large_study_runs
+        geo_to_hca.create_spreadsheet_using_accessions(self.accessions, self.output_dir)
+        with open(os.path.join(self.output_dir, run_report.REPORT_FILE_NAME), newline='') as report_file:
+            return list(csv.DictReader(report_file, delimiter='\t'))
+
+    def test_small_studies_processed_first(self):
+        report = self.run_batch(0)
+        self.assertEqual([row['accession'] for row in report],
+                         [self.small[0].geo_accession, self.small[1].geo_accession, self.large.geo_accession])
+        self.assertEqual({row['status'] for row in report}, {'done'})
+
+    def test_large_study_lane(self):
+        report = self.run_batch(50)
+        self.assertEqual(sorted(row['accession'] for row in report), sorted(self.accessions))
+        self.assertEqual({row['status'] for row in report}, {'done'})
+        self.assertLess([row['accession'] for row in report].index(self.small[0].geo_accession),
+                        [row['accession'] for row in report].index(self.small[1].geo_accession))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+import time
+import unittest
+from io import BytesIO
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from openpyxl import load_workbook
+
+from benchmarks.synthetic import SyntheticStudy
+from geo_to_hca import service
+from geo_to_hca.cli import DEFAULT_HCA_TEMPLATE
+from geo_to_hca.utils import deadline, transport
+from tests.stub_test_case import StubTestCase
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_calls_are_spaced_across_threads(self):
+        limiter = transport.RateLimiter(rate=20)
+        start = time.monotonic()
+        threads = [threading.Thread(target=limiter.wait) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertGreaterEqual(time.monotonic() - start, 5 / 20 - 0.01)
+        self.assertEqual(limiter.calls, 6)
+
+
+class TemplatePoolTest(unittest.TestCase):
+
+    def test_template_which_cannot_be_loaded(self):
+        with self.assertRaises(FileNotFoundError):
+            service.TemplatePool('missing_template.xlsx')
+        pool = service.TemplatePool(DEFAULT_HCA_TEMPLATE, size=1)
+        self.addCleanup(pool.shutdown)
+        pool.hca_template = 'missing_template.xlsx'
+        pool.take()
+        # the workbook taken is replaced by a load which fails
+        with self.assertRaises(FileNotFoundError):
+            pool.take()
+
+    def test_take_waits_until_the_deadline(self):
+        pool = service.TemplatePool(DEFAULT_HCA_TEMPLATE, size=1)
+        self.addCleanup(pool.shutdown)
+        pool._ready.get()
+        with deadline.scope(0.2), self.assertRaises(deadline.DeadlineExceeded):
+            pool.take()
+
+
+class ServiceTest(StubTestCase):
+
+    def setUp(self):
+        self.study = SyntheticStudy(20)
+        self.stub = self.start_stub([self.study])
+        self.output_dir = self.temporary_dir()
+        self.service = service.ConversionService(self.output_dir, workers=2)
+        self.addCleanup(self.service.shutdown)
+        self.server = service.ServiceHTTPServer(('127.0.0.1', 0), self.service)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def request(self, path, payload=None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        with urlopen(Request(self.base_url + path, data=data)) as response:
+            return response.status, response.read()
+
+    def wait_for(self, job_id):
+        for _ in range(300):
+            _, body = self.request(f'/jobs/{job_id}')
+            job = json.loads(body)
+            if job['status'] in ('done', 'failed'):
+                return job
+            time.sleep(0.1)
+        self.fail(f'job {job_id} did not finish')
+
+    def test_job_result_can_be_downloaded(self):
+        status, body = self.request('/jobs', {'accession': self.study.geo_accession})
+        self.assertEqual(status, 202)
+        job = self.wait_for(json.loads(body)['id'])
+        self.assertEqual(job['status'], 'done', job['error'])
+        # the template was loaded by the template pool, not in the job
+        self.assertLess(job['stages']['load_template']['seconds'], 0.01)
+
+        status, content = self.request(f"/jobs/{job['id']}/result")
+        self.assertEqual(status, 200)
+        workbook = load_workbook(BytesIO(content), read_only=True)
+        sequence_files = [row for row in workbook['Sequence file'].iter_rows(min_row=6, values_only=True) if row[0]]
+        self.assertEqual(len(sequence_files), 3 * self.study.n_runs)
+
+    def test_second_job_uses_warm_caches(self):
+        _, body = self.request('/jobs', {'accession': self.study.geo_accession})
+        self.assertEqual(self.wait_for(json.loads(body)['id'])['status'], 'done')
+        first_requests = sum(self.stub.request_counts.values())
+        _, body = self.request('/jobs', {'accession': self.study.geo_accession})
+        self.assertEqual(self.wait_for(json.loads(body)['id'])['status'], 'done')
+        second_requests = sum(self.stub.request_counts.values()) - first_requests
+        self.assertLess(second_requests, first_requests)
+        _, body = self.request('/stats')
+        self.assertGreater(json.loads(body)['response_cache']['hits'], 0)
+
+    def test_finished_jobs_are_evicted(self):
+        self.service.max_finished_jobs = 1
+        job_ids = []
+        for _ in range(2):
+            _, body = self.request('/jobs', {'accession': self.study.geo_accession})
+            job_ids.append(json.loads(body)['id'])
+            self.assertEqual(self.wait_for(job_ids[-1])['status'], 'done')
+        # the first job is evicted once the second one finished, just after its status is set
+        for _ in range(50):
+            if json.loads(self.request('/stats')[1])['evicted_jobs']:
+                break
+            time.sleep(0.1)
+        with self.assertRaises(HTTPError) as error:
+            self.request(f'/jobs/{job_ids[0]}/result')
+        self.assertEqual(error.exception.code, 404)
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, job_ids[0])))
+        self.assertEqual(self.request(f'/jobs/{job_ids[1]}/result')[0], 200)
+
+    def test_unknown_job_and_missing_accession(self):
+        with self.assertRaises(HTTPError) as error:
+            self.request('/jobs/0123abcd')
+        self.assertEqual(error.exception.code, 404)
+        with self.assertRaises(HTTPError) as error:
+            self.request('/jobs', {})
+        self.assertEqual(error.exception.code, 400)
+
+    def test_invalid_accessions_are_rejected(self):
+        for accession in ('../GSE1', 'GSE1/x', 'GSE1"', 'GSE1\r\nSet-Cookie: x', 'SRR1', 'GSE'):
+            with self.subTest(accession=accession):
+                with self.assertRaises(HTTPError) as error:
+                    self.request('/jobs', {'accession': accession})
+                self.assertEqual(error.exception.code, 400)
+        self.assertEqual(self.service.jobs(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import csv
+import os
+import unittest
+
+from benchmarks.synthetic import SyntheticStudy
+from geo_to_hca import config, geo_to_hca
+from geo_to_hca.utils import run_report
+from tests.test_large_study import read_rows
+from tests.stub_test_case import StubTestCase
+
+
+class SpreadsheetWriterTest(StubTestCase):
+
+    def setUp(self):
+        self.studies = [SyntheticStudy(20, study_number=number) for number in (1, 2, 3)]
+        self.accessions = [study.geo_accession for study in self.studies]
+        self.stub = self.start_stub(self.studies)
+        self.output_dir = self.temporary_dir()
+        self.set_config(WRITER_PROCESSES=config.WRITER_PROCESSES, BATCH_SCHEDULE='input')
+
+    def convert(self, output_dir, writer_processes):
+        config.WRITER_PROCESSES = writer_processes
+        os.makedirs(output_dir, exist_ok=True)
+        geo_to_hca.create_spreadsheet_using_accessions(self.accessions, output_dir)
+        with open(os.path.join(output_dir, run_report.REPORT_FILE_NAME), newline='') as report_file:
+            return list(csv.DictReader(report_file, delimiter='\t'))
+
+    def test_written_by_writer_processes_as_saved_in_turn(self):
+        in_turn_dir = os.path.join(self.output_dir, 'in_turn')
+        pipelined_dir = os.path.join(self.output_dir, 'pipelined')
+        self.convert(in_turn_dir, 0)
+        report = self.convert(pipelined_dir, 2)
+        self.assertEqual([row['accession'] for row in report], self.accessions)
+        self.assertEqual([row['status'] for row in report], ['done'] * 3)
+        for accession in self.accessions:
+            self.assertEqual(read_rows(os.path.join(pipelined_dir, f'{accession}.xlsx')),
+                             read_rows(os.path.join(in_turn_dir, f'{accession}.xlsx')))
+
+    def test_write_failure_is_reported(self):
+        # the spreadsheet of the second accession cannot be saved over a directory
+        os.makedirs(os.path.join(self.output_dir, f'{self.accessions[1]}.xlsx'))
+        with self.assertRaises(Exception):
+            self.convert(self.output_dir, 1)
+        with open(os.path.join(self.output_dir, run_report.REPORT_FILE_NAME), newline='') as report_file:
+            report = list(csv.DictReader(report_file, delimiter='\t'))
+        self.assertEqual([row['status'] for row in report], ['done', 'failed', 'done'])
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, f'{self.accessions[2]}.xlsx')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import unittest
+from unittest.mock import patch
+
+from benchmarks.synthetic import SyntheticStudy, SyntheticSuperSeries
+from geo_to_hca import geo_to_hca
+from geo_to_hca import large_study
+from geo_to_hca.utils import negative_cache, sra_utils, transport
+from tests.test_large_study import read_rows
+from tests.stub_test_case import StubTestCase
+
+
+class SuperSeriesTest(StubTestCase):
+
+    def setUp(self):
+        self.studies = [SyntheticStudy(6, study_number=1), SyntheticStudy(8, study_number=2)]
+        self.superseries = SyntheticSuperSeries(self.studies)
+        self.stub = self.start_stub(self.studies, superseries=[self.superseries])
+        self.output_dir = self.temporary_dir()
+
+    def spreadsheet_rows(self, accession):
+        out_file = os.path.join(self.output_dir, f'{accession}.xlsx')
+        geo_to_hca.create_spreadsheet_using_accession(accession).save(out_file)
+        return read_rows(out_file)
+
+    def test_superseries_expanded_into_the_studies_of_its_subseries(self):
+        self.assertEqual(sra_utils.get_srp_accessions_from_geo(self.superseries.geo_accession),
+                         [study.srp_accession for study in self.studies])
+        self.assertEqual(sra_utils.get_srp_accession_from_geo(self.studies[1].geo_accession),
+                         self.studies[1].srp_accession)
+
+    def test_superseries_not_recorded_without_study_when_a_subseries_lookup_fails(self):
+        self.set_env(CACHE_DIR=self.temporary_dir())
+        self.reset_modules(transport)
+        find_related_objects = sra_utils.find_related_objects
+
+        def unreachable_subseries(summary_id, accession_type):
+            if summary_id != self.superseries.gds_id:
+                raise ConnectionError('connection reset')
+            return find_related_objects(summary_id, accession_type=accession_type)
+
+        with patch.object(sra_utils, 'find_related_objects', side_effect=unreachable_subseries):
+            with self.assertRaisesRegex(Exception, 'connection reset'):
+                sra_utils.get_srp_accessions_from_geo(self.superseries.geo_accession)
+        self.assertIsNone(negative_cache.known_failure(negative_cache.GEO_WITHOUT_SRA_STUDY,
+                                                       self.superseries.geo_accession))
+
+    def test_studies_merged_into_one_workbook(self):
+        rows = self.spreadsheet_rows(self.superseries.geo_accession)
+        subseries_rows = [self.spreadsheet_rows(study.geo_accession) for study in self.studies]
+        for tab in ('Sequence file', 'Cell suspension', 'Specimen from organism'):
+            with self.subTest(tab=tab):
+                self.assertCountEqual(rows[tab], [row for study_rows in subseries_rows for row in study_rows[tab]])
+        self.assertEqual(len(rows['Library preparation protocol']), 1)
+
+    def test_large_study_mode_writes_the_same_rows(self):
+        expected = self.spreadsheet_rows(self.superseries.geo_accession)
+        chunked_dir = os.path.join(self.output_dir, 'chunked')
+        os.mkdir(chunked_dir)
+        actual = read_rows(large_study.create_spreadsheet_in_chunks(self.superseries.geo_accession, chunked_dir,
+                                                                    chunk_size=5))
+        for tab in ('Sequence file', 'Cell suspension', 'Specimen from organism', 'Library preparation protocol'):
+            with self.subTest(tab=tab):
+                self.assertCountEqual(actual[tab], expected[tab])
+
+
+if __name__ == '__main__':
+    unittest.main()
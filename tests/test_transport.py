@@ -0,0 +1,66 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.synthetic import SyntheticStudy
+from geo_to_hca import config
+from geo_to_hca.utils import transport
+from geo_to_hca.utils.transport import ConcurrencyLimiter
+from tests.stub_test_case import StubTestCase
+
+
+class ConcurrencyLimiterTest(unittest.TestCase):
+
+    def test_additive_increase_on_success(self):
+        limiter = ConcurrencyLimiter('host', initial=2, min_limit=1, max_limit=4, latency_tolerance=2.0)
+        for _ in range(10):
+            limiter.acquire()
+            limiter.release(200, 0.1, '/esearch.fcgi')
+        self.assertEqual(limiter.stats()['limit'], 4)
+        self.assertEqual(limiter.stats()['decreases'], 0)
+
+    def test_multiplicative_decrease_on_throttling(self):
+        limiter = ConcurrencyLimiter('host', initial=8, min_limit=1, max_limit=10, latency_tolerance=2.0)
+        limiter.acquire()
+        limiter.release(429)
+        self.assertEqual(limiter.stats()['limit'], 4)
+        limiter.acquire()
+        limiter.release(503)
+        self.assertEqual(limiter.stats()['limit'], 2)
+        self.assertEqual(limiter.stats()['throttled'], 2)
+
+    def test_decrease_on_rising_latency(self):
+        limiter = ConcurrencyLimiter('host', initial=4, min_limit=1, max_limit=4, latency_tolerance=2.0)
+        for _ in range(20):
+            limiter.acquire()
+            limiter.release(200, 0.01, '/efetch.fcgi')
+        for _ in range(5):
+            limiter.acquire()
+            limiter.release(200, 1.0, '/efetch.fcgi')
+        stats = limiter.stats()
+        self.assertLess(stats['limit'], 4)
+        latency = stats['latencies']['/efetch.fcgi']
+        self.assertGreater(latency['current'], 2 * latency['usual'])
+
+
+class AdaptiveConcurrencyTest(StubTestCase):
+
+    def setUp(self):
+        self.study = SyntheticStudy(20)
+        self.stub = self.start_stub([self.study], capacity=2, latency_seconds=0.05)
+        self.reset_modules(transport)
+
+    def test_limit_adapts_to_the_capacity_of_the_host(self):
+        url = f'{config.ENA_PORTAL_API_URL}/filereport'
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(
+                lambda _: transport.get(url, params={'accession': self.study.srp_accession, 'result': 'read_run'}),
+                range(40)))
+        self.assertEqual({response.status_code for response in responses}, {200})
+        self.assertGreater(self.stub.request_counts['throttled'], 0)
+        host_stats = transport.stats()['concurrency'][url.split('/')[2]]
+        self.assertGreater(host_stats['decreases'], 0)
+        self.assertLessEqual(host_stats['limit'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()